@@ -0,0 +1,83 @@
+"""
+Color correction factors from instrument passbands.
+"""
+import numpy as np
+
+from uvcombine.uvcombine import color_correction_factors
+
+from .common import IMAGE_SIZES, TIMEOUT, passband
+
+
+class ColorCorrectionFactors(object):
+    """
+    A SPIRE 500 micron-like high resolution band against a Planck 353
+    GHz-like low resolution band, sampled at ``nsamples`` wavelengths, for
+    ``nalpha`` spectral indices.
+    """
+    params = ([100, 1000, 10000], [1, 1000])
+    param_names = ['nsamples', 'nalpha']
+
+    def setup(self, nsamples, nalpha):
+        self.pb_hi = passband(500., 160., nsamples)
+        self.pb_lo = passband(850., 280., nsamples)
+        self.alpha = 3.5 if nalpha == 1 else np.linspace(1, 4, nalpha)
+
+    def time_color_correction_factors(self, nsamples, nalpha):
+        color_correction_factors(600., 353., self.pb_hi, self.pb_lo,
+                                 self.alpha)
+
+    def peakmem_color_correction_factors(self, nsamples, nalpha):
+        color_correction_factors(600., 353., self.pb_hi, self.pb_lo,
+                                 self.alpha)
+
+
+class FilterLookup(object):
+    """
+    Loading a Planck HFI passband (~13k points) from its text file, from
+    the binary cache of a new registry, and from a warm registry.
+    """
+
+    def setup(self):
+        import tempfile
+        from uvcombine.filters import FilterRegistry
+        self.cachedir = tempfile.mkdtemp()
+        FilterRegistry(cachedir=self.cachedir).get('HFI_353')
+        self.registry = FilterRegistry(cachedir=self.cachedir)
+        self.registry.get('HFI_353')
+
+    def teardown(self):
+        import shutil
+        shutil.rmtree(self.cachedir)
+
+    def time_parse_text(self):
+        from uvcombine.filters import FilterRegistry
+        FilterRegistry(cachedir=False).get('HFI_353')
+
+    def time_load_cached(self):
+        from uvcombine.filters import FilterRegistry
+        FilterRegistry(cachedir=self.cachedir).get('HFI_353')
+
+    def time_lookup(self):
+        self.registry.get('HFI_353')
+
+
+class ColorCorrectionMap(object):
+    """
+    Per-pixel color correction factors of a ``size`` x ``size`` spectral
+    index map, from a lookup table.
+    """
+    params = IMAGE_SIZES
+    param_names = ['size']
+    timeout = TIMEOUT
+
+    def setup(self, size):
+        from uvcombine.uvcombine import ColorCorrectionTable
+        self.table = ColorCorrectionTable.from_passbands(
+            600., 353., passband(500., 160.), passband(850., 280.))
+        self.alpha = np.random.RandomState(0).uniform(1, 4, (size, size))
+
+    def time_color_correction_map(self, size):
+        self.table(self.alpha)
+
+    def peakmem_color_correction_map(self, size):
+        self.table(self.alpha)
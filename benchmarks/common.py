@@ -0,0 +1,99 @@
+"""
+Synthetic inputs shared by the benchmarks.
+"""
+import numpy as np
+from astropy.io import fits
+import scipy.ndimage
+
+#: The image sizes (pixels on a side) of the image benchmarks
+IMAGE_SIZES = [512, 2048, 8192]
+
+#: The numbers of channels of the cube benchmarks
+CHANNELS = [100, 500, 2000]
+
+#: Benchmarks of the largest sizes take minutes
+TIMEOUT = 600
+
+
+def image_header(nax1, nax2, pixscale=1/3600.):
+    """
+    A celestial header for a ``nax2`` x ``nax1`` image with square pixels of
+    ``pixscale`` degrees.
+    """
+    header = fits.Header()
+    header['NAXIS'] = 2
+    header['NAXIS1'] = nax1
+    header['NAXIS2'] = nax2
+    header['CTYPE1'] = 'RA---TAN'
+    header['CTYPE2'] = 'DEC--TAN'
+    header['CRPIX1'] = (nax1+1)/2.
+    header['CRPIX2'] = (nax2+1)/2.
+    header['CRVAL1'] = 10.
+    header['CRVAL2'] = 20.
+    header['CDELT1'] = -pixscale
+    header['CDELT2'] = pixscale
+    header['CUNIT1'] = 'deg'
+    header['CUNIT2'] = 'deg'
+    return header
+
+
+def image_pair(size, ratio=4, lowresfwhm_pix=8, seed=0):
+    """
+    A high resolution image of ``size`` x ``size`` pixels and a low resolution
+    image covering the same field with pixels ``ratio`` times larger, made by
+    smoothing the high resolution image with a gaussian of FWHM
+    ``lowresfwhm_pix`` pixels.
+    """
+    rs = np.random.RandomState(seed)
+    im_hi = scipy.ndimage.gaussian_filter(rs.standard_normal((size, size)), 1)
+    sigma = lowresfwhm_pix / np.sqrt(8*np.log(2))
+    im_lo = scipy.ndimage.gaussian_filter(im_hi, sigma)[::ratio, ::ratio]
+
+    hdu_hi = fits.PrimaryHDU(data=im_hi, header=image_header(size, size))
+    hdu_lo = fits.PrimaryHDU(data=np.ascontiguousarray(im_lo),
+                             header=image_header(size//ratio, size//ratio,
+                                                 pixscale=ratio/3600.))
+    return hdu_hi, hdu_lo
+
+
+def cube_header(nax1, nax2, nchan, pixscale=1/3600., restfreq=1e11,
+                chanwidth=1e6):
+    """
+    A header for a cube of ``nchan`` frequency channels of ``chanwidth`` Hz
+    with the celestial axes of `image_header`.
+    """
+    header = image_header(nax1, nax2, pixscale=pixscale)
+    header['NAXIS'] = 3
+    header['NAXIS3'] = nchan
+    header['CTYPE3'] = 'FREQ'
+    header['CRPIX3'] = 1
+    header['CRVAL3'] = restfreq
+    header['CDELT3'] = chanwidth
+    header['CUNIT3'] = 'Hz'
+    header['BUNIT'] = 'K'
+    return header
+
+
+def spectral_cube(nchan, size=64, seed=0):
+    """
+    A `~spectral_cube.SpectralCube` of ``nchan`` channels of ``size`` x
+    ``size`` pixels of noise.
+    """
+    from spectral_cube import SpectralCube
+    rs = np.random.RandomState(seed)
+    data = rs.standard_normal((nchan, size, size))
+    return SpectralCube.read(fits.PrimaryHDU(data=data,
+                                             header=cube_header(size, size,
+                                                                nchan)))
+
+
+def passband(center, width, nsamples=1000):
+    """
+    A gaussian passband ``(wavelength, response)`` centered on ``center``
+    microns with a FWHM of ``width`` microns, sampled in ``nsamples``
+    points, in the format of the curves in ``uvcombine/data/filter/``.
+    """
+    wavelength = np.linspace(center - 2*width, center + 2*width, nsamples)
+    sigma = width / np.sqrt(8*np.log(2))
+    response = np.exp(-0.5*((wavelength - center)/sigma)**2)
+    return wavelength, response
@@ -0,0 +1,68 @@
+"""
+Feathering: weight kernels, the Fourier-space merge and the full
+feather_simple pipeline.
+"""
+import numpy as np
+from astropy import units as u
+
+from uvcombine.uvcombine import feather_kernel, fftmerge, feather_simple
+
+from .common import IMAGE_SIZES, TIMEOUT, image_pair
+
+LOWRESFWHM = 8*u.arcsec
+PIXSCALE = 1/3600.
+
+
+class FeatherKernel(object):
+    params = (IMAGE_SIZES, ['fft', 'analytic'], [False, True])
+    param_names = ['size', 'method', 'rfft']
+    timeout = TIMEOUT
+
+    def time_feather_kernel(self, size, method, rfft):
+        feather_kernel(size, size, LOWRESFWHM, PIXSCALE, rfft=rfft,
+                       method=method, cache=False)
+
+    def peakmem_feather_kernel(self, size, method, rfft):
+        feather_kernel(size, size, LOWRESFWHM, PIXSCALE, rfft=rfft,
+                       method=method, cache=False)
+
+
+class FFTMerge(object):
+    params = (IMAGE_SIZES, [False, True])
+    param_names = ['size', 'rfft']
+    timeout = TIMEOUT
+
+    def setup(self, size, rfft):
+        rs = np.random.RandomState(0)
+        self.im_hi = rs.standard_normal((size, size))
+        self.im_lo = rs.standard_normal((size, size))
+        self.kfft, self.ikfft = feather_kernel(size, size, LOWRESFWHM,
+                                               PIXSCALE, rfft=rfft,
+                                               method='analytic',
+                                               cache=False)
+
+    def time_fftmerge(self, size, rfft):
+        fftmerge(self.kfft, self.ikfft, self.im_hi, self.im_lo, rfft=rfft)
+
+    def peakmem_fftmerge(self, size, rfft):
+        fftmerge(self.kfft, self.ikfft, self.im_hi, self.im_lo, rfft=rfft)
+
+
+class FeatherSimple(object):
+    """
+    The whole pipeline, including the regridding and (uncached) kernels.
+    """
+    params = (IMAGE_SIZES, [False, True])
+    param_names = ['size', 'rfft']
+    timeout = TIMEOUT
+
+    def setup(self, size, rfft):
+        self.hires, self.lores = image_pair(size)
+
+    def time_feather_simple(self, size, rfft):
+        feather_simple(self.hires, self.lores, lowresfwhm=LOWRESFWHM,
+                       rfft=rfft, kernel_cache=False)
+
+    def peakmem_feather_simple(self, size, rfft):
+        feather_simple(self.hires, self.lores, lowresfwhm=LOWRESFWHM,
+                       rfft=rfft, kernel_cache=False)
@@ -0,0 +1,31 @@
+"""
+The cost of importing uvcombine, which should not include its heavy optional
+dependencies.
+"""
+import sys
+import subprocess
+
+HEAVY_MODULES = ('spectral_cube', 'FITS_tools', 'image_tools',
+                 'astropy.convolution', 'astropy.utils.console',
+                 'astropy.wcs', 'scipy.ndimage')
+
+
+def timeraw_import_uvcombine():
+    # run by asv in a fresh interpreter
+    return "import uvcombine"
+
+
+def timeraw_import_cli():
+    return "import uvcombine.cli"
+
+
+def track_heavy_modules_imported():
+    """
+    The number of heavy dependencies loaded by ``import uvcombine``.
+    """
+    code = ("import sys, uvcombine; "
+            "print(sum(name in sys.modules for name in {0!r}))"
+            .format(HEAVY_MODULES))
+    return int(subprocess.check_output([sys.executable, '-c', code]))
+
+track_heavy_modules_imported.unit = 'modules'
@@ -0,0 +1,53 @@
+"""
+Single versus double precision feathering.
+"""
+import numpy as np
+from astropy import units as u
+
+from uvcombine.uvcombine import feather_simple
+
+from .common import image_pair
+
+LOWRESFWHM = 8*u.arcsec
+
+
+class FeatherPrecision(object):
+    params = ([512, 2048], ['float64', 'float32'])
+    param_names = ['size', 'dtype']
+
+    def setup(self, size, dtype):
+        self.hires, self.lores = image_pair(size)
+        # build and cache the kernels outside of the timing
+        feather_simple(self.hires, self.lores, lowresfwhm=LOWRESFWHM,
+                       rfft=True, dtype=dtype, kernel_cache=True)
+
+    def time_feather_simple(self, size, dtype):
+        feather_simple(self.hires, self.lores, lowresfwhm=LOWRESFWHM,
+                       rfft=True, dtype=dtype, kernel_cache=True)
+
+    def peakmem_feather_simple(self, size, dtype):
+        feather_simple(self.hires, self.lores, lowresfwhm=LOWRESFWHM,
+                       rfft=True, dtype=dtype, kernel_cache=True)
+
+
+class Float32Accuracy(object):
+    """
+    The error of the single precision path relative to the double precision
+    path, as a fraction of the peak of the combined image.
+    """
+    params = ([512, 2048], [False, True])
+    param_names = ['size', 'rfft']
+
+    def setup(self, size, rfft):
+        self.hires, self.lores = image_pair(size)
+
+    def track_max_relative_error(self, size, rfft):
+        combo64 = feather_simple(self.hires, self.lores,
+                                 lowresfwhm=LOWRESFWHM, rfft=rfft,
+                                 kernel_cache=False).real
+        combo32 = feather_simple(self.hires, self.lores,
+                                 lowresfwhm=LOWRESFWHM, rfft=rfft,
+                                 kernel_cache=False, dtype=np.float32).real
+        return float(np.abs(combo32 - combo64).max() / np.abs(combo64).max())
+
+    track_max_relative_error.unit = 'relative error'
@@ -0,0 +1,72 @@
+"""
+Spatial regridding of images and spectral regridding of cubes.
+"""
+import numpy as np
+from astropy import units as u
+
+from uvcombine.uvcombine import (regrid, PixelMapping, spectral_regrid,
+                                 spectral_smooth_and_downsample)
+
+from .common import IMAGE_SIZES, CHANNELS, TIMEOUT, image_pair, spectral_cube
+
+
+class Regrid(object):
+    """
+    Regridding the low resolution image onto the high resolution grid, with
+    FITS_tools (``mapping=False``) or a precomputed `PixelMapping`.
+    """
+    params = (IMAGE_SIZES, [False, True])
+    param_names = ['size', 'mapping']
+    timeout = TIMEOUT
+
+    def setup(self, size, mapping):
+        hires, lores = image_pair(size)
+        self.hd1, self.im1 = hires.header, hires.data
+        self.hd2, self.im2 = lores.header, lores.data
+        self.mapping = (PixelMapping.from_headers(self.hd2, self.hd1)
+                        if mapping else None)
+
+    def time_regrid(self, size, mapping):
+        regrid(self.hd1, self.im1, self.im2.copy(), self.hd2,
+               mapping=self.mapping)
+
+    def peakmem_regrid(self, size, mapping):
+        regrid(self.hd1, self.im1, self.im2.copy(), self.hd2,
+               mapping=self.mapping)
+
+
+class SpectralRegrid(object):
+    """
+    Regridding 128x128 pixel cubes onto a grid of 0.75 times as many
+    channels, in memory or in 32x32 pixel tiles.
+    """
+    params = (CHANNELS, [None, 32])
+    param_names = ['nchan', 'tile_size']
+    timeout = TIMEOUT
+
+    def setup(self, nchan, tile_size):
+        self.cube = spectral_cube(nchan, size=128)
+        axis = self.cube.spectral_axis.to(u.Hz)
+        self.outgrid = np.linspace(axis[0].value, axis[-1].value,
+                                   int(nchan*0.75)) * u.Hz
+
+    def time_spectral_regrid(self, nchan, tile_size):
+        spectral_regrid(self.cube, self.outgrid, tile_size=tile_size)
+
+    def peakmem_spectral_regrid(self, nchan, tile_size):
+        spectral_regrid(self.cube, self.outgrid, tile_size=tile_size)
+
+
+class SpectralSmoothDownsample(object):
+    params = (CHANNELS, [2, 8])
+    param_names = ['nchan', 'kernelwidth']
+    timeout = TIMEOUT
+
+    def setup(self, nchan, kernelwidth):
+        self.cube = spectral_cube(nchan, size=128)
+
+    def time_spectral_smooth_and_downsample(self, nchan, kernelwidth):
+        spectral_smooth_and_downsample(self.cube, kernelwidth)
+
+    def peakmem_spectral_smooth_and_downsample(self, nchan, kernelwidth):
+        spectral_smooth_and_downsample(self.cube, kernelwidth)
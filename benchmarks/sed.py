@@ -0,0 +1,68 @@
+"""
+Per-pixel spectral interpolation of multi-band maps.
+"""
+import numpy as np
+
+from uvcombine.uvcombine import spectral_index_interpolate
+
+from .common import IMAGE_SIZES, TIMEOUT
+
+#: SPIRE 250/350/500 micron frequencies (GHz)
+FREQUENCIES = [1199.169, 856.550, 599.585]
+
+
+def power_law_maps(size, frequencies, target_frequency, seed=0):
+    """ Maps at ``frequencies`` of random power laws """
+    rs = np.random.RandomState(seed)
+    alpha = rs.uniform(1, 4, (size, size))
+    flux = rs.uniform(1, 10, (size, size))
+    return [flux*(frequency/target_frequency)**alpha
+            for frequency in frequencies]
+
+
+class SpectralIndexInterpolate(object):
+    """
+    Interpolating ``nmaps`` maps to 353 GHz, by default in chunks of 2**20
+    pixels.
+    """
+    params = (IMAGE_SIZES, [2, 3])
+    param_names = ['size', 'nmaps']
+    timeout = TIMEOUT
+
+    def setup(self, size, nmaps):
+        self.frequencies = FREQUENCIES[:nmaps]
+        self.maps = power_law_maps(size, self.frequencies, 353.)
+
+    def time_spectral_index_interpolate(self, size, nmaps):
+        spectral_index_interpolate(self.maps, self.frequencies, 353.,
+                                   return_alpha=True)
+
+    def peakmem_spectral_index_interpolate(self, size, nmaps):
+        spectral_index_interpolate(self.maps, self.frequencies, 353.,
+                                   return_alpha=True)
+
+
+class SEDFit(object):
+    """
+    Per-pixel SED fits to PACS 160 and SPIRE 250/350/500 micron maps, with
+    color corrections from the filter curves.
+    """
+    params = ([512, 2048], ['powerlaw', 'mbb'])
+    param_names = ['size', 'model']
+    timeout = TIMEOUT
+
+    def setup(self, size, model):
+        from uvcombine.sedfit import band_frequencies, sed_interpolate
+        self.bands = ['PACS_red', 'SPIRE_PSW', 'SPIRE_PMW', 'SPIRE_PLW']
+        self.maps = power_law_maps(size, band_frequencies(self.bands), 353.)
+        # build the color correction tables outside of the timing
+        sed_interpolate([image[:1, :1] for image in self.maps], self.bands,
+                        353., model=model)
+
+    def time_sed_interpolate(self, size, model):
+        from uvcombine.sedfit import sed_interpolate
+        sed_interpolate(self.maps, self.bands, 353., model=model)
+
+    def peakmem_sed_interpolate(self, size, model):
+        from uvcombine.sedfit import sed_interpolate
+        sed_interpolate(self.maps, self.bands, 353., model=model)
@@ -12,4 +12,20 @@ from ._astropy_init import *
 
 # For egg_info test builds to pass, put package imports here.
 if not _ASTROPY_SETUP_:
-    from uvcombine import *
+    from .uvcombine import *
+
+    # The submodules with optional features and the heavy dependencies
+    # re-exported from uvcombine.uvcombine are imported on first access
+    # (PEP 562), so that importing the package stays fast.
+    _lazy_submodules = ('batch', 'cli', 'parallel', 'fft_backends', 'cache',
+                        'tracing', 'filters', 'sedfit')
+
+    def __getattr__(name):
+        import importlib
+        if name in _lazy_submodules:
+            return importlib.import_module('.' + name, __name__)
+        from . import uvcombine as _uvcombine
+        if name in _uvcombine._lazy_attributes:
+            return getattr(_uvcombine, name)
+        raise AttributeError("module {0!r} has no attribute {1!r}"
+                             .format(__name__, name))
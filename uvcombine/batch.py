@@ -0,0 +1,392 @@
+"""
+Batch feathering of many high/low resolution image pairs.
+
+A batch is described by a manifest: a list of fields, each naming a high and a
+low resolution image and where to write the combined image.  Fields that share
+an image shape, pixel scale and low resolution beam share their weight
+kernels, and fields that also share both WCSs share the reprojection of the
+low resolution image, so the per-field setup is only done once per group.  The
+groups are spread over a pool of processes.  A failing field is reported and
+skipped instead of stopping the batch.
+
+Example
+-------
+>>> results = feather_batch([dict(hires='f1_12m.fits', lores='f1_tp.fits'),
+...                          dict(hires='f2_12m.fits', lores='f2_tp.fits')],
+...                         outdir='feathered', lowresfwhm=30*u.arcsec,
+...                         nprocs=4)                     # doctest: +SKIP
+>>> [r['status'] for r in results]                        # doctest: +SKIP
+['ok', 'ok']
+"""
+import os
+import time
+import hashlib
+import shutil
+import tempfile
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from astropy.io import fits
+from astropy import units as u
+from astropy import log
+
+from .uvcombine import (PixelMapping, file_in, regrid, feather_kernel,
+                        fftmerge)
+from .parallel import _shared_input
+from .tracing import stage
+
+__all__ = ['feather_batch', 'read_manifest']
+
+#: Settings that may be given per field in the manifest, and their defaults
+_field_defaults = OrderedDict([('highresextnum', 0),
+                               ('lowresextnum', 0),
+                               ('highresscalefactor', 1.0),
+                               ('lowresscalefactor', 1.0),
+                               ('lowresfwhm', 1*u.arcmin)])
+
+
+def _manifest_fields(manifest, outdir, defaults):
+    """
+    Normalize the entries of a manifest into dictionaries with every setting
+    filled in.
+    """
+    fields = []
+    for ii, entry in enumerate(manifest):
+        if not isinstance(entry, dict):
+            entry = dict(zip(('hires', 'lores', 'outname'), entry))
+        field = dict(defaults)
+        field.update(entry)
+        if 'name' not in field:
+            if isinstance(field['hires'], str):
+                field['name'] = os.path.splitext(
+                    os.path.basename(field['hires']))[0]
+            else:
+                field['name'] = 'field{0}'.format(ii)
+        if field.get('outname') is None:
+            if outdir is None:
+                raise ValueError("Field {0} has no outname; give one in the "
+                                 "manifest or set outdir."
+                                 .format(field['name']))
+            field['outname'] = os.path.join(outdir,
+                                            field['name'] + '_feathered.fits')
+        field['lowresfwhm'] = u.Quantity(field['lowresfwhm'], u.arcsec)
+        field['index'] = ii
+        # the input filenames as given, for the report
+        field['inputs'] = tuple(data if isinstance(data, str) else None
+                                for data in (field['hires'], field['lores']))
+        fields.append(field)
+    return fields
+
+
+def _read_header(data, extnum):
+    if isinstance(data, str):
+        header = fits.getheader(data, extnum)
+    else:
+        header = data.header
+    import FITS_tools
+    return FITS_tools.strip_headers.flatten_header(header)
+
+
+def _wcs_string(header):
+    from astropy.wcs import WCS
+    return WCS(header).celestial.to_header_string()
+
+
+def _group_keys(field):
+    """
+    The keys of the setup ``field`` can share with other fields: the kernel
+    key (image shape, pixel scale and beam) and the mapping key (both grids).
+    """
+    header_hi = _read_header(field['hires'], field['highresextnum'])
+    header_low = _read_header(field['lores'], field['lowresextnum'])
+    shape_hi = (header_hi['NAXIS2'], header_hi['NAXIS1'])
+    shape_low = (header_low['NAXIS2'], header_low['NAXIS1'])
+    import FITS_tools
+    pixscale = FITS_tools.header_tools.header_to_platescale(header_hi)
+
+    kernel_key = (shape_hi, round(pixscale*3600, 9),
+                  round(field['lowresfwhm'].to(u.arcsec).value, 9))
+
+    sha = hashlib.sha1()
+    for item in (shape_hi, _wcs_string(header_hi), shape_low,
+                 _wcs_string(header_low)):
+        sha.update(str(item).encode())
+    return kernel_key, sha.hexdigest()
+
+
+def _result(field, status, time=0., error=None, tb=None):
+    return dict(index=field['index'], name=field['name'],
+                hires=field['inputs'][0], lores=field['inputs'][1],
+                outname=field['outname'], group=field.get('group'),
+                status=status, time=time, error=error, traceback=tb)
+
+
+def _feather_field(field, mappings, rfft, fft_backend, kernel_method, dtype,
+                   overwrite):
+    """
+    Feather a single field, reusing the low resolution mappings in
+    ``mappings`` (and the shared kernel cache).
+    """
+    with stage('file_in'):
+        hdu_hi, im_hi, header_hi = file_in(field['hires'],
+                                           field['highresextnum'])
+        hdu_low, im_lowraw, header_low = file_in(field['lores'],
+                                                 field['lowresextnum'])
+
+    with stage('regrid'):
+        mapping = mappings.get(field['mapping_key'])
+        if mapping is None:
+            mapping = PixelMapping.from_headers(header_low, header_hi)
+            mappings[field['mapping_key']] = mapping
+
+        hdu_low, im_low, nax1, nax2, pixscale = regrid(header_hi, im_hi,
+                                                       im_lowraw, header_low,
+                                                       mapping=mapping)
+
+    with stage('feather_kernel'):
+        kfft, ikfft = feather_kernel(nax2, nax1, field['lowresfwhm'],
+                                     pixscale, rfft=rfft,
+                                     fft_backend=fft_backend,
+                                     method=kernel_method, cache=True,
+                                     dtype=dtype)
+
+    with stage('fftmerge'):
+        fftsum, combo = fftmerge(kfft, ikfft, im_hi, im_low, rfft=rfft,
+                                 fft_backend=fft_backend, dtype=dtype,
+                                 highresscalefactor=field['highresscalefactor'],
+                                 lowresscalefactor=field['lowresscalefactor'])
+
+    with stage('outfits'):
+        outdir = os.path.dirname(field['outname'])
+        if outdir and not os.path.isdir(outdir):
+            os.makedirs(outdir)
+        fits.PrimaryHDU(data=np.asarray(combo.real, dtype=dtype),
+                        header=header_hi).writeto(field['outname'],
+                                                  overwrite=overwrite)
+
+
+def _feather_fields_task(fields, rfft, fft_backend, kernel_method, dtype,
+                         overwrite):
+    """
+    Feather a list of fields in turn, returning one result per field.
+    """
+    mappings = {}
+    results = []
+    for field in fields:
+        t0 = time.time()
+        try:
+            with stage('field', field=field['name']):
+                _feather_field(field, mappings, rfft, fft_backend,
+                               kernel_method, dtype, overwrite)
+        except Exception as ex:
+            results.append(_result(field, 'failed', time.time()-t0,
+                                   error=repr(ex),
+                                   tb=traceback.format_exc()))
+        else:
+            results.append(_result(field, 'ok', time.time()-t0))
+    return results
+
+
+def feather_batch(manifest, outdir=None, nprocs=None, chunksize=None,
+                  overwrite=False, rfft=True, fft_backend=None,
+                  kernel_method='fft', dtype=np.float64, tmpdir=None,
+                  **kwargs):
+    """
+    Feather every field of a manifest of high/low resolution image pairs.
+
+    Parameters
+    ----------
+    manifest : list
+        The fields to combine.  Each entry is either a ``(hires, lores)`` or
+        ``(hires, lores, outname)`` tuple or a dictionary with the keys
+        ``hires`` and ``lores`` (filenames or HDUs) and optionally
+        ``outname``, ``name``, ``highresextnum``, ``lowresextnum``,
+        ``highresscalefactor``, ``lowresscalefactor`` and ``lowresfwhm``,
+        which override the keyword arguments of the same names.
+    outdir : str or None
+        Where to write fields without an ``outname``, as
+        ``<name>_feathered.fits``.  The name defaults to the base name of the
+        high resolution file.
+    nprocs : int or None
+        Number of worker processes; defaults to the number of CPUs.  With
+        ``nprocs=1`` the fields are feathered in this process.
+    chunksize : int or None
+        The largest number of fields sent to a worker at once.  Fields are
+        only sent together if they share their setup.  Defaults to splitting
+        every group of fields over at most ``nprocs`` workers.
+    overwrite : bool
+        Overwrite existing output files?
+    rfft, fft_backend, kernel_method, dtype :
+        See `~uvcombine.uvcombine.feather_simple`.  ``fft_backend`` is sent
+        to the workers, so pass a registered name rather than an instance.
+    tmpdir : str or None
+        Where to write HDUs given in the manifest so that the workers can
+        read them; defaults to a new temporary directory that is removed
+        afterwards.
+    kwargs : dict
+        Defaults for the per-field settings (``highresextnum``,
+        ``lowresextnum``, ``highresscalefactor``, ``lowresscalefactor`` and
+        ``lowresfwhm``).
+
+    Returns
+    -------
+    results : list of dict
+        One entry per field, in manifest order, with the field ``name``,
+        ``hires``, ``lores`` and ``outname``, the setup ``group`` it was
+        feathered in, its ``status`` (``'ok'`` or ``'failed'``), the wall
+        ``time`` in seconds and, for failures, the ``error`` and its
+        ``traceback``.
+    """
+    unknown = set(kwargs) - set(_field_defaults)
+    if unknown:
+        raise TypeError("Unexpected keyword arguments: {0}"
+                        .format(sorted(unknown)))
+    defaults = dict(_field_defaults)
+    defaults.update(kwargs)
+
+    if nprocs is None:
+        nprocs = os.cpu_count()
+    dtype = np.dtype(dtype)
+
+    fields = _manifest_fields(manifest, outdir, defaults)
+    results = [None] * len(fields)
+
+    cleanup = tmpdir is None and nprocs > 1
+    if cleanup:
+        tmpdir = tempfile.mkdtemp(prefix='uvcombine')
+
+    try:
+        # group the fields by their shared setup; fields whose headers
+        # cannot be read fail here
+        groups = OrderedDict()
+        for field in fields:
+            try:
+                if nprocs > 1:
+                    # HDUs are written out for the workers to read
+                    for key, extkey in (('hires', 'highresextnum'),
+                                        ('lores', 'lowresextnum')):
+                        field[key], field[extkey] = _shared_input(
+                            field[key], field[extkey], tmpdir,
+                            '{0}{1}'.format(key, field['index']))
+                kernel_key, field['mapping_key'] = _group_keys(field)
+            except Exception as ex:
+                results[field['index']] = _result(field, 'failed',
+                                                  error=repr(ex),
+                                                  tb=traceback.format_exc())
+                continue
+            groups.setdefault(kernel_key, []).append(field)
+
+        tasks = []
+        for group, (key, members) in enumerate(groups.items()):
+            # fields sharing a mapping are kept together in the chunks
+            members.sort(key=lambda field: field['mapping_key'])
+            for field in members:
+                field['group'] = group
+            size = chunksize or max(1, -(-len(members) // nprocs))
+            tasks.extend(members[ii:ii+size]
+                         for ii in range(0, len(members), size))
+        log.debug("Feathering {0} fields in {1} groups as {2} tasks on {3} "
+                  "processes".format(len(fields), len(groups), len(tasks),
+                                     nprocs))
+
+        settings = (rfft, fft_backend, kernel_method, dtype, overwrite)
+        from astropy.utils.console import ProgressBar
+        pb = ProgressBar(len(tasks))
+        if nprocs == 1:
+            for task in tasks:
+                for result in _feather_fields_task(task, *settings):
+                    results[result['index']] = result
+                pb.update()
+        else:
+            with ProcessPoolExecutor(max_workers=nprocs) as executor:
+                futures = [executor.submit(_feather_fields_task, task,
+                                           *settings)
+                           for task in tasks]
+                for task, future in zip(tasks, futures):
+                    try:
+                        task_results = future.result()
+                    except Exception as ex:
+                        # the worker itself died; every field of the task
+                        # is lost
+                        task_results = [_result(field, 'failed',
+                                                error=repr(ex))
+                                        for field in task]
+                    for result in task_results:
+                        results[result['index']] = result
+                    pb.update()
+    finally:
+        if cleanup:
+            shutil.rmtree(tmpdir)
+
+    for result in results:
+        if result['status'] == 'failed':
+            log.warning("Feathering field {0} failed: {1}"
+                        .format(result['name'], result['error']))
+
+    return results
+
+
+def _manifest_value(key, value):
+    """
+    Convert a manifest setting given as a string (e.g. read from a CSV file)
+    to its proper type.
+    """
+    if not isinstance(value, str):
+        return value
+    if key in ('highresextnum', 'lowresextnum'):
+        return int(value)
+    if key in ('highresscalefactor', 'lowresscalefactor'):
+        return float(value)
+    if key == 'lowresfwhm':
+        try:
+            return float(value) * u.arcsec
+        except ValueError:
+            return u.Quantity(value)
+    return value
+
+
+def read_manifest(filename):
+    """
+    Read a manifest for `feather_batch` from a CSV or YAML file.
+
+    A CSV file has a header row naming its columns, which are the manifest
+    keys (``hires``, ``lores`` and optionally ``outname``, ``name``,
+    ``highresextnum``, ``lowresextnum``, ``highresscalefactor``,
+    ``lowresscalefactor`` and ``lowresfwhm``).  Empty cells are left out so
+    that the defaults apply.  A YAML file (``.yaml`` or ``.yml``; requires
+    PyYAML) holds a list of mappings with the same keys, or a mapping with
+    such a list under ``fields``.  ``lowresfwhm`` is a quantity string such
+    as ``30 arcsec`` or a number of arcseconds.
+
+    Returns
+    -------
+    manifest : list of dict
+    """
+    if filename.endswith(('.yaml', '.yml')):
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError("Reading YAML manifests requires PyYAML.")
+        with open(filename) as fh:
+            entries = yaml.safe_load(fh)
+        if isinstance(entries, dict):
+            entries = entries['fields']
+    else:
+        import csv
+        with open(filename) as fh:
+            entries = [dict((key.strip(), value.strip())
+                            for key, value in row.items()
+                            if key is not None and value and value.strip())
+                       for row in csv.DictReader(fh)]
+
+    manifest = []
+    for entry in entries:
+        for key in ('hires', 'lores'):
+            if key not in entry:
+                raise ValueError("Manifest entry {0} of {1} has no '{2}'."
+                                 .format(len(manifest)+1, filename, key))
+        manifest.append(dict((key, _manifest_value(key, value))
+                             for key, value in entry.items()))
+    return manifest
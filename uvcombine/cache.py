@@ -0,0 +1,242 @@
+"""
+Memoizing caches for intermediate products of the combination pipeline.
+"""
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+__all__ = ['ArrayCache', 'KernelCache', 'RegridCache', 'kernel_cache',
+           'regrid_cache', 'regrid_cache_key']
+
+
+class ArrayCache(object):
+    """
+    A least-recently-used in-memory cache of arrays with a byte budget.
+
+    Values are arrays or tuples of arrays.  The arrays are made read-only
+    when stored, since every caller receives the same objects; arrays too
+    large to be stored are left untouched.
+
+    Parameters
+    ----------
+    maxbytes : int
+        The total size of the cached arrays.  When adding an entry would
+        exceed it, the least recently used entries are evicted.  An entry
+        larger than ``maxbytes`` is never stored.
+    """
+
+    def __init__(self, maxbytes=512*1024**2):
+        self._maxbytes = int(maxbytes)
+        self._data = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _arrays(value):
+        return value if isinstance(value, tuple) else (value,)
+
+    def _sizeof(self, value):
+        return sum(arr.nbytes for arr in self._arrays(value))
+
+    @property
+    def maxbytes(self):
+        return self._maxbytes
+
+    @maxbytes.setter
+    def maxbytes(self, value):
+        with self._lock:
+            self._maxbytes = int(value)
+            self._evict()
+
+    @property
+    def nbytes(self):
+        """ The total size of the cached arrays """
+        return self._nbytes
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def _evict(self):
+        while self._nbytes > self._maxbytes and self._data:
+            _, value = self._data.popitem(last=False)
+            self._nbytes -= self._sizeof(value)
+            self.evictions += 1
+
+    def get(self, key):
+        """
+        Return the cached value for ``key`` (marking it most recently used),
+        or ``None`` if it is not cached.
+        """
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        Store ``value`` under ``key``, evicting old entries as needed.
+        """
+        size = self._sizeof(value)
+        with self._lock:
+            if key in self._data:
+                self._nbytes -= self._sizeof(self._data.pop(key))
+            if size > self._maxbytes:
+                return
+            for arr in self._arrays(value):
+                arr.flags.writeable = False
+            self._data[key] = value
+            self._nbytes += size
+            self._evict()
+
+    def clear(self):
+        """ Drop every entry and reset the statistics """
+        with self._lock:
+            self._data.clear()
+            self._nbytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """
+        Return a dictionary of the hit/miss/eviction counts and the current
+        size of the cache.
+        """
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses,
+                        evictions=self.evictions, entries=len(self._data),
+                        nbytes=self._nbytes, maxbytes=self._maxbytes)
+
+    def __repr__(self):
+        return ("<{name} entries={entries} nbytes={nbytes} "
+                "maxbytes={maxbytes} hits={hits} misses={misses} "
+                "evictions={evictions}>".format(name=type(self).__name__,
+                                                **self.stats()))
+
+
+class KernelCache(ArrayCache):
+    """
+    An `ArrayCache` of ``(kfft, ikfft)`` feather weight kernels, used by
+    `~uvcombine.uvcombine.feather_kernel`.
+    """
+
+
+def _default_cache_dir(name):
+    from astropy.config.paths import get_cache_dir
+    return os.path.join(get_cache_dir(), 'uvcombine', name)
+
+
+class RegridCache(ArrayCache):
+    """
+    A cache of regridded low resolution images, held in memory (as an
+    `ArrayCache`) and optionally mirrored on disk as ``.npy`` files so that
+    it persists across sessions and processes.
+
+    Parameters
+    ----------
+    maxbytes : int
+        The byte budget of the in-memory layer
+    cachedir : str, None or False
+        The directory of the on-disk layer; `None` uses ``uvcombine/regrid``
+        in the astropy cache directory.  The disk layer has no size limit,
+        so it is off (``False``) by default; it can be turned on later by
+        setting the `cachedir` attribute, and emptied with
+        ``clear(disk=True)``.
+    """
+
+    def __init__(self, maxbytes=512*1024**2, cachedir=False):
+        super(RegridCache, self).__init__(maxbytes=maxbytes)
+        self._cachedir = cachedir
+        self.disk_hits = 0
+
+    @property
+    def cachedir(self):
+        if self._cachedir is None:
+            self._cachedir = _default_cache_dir('regrid')
+        return self._cachedir
+
+    @cachedir.setter
+    def cachedir(self, value):
+        self._cachedir = value
+
+    def _filename(self, key):
+        return os.path.join(self.cachedir, key + '.npy')
+
+    def get(self, key):
+        value = super(RegridCache, self).get(key)
+        if value is not None or self._cachedir is False:
+            return value
+        filename = self._filename(key)
+        if not os.path.exists(filename):
+            return None
+        value = np.load(filename)
+        with self._lock:
+            # a disk hit counts as a hit rather than a miss
+            self.misses -= 1
+            self.hits += 1
+            self.disk_hits += 1
+        super(RegridCache, self).put(key, value)
+        return value
+
+    def put(self, key, value):
+        super(RegridCache, self).put(key, value)
+        if self._cachedir is False:
+            return
+        if not os.path.isdir(self.cachedir):
+            os.makedirs(self.cachedir)
+        filename = self._filename(key)
+        # write then rename so that concurrent readers never see a partial
+        # file
+        tmpname = '{0}.{1}.tmp.npy'.format(filename[:-4], os.getpid())
+        np.save(tmpname, value)
+        os.rename(tmpname, filename)
+
+    def clear(self, disk=False):
+        """
+        Drop every in-memory entry and reset the statistics; with
+        ``disk=True`` also delete the on-disk cache files.
+        """
+        super(RegridCache, self).clear()
+        self.disk_hits = 0
+        if disk and self._cachedir is not False and os.path.isdir(self.cachedir):
+            for filename in os.listdir(self.cachedir):
+                if filename.endswith('.npy'):
+                    os.remove(os.path.join(self.cachedir, filename))
+
+    def stats(self):
+        stats = super(RegridCache, self).stats()
+        stats['disk_hits'] = self.disk_hits
+        return stats
+
+
+def regrid_cache_key(image, header_from, header_to):
+    """
+    A content hash identifying the regridding of ``image`` (with header
+    ``header_from``) onto ``header_to``.
+    """
+    image = np.ascontiguousarray(image)
+    sha = hashlib.sha1()
+    sha.update(str((image.shape, image.dtype.str)).encode())
+    sha.update(image.view(np.uint8).ravel())
+    sha.update(header_from.tostring().encode())
+    sha.update(header_to.tostring().encode())
+    return sha.hexdigest()
+
+
+#: The cache used by `~uvcombine.uvcombine.feather_kernel` with ``cache=True``
+kernel_cache = KernelCache()
+
+#: The cache used by `~uvcombine.uvcombine.regrid` with ``cache=True``
+regrid_cache = RegridCache()
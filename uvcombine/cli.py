@@ -0,0 +1,320 @@
+"""
+The ``uvcombine`` command-line interface.
+
+Examples
+--------
+Feather a single pair of images::
+
+    uvcombine feather hires.fits lores.fits -o combined.fits \\
+        --lowresfwhm "30 arcsec"
+
+Feather every field of a manifest on 16 processes and record the timings::
+
+    uvcombine feather --manifest fields.csv --outdir feathered --jobs 16 \\
+        --lowresfwhm "30 arcsec" --timing timing.json
+
+Feather a pair of cubes within 8 GB per process::
+
+    uvcombine feather --mode cube hires.fits lores.fits -o combined.fits \\
+        --jobs 4 --max-memory "8 GB"
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+
+import numpy as np
+from astropy import units as u
+from astropy import log
+
+__all__ = ['main']
+
+
+def _quantity(unit):
+    """ An argparse type for quantities, with ``unit`` for bare numbers """
+    def parse(value):
+        try:
+            return float(value) * unit
+        except ValueError:
+            pass
+        try:
+            return u.Quantity(value).to(unit)
+        except (TypeError, ValueError, u.UnitsError) as ex:
+            raise argparse.ArgumentTypeError(str(ex))
+    return parse
+
+
+def _parser():
+    parser = argparse.ArgumentParser(
+        prog='uvcombine',
+        description="Fourier-space combination of images with different "
+                    "angular sensitivity.")
+    subparsers = parser.add_subparsers(dest='command')
+
+    feather = subparsers.add_parser(
+        'feather',
+        help="Combine high and low resolution images or cubes.",
+        description="Combine a pair of high and low resolution images (or "
+                    "cubes), or every pair of a manifest.")
+    feather.add_argument('hires', nargs='?',
+                         help="The high resolution FITS file")
+    feather.add_argument('lores', nargs='?',
+                         help="The low resolution (single-dish) FITS file")
+    feather.add_argument('-o', '--outname',
+                         help="The output FITS file of a single pair")
+    feather.add_argument('--manifest',
+                         help="A CSV or YAML manifest of pairs to combine "
+                              "(see uvcombine.batch.read_manifest)")
+    feather.add_argument('--outdir',
+                         help="Where to write manifest fields without an "
+                              "outname")
+    feather.add_argument('--mode', choices=['simple', 'akb', 'cube'],
+                         default='simple',
+                         help="feather_simple, AKB_combine or cube "
+                              "feathering (default: %(default)s)")
+    feather.add_argument('--lowresfwhm', type=_quantity(u.arcsec),
+                         default=1*u.arcmin,
+                         help="The FWHM of the low resolution beam, e.g. "
+                              "'30 arcsec'; bare numbers are arcseconds "
+                              "(default: 1 arcmin)")
+    feather.add_argument('--highresscalefactor', type=float, default=1.0)
+    feather.add_argument('--lowresscalefactor', type=float, default=1.0)
+    feather.add_argument('--highresextnum', type=int, default=0)
+    feather.add_argument('--lowresextnum', type=int, default=0)
+    feather.add_argument('-j', '--jobs', type=int, default=1,
+                         help="Number of processes (default: %(default)s)")
+    feather.add_argument('--max-memory', type=_quantity(u.byte),
+                         help="Memory budget per process, e.g. '4 GB'.  It "
+                              "sets the channel block size of cube "
+                              "feathering and limits the number of "
+                              "concurrent jobs of image feathering.")
+    feather.add_argument('--dtype', choices=['float64', 'float32'],
+                         default='float64',
+                         help="Working and output precision "
+                              "(default: %(default)s)")
+    feather.add_argument('--no-rfft', dest='rfft', action='store_false',
+                         help="Use full complex FFTs instead of real ones")
+    feather.add_argument('--fft-backend',
+                         help="The FFT backend, e.g. 'scipy' or 'pyfftw'")
+    feather.add_argument('--kernel-method', choices=['fft', 'analytic'],
+                         default='fft')
+    feather.add_argument('--overwrite', action='store_true',
+                         help="Overwrite existing output files")
+    feather.add_argument('--timing',
+                         help="Write per-field timings and failures as JSON "
+                              "to this file ('-' for standard output)")
+    feather.add_argument('--trace',
+                         help="Write the wall time, CPU time and peak memory "
+                              "of every pipeline stage to this file, in the "
+                              "Chrome trace format (or as JSON if the name "
+                              "does not end in .trace.json).  Only stages "
+                              "run in this process are recorded, so use "
+                              "--jobs 1.")
+    return parser
+
+
+def _fields(args):
+    """ The manifest given on the command line """
+    from .batch import read_manifest
+
+    if args.manifest is not None:
+        if args.hires is not None or args.lores is not None:
+            raise ValueError("Give either a manifest or a hires/lores pair, "
+                             "not both.")
+        return read_manifest(args.manifest)
+    if args.hires is None or args.lores is None:
+        raise ValueError("Give a hires and a lores file, or --manifest.")
+    return [dict(hires=args.hires, lores=args.lores, outname=args.outname)]
+
+
+def _limit_jobs(fields, args):
+    """
+    The number of concurrent image feathering jobs that fit in
+    ``args.max_memory`` per job.
+    """
+    from .batch import _read_header
+    from .uvcombine import _feather_bytes_per_channel
+
+    if args.max_memory is None:
+        return args.jobs
+    perfield = 0
+    for field in fields:
+        try:
+            header = _read_header(field['hires'],
+                                  field.get('highresextnum',
+                                            args.highresextnum))
+        except (IOError, OSError):
+            # reported as a failure of the field by the batch
+            continue
+        perfield = max(perfield,
+                       _feather_bytes_per_channel(header['NAXIS2'],
+                                                  header['NAXIS1'],
+                                                  rfft=args.rfft,
+                                                  dtype=args.dtype))
+    if perfield == 0:
+        return args.jobs
+    jobs = int(min(args.jobs, max(1, args.max_memory.value // perfield)))
+    if jobs < args.jobs:
+        log.info("Running {0} jobs instead of {1} to stay within "
+                 "--max-memory".format(jobs, args.jobs))
+    return jobs
+
+
+def _run_batch(fields, args):
+    """ feather_simple over the manifest, through feather_batch """
+    from .batch import feather_batch
+
+    return feather_batch(fields, outdir=args.outdir,
+                         nprocs=_limit_jobs(fields, args),
+                         overwrite=args.overwrite, rfft=args.rfft,
+                         fft_backend=args.fft_backend,
+                         kernel_method=args.kernel_method, dtype=args.dtype,
+                         highresextnum=args.highresextnum,
+                         lowresextnum=args.lowresextnum,
+                         highresscalefactor=args.highresscalefactor,
+                         lowresscalefactor=args.lowresscalefactor,
+                         lowresfwhm=args.lowresfwhm)
+
+
+def _feather_akb(field, args):
+    from .uvcombine import AKB_combine
+
+    if os.path.exists(field['outname']):
+        if not args.overwrite:
+            raise IOError("File {0} exists.".format(field['outname']))
+        os.remove(field['outname'])
+    AKB_combine(field['hires'], field['lores'],
+                highresextnum=field['highresextnum'],
+                lowresextnum=field['lowresextnum'],
+                highresscalefactor=field['highresscalefactor'],
+                lowresscalefactor=field['lowresscalefactor'],
+                lowresfwhm=field['lowresfwhm'], fft_backend=args.fft_backend,
+                outfitsname=field['outname'])
+
+
+def _feather_cube(field, args):
+    from .uvcombine import feather_cube_to_fits
+    from .parallel import feather_cube_parallel
+
+    kwargs = dict(highresextnum=field['highresextnum'],
+                  lowresextnum=field['lowresextnum'],
+                  highresscalefactor=field['highresscalefactor'],
+                  lowresscalefactor=field['lowresscalefactor'],
+                  lowresfwhm=field['lowresfwhm'], overwrite=args.overwrite,
+                  rfft=args.rfft, fft_backend=args.fft_backend,
+                  kernel_method=args.kernel_method, dtype=args.dtype)
+    if args.max_memory is not None:
+        kwargs['max_memory'] = args.max_memory
+    if args.jobs > 1:
+        feather_cube_parallel(field['hires'], field['lores'],
+                              field['outname'], nprocs=args.jobs, **kwargs)
+    else:
+        feather_cube_to_fits(field['hires'], field['lores'],
+                             field['outname'], **kwargs)
+
+
+def _run_each(fields, args, function):
+    """
+    Run ``function(field, args)`` for every field in turn, recording the
+    outcome in the same form as `~uvcombine.batch.feather_batch`.
+    """
+    from .batch import _manifest_fields, _result
+
+    defaults = dict(highresextnum=args.highresextnum,
+                    lowresextnum=args.lowresextnum,
+                    highresscalefactor=args.highresscalefactor,
+                    lowresscalefactor=args.lowresscalefactor,
+                    lowresfwhm=args.lowresfwhm)
+    results = []
+    for field in _manifest_fields(fields, args.outdir, defaults):
+        t0 = time.time()
+        try:
+            function(field, args)
+        except Exception as ex:
+            log.warning("Feathering field {0} failed: {1!r}"
+                        .format(field['name'], ex))
+            results.append(_result(field, 'failed', time.time()-t0,
+                                   error=repr(ex),
+                                   tb=traceback.format_exc()))
+        else:
+            results.append(_result(field, 'ok', time.time()-t0))
+    return results
+
+
+def _write_timing(filename, args, results, total_time):
+    report = dict(command='feather', mode=args.mode, jobs=args.jobs,
+                  total_time=total_time,
+                  n_ok=sum(result['status'] == 'ok' for result in results),
+                  n_failed=sum(result['status'] == 'failed'
+                               for result in results),
+                  fields=[dict((key, value) for key, value in result.items()
+                               if key != 'index')
+                          for result in results])
+    if filename == '-':
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(filename, 'w') as fh:
+            json.dump(report, fh, indent=2)
+
+
+def feather(args):
+    """
+    Run ``uvcombine feather`` with parsed arguments ``args``.  Returns the
+    exit status: 0 if every field was combined, 1 otherwise.
+    """
+    from .tracing import trace
+
+    t0 = time.time()
+    fields = _fields(args)
+    # the memory tracing has a cost, so it is only on for --trace
+    with trace(memory=args.trace is not None) as tracer:
+        if args.mode == 'simple':
+            results = _run_batch(fields, args)
+        elif args.mode == 'akb':
+            results = _run_each(fields, args, _feather_akb)
+        else:
+            results = _run_each(fields, args, _feather_cube)
+    total_time = time.time() - t0
+
+    if args.timing is not None:
+        _write_timing(args.timing, args, results, total_time)
+    if args.trace is not None:
+        if args.trace.endswith('.trace.json'):
+            tracer.to_chrome_trace(args.trace)
+        else:
+            tracer.to_json(args.trace)
+
+    nfailed = sum(result['status'] == 'failed' for result in results)
+    log.info("Combined {0} of {1} fields in {2:.1f} s"
+             .format(len(results)-nfailed, len(results), total_time))
+    return 1 if nfailed else 0
+
+
+def main(argv=None):
+    """
+    The entry point of the ``uvcombine`` command.
+    """
+    parser = _parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 2
+    args.dtype = np.dtype(args.dtype)
+    level = log.level
+    if args.timing == '-':
+        # astropy logs INFO messages to standard output, which is kept for
+        # the report; warnings still go to standard error
+        log.setLevel('WARNING')
+    try:
+        return feather(args)
+    except (ValueError, IOError) as ex:
+        parser.exit(2, "uvcombine: error: {0}\n".format(ex))
+    finally:
+        log.setLevel(level)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
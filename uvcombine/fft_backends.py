@@ -0,0 +1,216 @@
+"""
+Pluggable FFT backends for the Fourier-space operations in uvcombine.
+
+Every backend exposes the same four transforms, ``fft2``, ``ifft2``, ``rfft2``
+and ``irfft2``, with `numpy.fft` call signatures and normalization.  The
+functions in `uvcombine.uvcombine` take a ``fft_backend`` keyword, which may be
+a registered backend name, a backend instance or ``None`` to use the global
+default set with `set_fft_backend`.
+
+Example
+-------
+>>> set_fft_backend('scipy', workers=8)              # doctest: +SKIP
+>>> feather_simple(hires, lores, fft_backend='pyfftw') # doctest: +SKIP
+"""
+import os
+import pickle
+
+import numpy as np
+
+__all__ = ['NumpyFFTBackend', 'ScipyFFTBackend', 'PyFFTWBackend',
+           'register_fft_backend', 'get_fft_backend', 'set_fft_backend',
+           'available_fft_backends']
+
+
+class NumpyFFTBackend(object):
+    """
+    Single-threaded transforms from `numpy.fft`.
+    """
+    name = 'numpy'
+
+    def fft2(self, a, axes=(-2,-1)):
+        return np.fft.fft2(a, axes=axes)
+
+    def ifft2(self, a, axes=(-2,-1)):
+        return np.fft.ifft2(a, axes=axes)
+
+    def rfft2(self, a, axes=(-2,-1)):
+        return np.fft.rfft2(a, axes=axes)
+
+    def irfft2(self, a, s=None, axes=(-2,-1)):
+        return np.fft.irfft2(a, s=s, axes=axes)
+
+
+class ScipyFFTBackend(object):
+    """
+    Multi-threaded transforms from `scipy.fft`.
+
+    Parameters
+    ----------
+    workers : int
+        Number of worker threads passed to `scipy.fft`.  Negative values count
+        back from the number of CPUs, so ``-1`` uses every core.
+    """
+    name = 'scipy'
+
+    def __init__(self, workers=-1):
+        try:
+            import scipy.fft
+        except ImportError:
+            raise ImportError("The 'scipy' FFT backend requires scipy>=1.4 "
+                              "(scipy.fft).")
+        self._fft = scipy.fft
+        self.workers = workers
+
+    def fft2(self, a, axes=(-2,-1)):
+        return self._fft.fft2(a, axes=axes, workers=self.workers)
+
+    def ifft2(self, a, axes=(-2,-1)):
+        return self._fft.ifft2(a, axes=axes, workers=self.workers)
+
+    def rfft2(self, a, axes=(-2,-1)):
+        return self._fft.rfft2(a, axes=axes, workers=self.workers)
+
+    def irfft2(self, a, s=None, axes=(-2,-1)):
+        return self._fft.irfft2(a, s=s, axes=axes, workers=self.workers)
+
+
+class PyFFTWBackend(object):
+    """
+    Planned, multi-threaded transforms from pyFFTW.
+
+    The FFTW plans are kept in pyFFTW's interface cache, so repeated transforms
+    of the same shape and dtype reuse their plan.  Accumulated FFTW wisdom can
+    be stored in a file and loaded in later sessions so that planning with
+    ``FFTW_MEASURE`` or ``FFTW_PATIENT`` is only paid once.
+
+    Parameters
+    ----------
+    threads : int
+        Number of threads used by FFTW.  Defaults to the number of CPUs.
+    planner_effort : str
+        The FFTW planner flag, e.g. ``'FFTW_ESTIMATE'`` or ``'FFTW_MEASURE'``.
+    wisdom_file : str or None
+        A file of previously exported wisdom.  It is loaded now if it exists
+        and is the default target of `save_wisdom`.
+    cache_keepalive : float
+        Seconds an unused plan stays in the pyFFTW interface cache.
+    """
+    name = 'pyfftw'
+
+    def __init__(self, threads=None, planner_effort='FFTW_MEASURE',
+                 wisdom_file=None, cache_keepalive=300.):
+        try:
+            import pyfftw
+            import pyfftw.interfaces.numpy_fft
+        except ImportError:
+            raise ImportError("The 'pyfftw' FFT backend requires pyFFTW.")
+        self._pyfftw = pyfftw
+        self._fft = pyfftw.interfaces.numpy_fft
+        self.threads = os.cpu_count() if threads is None else threads
+        self.planner_effort = planner_effort
+        self.wisdom_file = wisdom_file
+
+        pyfftw.interfaces.cache.enable()
+        pyfftw.interfaces.cache.set_keepalive_time(cache_keepalive)
+
+        if wisdom_file is not None and os.path.exists(wisdom_file):
+            self.load_wisdom(wisdom_file)
+
+    def load_wisdom(self, filename):
+        """
+        Import FFTW wisdom previously written with `save_wisdom`.
+        """
+        with open(filename, 'rb') as fh:
+            self._pyfftw.import_wisdom(pickle.load(fh))
+
+    def save_wisdom(self, filename=None):
+        """
+        Export the accumulated FFTW wisdom to ``filename`` (default:
+        ``wisdom_file``).
+        """
+        filename = self.wisdom_file if filename is None else filename
+        if filename is None:
+            raise ValueError("No wisdom file given.")
+        with open(filename, 'wb') as fh:
+            pickle.dump(self._pyfftw.export_wisdom(), fh)
+
+    def _kwargs(self):
+        return dict(threads=self.threads, planner_effort=self.planner_effort)
+
+    def fft2(self, a, axes=(-2,-1)):
+        return self._fft.fft2(a, axes=axes, **self._kwargs())
+
+    def ifft2(self, a, axes=(-2,-1)):
+        return self._fft.ifft2(a, axes=axes, **self._kwargs())
+
+    def rfft2(self, a, axes=(-2,-1)):
+        return self._fft.rfft2(a, axes=axes, **self._kwargs())
+
+    def irfft2(self, a, s=None, axes=(-2,-1)):
+        return self._fft.irfft2(a, s=s, axes=axes, **self._kwargs())
+
+
+_fft_backends = {}
+_default_fft_backend = None
+
+
+def register_fft_backend(name, backend_class):
+    """
+    Register a backend class under ``name``.  The class is instantiated with
+    the keyword arguments given to `get_fft_backend` or `set_fft_backend`, and
+    must provide ``fft2``, ``ifft2``, ``rfft2`` and ``irfft2``.
+    """
+    _fft_backends[name] = backend_class
+
+
+def available_fft_backends():
+    """
+    Return the names of the registered backends.
+    """
+    return sorted(_fft_backends)
+
+
+def get_fft_backend(backend=None, **kwargs):
+    """
+    Resolve ``backend`` to a backend instance.
+
+    Parameters
+    ----------
+    backend : None, str or backend instance
+        ``None`` returns the global default backend, a string is looked up in
+        the registry and instantiated with ``kwargs``, and anything else is
+        assumed to already be a backend and is returned unchanged.
+    """
+    if backend is None:
+        return _default_fft_backend
+    if isinstance(backend, str):
+        if backend not in _fft_backends:
+            raise ValueError("Unknown FFT backend '{0}'.  Available backends "
+                             "are: {1}".format(backend,
+                                               available_fft_backends()))
+        return _fft_backends[backend](**kwargs)
+    return backend
+
+
+def set_fft_backend(backend, **kwargs):
+    """
+    Set the global default backend used when ``fft_backend=None``.
+
+    Parameters
+    ----------
+    backend : str or backend instance
+        See `get_fft_backend`; ``kwargs`` are passed to the backend class.
+    """
+    global _default_fft_backend
+    if backend is None:
+        backend = 'numpy'
+    _default_fft_backend = get_fft_backend(backend, **kwargs)
+    return _default_fft_backend
+
+
+register_fft_backend('numpy', NumpyFFTBackend)
+register_fft_backend('scipy', ScipyFFTBackend)
+register_fft_backend('pyfftw', PyFFTWBackend)
+
+set_fft_backend('numpy')
@@ -0,0 +1,371 @@
+"""
+A registry of instrument passbands.
+
+The text files in the ``data/filter/`` directory of the package come in
+several layouts: two column ``.fad`` files of wavelength (micron) and
+transmission (Herschel PACS and SPIRE), and Planck RIMO tables of
+wavenumber (cm^-1, HFI) or frequency (GHz, LFI), transmission, uncertainty
+and flag.  The registry parses each
+file once into a binary ``.npy`` cache, memory-mapped on later loads, and
+keeps the loaded filters in memory, so that looking a filter up by name
+costs a dictionary access::
+
+    >>> from uvcombine.filters import get_filter
+    >>> spire = get_filter('SPIRE_PLW')               # doctest: +SKIP
+    >>> planck = get_filter('HFI_353')                # doctest: +SKIP
+    >>> color_correction_factors(spire.frequency.value,
+    ...                          planck.frequency.value,
+    ...                          spire, planck, 3.5)  # doctest: +SKIP
+"""
+import os
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from astropy import units as u
+
+from .cache import _default_cache_dir
+
+__all__ = ['Filter', 'FilterRegistry', 'filter_registry', 'get_filter',
+           'list_filters']
+
+#: The directory of the passband files shipped with the package
+filter_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data',
+                          'filter')
+
+#: The known passband files: file name -> (filter name, instrument, nominal
+#: frequency in GHz, aliases).  Other files in the directory are registered
+#: under their file name, without a nominal frequency.
+_known_filters = OrderedDict([
+    ('PACS_blue.fad', ('PACS_blue', 'PACS', 4282.749, ('PACS_70',))),
+    ('PACS_red.fad', ('PACS_red', 'PACS', 1873.703, ('PACS_160',))),
+    ('SPIRE_PSW_exd.fad', ('SPIRE_PSW', 'SPIRE', 1199.169, ('SPIRE_250',))),
+    ('SPIRE_PMW_exd.fad', ('SPIRE_PMW', 'SPIRE', 856.550, ('SPIRE_350',))),
+    ('SPIRE_PLW_exd.fad', ('SPIRE_PLW', 'SPIRE', 599.585, ('SPIRE_500',))),
+    ('LFI_planck_30.txt', ('LFI_30', 'LFI', 28.4, ('planck_30',))),
+    ('LFI_planck_44.txt', ('LFI_44', 'LFI', 44.1, ('planck_44',))),
+    ('LFI_planck_70.txt', ('LFI_70', 'LFI', 70.4, ('planck_70',))),
+    ('HFI_planck_100.txt', ('HFI_100', 'HFI', 100., ('planck_100',))),
+    ('HFI_planck_143.txt', ('HFI_143', 'HFI', 143., ('planck_143',))),
+    ('HFI_planck_217.txt', ('HFI_217', 'HFI', 217., ('planck_217',))),
+    ('HFI_planck_353.txt', ('HFI_353', 'HFI', 353., ('planck_353',))),
+    ('HFI_planck_545.txt', ('HFI_545', 'HFI', 545., ('planck_545',))),
+    ('HFI_planck_857.txt', ('HFI_857', 'HFI', 857., ('planck_857',))),
+])
+
+#: The spectral axis units of the table layouts, by their first column name
+_axis_units = {'WAVENUMBER': 'cm-1', 'FREQUENCY': 'GHz'}
+
+#: Bump to invalidate existing caches when the cache layout changes
+_cache_version = 1
+
+
+class Filter(object):
+    """
+    An instrument passband.
+
+    Iterating over a filter yields its ``wavelength`` and ``transmission``,
+    so a filter can be passed wherever a ``(wavelength, response)`` passband
+    is expected, e.g. to `~uvcombine.uvcombine.color_correction_factors`.
+
+    Attributes
+    ----------
+    name : str
+        The registry name
+    instrument : str or None
+        The instrument, e.g. ``'SPIRE'`` or ``'HFI'``
+    frequency : `~astropy.units.Quantity` or None
+        The nominal (reference) frequency of the band
+    units : str
+        The units of the spectral axis in the source file: ``'um'``,
+        ``'cm-1'`` or ``'GHz'``
+    wavelength : array
+        The wavelengths of the passband in microns, in increasing order
+    transmission : array
+        The transmission at ``wavelength``
+    uncertainty : array or None
+        The uncertainty of the transmission, where the file gives it
+    flag : array or None
+        The boolean flag column of Planck RIMO files
+    filename : str
+        The source file
+    """
+
+    def __init__(self, name, instrument, frequency, units, data, filename):
+        self.name = name
+        self.instrument = instrument
+        self.frequency = (None if frequency is None
+                          else u.Quantity(frequency, u.GHz))
+        self.units = units
+        self.filename = filename
+        self.wavelength = data[0]
+        self.transmission = data[1]
+        self.uncertainty = data[2] if len(data) > 2 else None
+        self.flag = data[3].astype(bool) if len(data) > 3 else None
+
+    def __iter__(self):
+        yield self.wavelength
+        yield self.transmission
+
+    def __len__(self):
+        return 2
+
+    @property
+    def passband(self):
+        """ The ``(wavelength, transmission)`` tuple """
+        return self.wavelength, self.transmission
+
+    @property
+    def spectral_axis(self):
+        """ The wavelengths as a `~astropy.units.Quantity` in ``units`` """
+        return (self.wavelength*u.um).to(u.Unit(self.units),
+                                         equivalencies=u.spectral())
+
+    def __repr__(self):
+        return ("<Filter {0} instrument={1} frequency={2} npoints={3}>"
+                .format(self.name, self.instrument, self.frequency,
+                        self.wavelength.size))
+
+
+def read_filter_file(filename):
+    """
+    Parse a passband text file.
+
+    Returns
+    -------
+    data : array
+        ``(ncolumns, npoints)`` array of wavelength (micron, increasing),
+        transmission and, for Planck RIMO tables, uncertainty and flag
+        (1 for ``T``, 0 for ``F``).  Points at zero frequency are dropped.
+    units : str
+        The units of the spectral axis in the file
+    """
+    with open(filename) as fh:
+        first = fh.readline().split()
+    if first and first[0].upper() in _axis_units:
+        # Planck RIMO: axis, transmission, uncertainty, T/F flag
+        units = _axis_units[first[0].upper()]
+        table = np.loadtxt(filename, skiprows=1, usecols=(0, 1, 2, 3),
+                           dtype=str)
+        data = np.empty((4, len(table)))
+        data[:3] = table[:, :3].astype(float).T
+        data[3] = table[:, 3] == 'T'
+    else:
+        units = 'um'
+        data = np.loadtxt(filename, usecols=(0, 1), ndmin=2).T.copy()
+
+    data = data[:, data[0] > 0]
+    if units != 'um':
+        data[0] = (data[0]*u.Unit(units)).to_value(u.um,
+                                                   equivalencies=u.spectral())
+    data = data[:, np.argsort(data[0], kind='stable')]
+    return data, units
+
+
+class FilterRegistry(object):
+    """
+    The passbands of a directory of filter files, looked up by name.
+
+    Each file is parsed once into ``<name>.npy`` in the cache directory,
+    next to an ``index.json`` of the filter metadata and of the size and
+    modification time of the source files; a changed file is parsed again.
+    Loaded filters are memory-mapped and kept in memory.
+
+    Parameters
+    ----------
+    directory : str or None
+        The directory of the passband files, by default `filter_dir`, the
+        ``data/filter`` directory of the package
+    cachedir : str, None or False
+        The directory of the binary cache, by default ``uvcombine/filters``
+        in the astropy cache directory.  ``False`` disables the on-disk
+        cache (the files are then parsed once per registry).
+    """
+
+    def __init__(self, directory=None, cachedir=None):
+        self.directory = filter_dir if directory is None else directory
+        self._cachedir = cachedir
+        self._index = None
+        self._filters = {}
+        self._lock = threading.Lock()
+
+    @property
+    def cachedir(self):
+        if self._cachedir is None:
+            self._cachedir = _default_cache_dir('filters')
+        return self._cachedir
+
+    def _index_filename(self):
+        return os.path.join(self.cachedir, 'index.json')
+
+    def _sources(self):
+        """ The passband files of ``directory`` and their metadata """
+        sources = OrderedDict()
+        for filename in sorted(os.listdir(self.directory)):
+            stem, ext = os.path.splitext(filename)
+            if ext not in ('.fad', '.txt') or filename == 'filter.txt':
+                continue
+            name, instrument, frequency, aliases = _known_filters.get(
+                filename, (stem, None, None, ()))
+            path = os.path.join(self.directory, filename)
+            stat = os.stat(path)
+            sources[name] = dict(name=name, instrument=instrument,
+                                 frequency=frequency, aliases=list(aliases),
+                                 filename=path, size=stat.st_size,
+                                 mtime=stat.st_mtime)
+        return sources
+
+    def _load_index(self):
+        sources = self._sources()
+        cached = {}
+        if self._cachedir is not False and os.path.exists(
+                self._index_filename()):
+            with open(self._index_filename()) as fh:
+                index = json.load(fh)
+            if (index.get('version') == _cache_version and
+                    index.get('directory') == os.path.abspath(
+                        self.directory)):
+                cached = index['filters']
+
+        changed = False
+        for name, source in sources.items():
+            entry = cached.get(name)
+            if (entry is not None and entry['size'] == source['size'] and
+                    entry['mtime'] == source['mtime'] and
+                    self._cachedir is not False and
+                    os.path.exists(self._data_filename(name))):
+                source['units'] = entry['units']
+                source['npoints'] = entry['npoints']
+                continue
+            data, units = read_filter_file(source['filename'])
+            source['units'] = units
+            source['npoints'] = data.shape[1]
+            if self._cachedir is False:
+                self._filters[name] = Filter(name, source['instrument'],
+                                             source['frequency'], units,
+                                             data, source['filename'])
+            else:
+                self._save_data(name, data)
+                changed = True
+
+        if changed or len(cached) != len(sources):
+            self._save_index(sources)
+
+        aliases = {}
+        for name, source in sources.items():
+            for alias in [name] + source['aliases']:
+                aliases[alias.lower()] = name
+        self._aliases = aliases
+        return sources
+
+    def _data_filename(self, name):
+        return os.path.join(self.cachedir, name + '.npy')
+
+    def _save_data(self, name, data):
+        if not os.path.isdir(self.cachedir):
+            os.makedirs(self.cachedir)
+        filename = self._data_filename(name)
+        # write then rename so that concurrent readers never see a partial
+        # file
+        tmpname = '{0}.{1}.tmp.npy'.format(filename[:-4], os.getpid())
+        np.save(tmpname, data)
+        os.rename(tmpname, filename)
+
+    def _save_index(self, sources):
+        if self._cachedir is False:
+            return
+        if not os.path.isdir(self.cachedir):
+            os.makedirs(self.cachedir)
+        filename = self._index_filename()
+        tmpname = '{0}.{1}.tmp'.format(filename, os.getpid())
+        with open(tmpname, 'w') as fh:
+            json.dump(dict(version=_cache_version,
+                           directory=os.path.abspath(self.directory),
+                           filters=sources), fh, indent=1)
+        os.rename(tmpname, filename)
+
+    @property
+    def index(self):
+        """
+        The metadata of every filter: name -> dictionary of ``instrument``,
+        ``frequency`` (GHz), ``units``, ``npoints``, ``aliases`` and the
+        source ``filename``.
+        """
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = self._load_index()
+        return self._index
+
+    def names(self):
+        """ The names of the registered filters """
+        return list(self.index)
+
+    def __iter__(self):
+        return iter(self.names())
+
+    def __len__(self):
+        return len(self.index)
+
+    def _key(self, name):
+        """ The registry name of filter (or alias) ``name``, or `None` """
+        self.index
+        return self._aliases.get(name.lower())
+
+    def __contains__(self, name):
+        return self._key(name) is not None
+
+    def get(self, name):
+        """
+        Return the `Filter` called ``name`` (or one of its aliases; case
+        insensitive).
+        """
+        filt = self._filters.get(name)
+        if filt is not None:
+            return filt
+        key = self._key(name)
+        if key is None:
+            raise KeyError("Unknown filter {0!r}; the registered filters are "
+                           "{1}".format(name, ', '.join(self.index)))
+        filt = self._filters.get(key)
+        if filt is None:
+            source = self.index[key]
+            data = np.load(self._data_filename(key), mmap_mode='r')
+            filt = Filter(key, source['instrument'], source['frequency'],
+                          source['units'], data, source['filename'])
+            self._filters[key] = filt
+        self._filters[name] = filt
+        return filt
+
+    __getitem__ = get
+
+    def rebuild(self):
+        """ Parse every file again and rewrite the cache """
+        with self._lock:
+            self._filters = {}
+            self._index = None
+            if self._cachedir is not False and os.path.exists(
+                    self._index_filename()):
+                os.remove(self._index_filename())
+
+    def __repr__(self):
+        return ("<FilterRegistry directory={0} filters={1}>"
+                .format(self.directory, len(self)))
+
+
+#: The registry of the passbands shipped with the package
+filter_registry = FilterRegistry()
+
+
+def get_filter(name):
+    """
+    Return the `Filter` called ``name`` from `filter_registry`, e.g.
+    ``'SPIRE_PLW'``, ``'HFI_353'`` or ``'PACS_160'``.
+    """
+    return filter_registry.get(name)
+
+
+def list_filters():
+    """ The names of the filters in `filter_registry` """
+    return filter_registry.names()
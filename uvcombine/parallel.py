@@ -0,0 +1,365 @@
+"""
+Process-pool drivers that spread feathering over many cores.
+
+The inputs are shared with the worker processes through memory-mapped FITS
+files: every task receives only filenames and index ranges, opens the inputs
+itself and writes its part of the result straight into a memory-mapped output
+file.  In-memory inputs (HDUs or `~spectral_cube.SpectralCube` objects) are
+written once to a temporary directory so that they can be mapped too.
+"""
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from astropy.io import fits
+from astropy import units as u
+from astropy import log
+
+from .uvcombine import (PixelMapping, file_in, regrid, feather_kernel,
+                        fftmerge, _cube_in, _channels_per_block,
+                        _check_spectral_axes, _cube_pixel_mapping,
+                        _feather_channel_block, _outfits_header,
+                        _outfits_allocate, _is_spectral_cube)
+
+__all__ = ['feather_cube_parallel', 'feather_tiles_parallel']
+
+
+def _shared_input(data, extnum, tmpdir, name):
+    """
+    Return a (filename, extnum) pair for ``data``, writing it to ``tmpdir``
+    if it is not already a file.
+    """
+    if isinstance(data, str):
+        return data, extnum
+    filename = os.path.join(tmpdir, name + '.fits')
+    if _is_spectral_cube(data):
+        data.write(filename)
+    else:
+        fits.PrimaryHDU(data=data.data, header=data.header).writeto(filename)
+    return filename, 0
+
+
+def _run_tasks(function, tasks, nprocs):
+    """
+    Run ``function(*args)`` for every ``args`` in ``tasks`` on a pool of
+    ``nprocs`` processes, re-raising the first failure.
+    """
+    from astropy.utils.console import ProgressBar
+    pb = ProgressBar(len(tasks))
+    with ProcessPoolExecutor(max_workers=nprocs) as executor:
+        futures = [executor.submit(function, *args) for args in tasks]
+        try:
+            for future in futures:
+                future.result()
+                pb.update()
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+
+
+def _feather_channels_task(hires, highresextnum, lores, lowresextnum,
+                           outname, offset, start, stop, lowresfwhm,
+                           highresscalefactor, lowresscalefactor, rfft,
+                           fft_backend, kernel_method, mappingfile, dtype):
+    cube_hi, header_hi = _cube_in(hires, highresextnum, lazy=True)
+    cube_low, header_low = _cube_in(lores, lowresextnum, lazy=True)
+    mapping = (PixelMapping.load(mappingfile) if mappingfile is not None
+               else None)
+
+    import FITS_tools
+    pixscale = FITS_tools.header_tools.header_to_platescale(
+        FITS_tools.strip_headers.flatten_header(header_hi))
+    nax2, nax1 = cube_hi.shape[1:]
+    # every worker keeps the kernel in its own cache, so it is built once per
+    # process rather than once per task
+    kfft, ikfft = feather_kernel(nax2, nax1, lowresfwhm, pixscale, rfft=rfft,
+                                 fft_backend=fft_backend,
+                                 method=kernel_method, cache=True,
+                                 dtype=dtype)
+
+    combo = _feather_channel_block(cube_hi, header_hi, cube_low, header_low,
+                                   start, stop, kfft, ikfft,
+                                   highresscalefactor=highresscalefactor,
+                                   lowresscalefactor=lowresscalefactor,
+                                   rfft=rfft, fft_backend=fft_backend,
+                                   mapping=mapping, dtype=dtype)
+
+    out = np.memmap(outname, dtype=dtype.newbyteorder('>'), mode='r+',
+                    offset=offset, shape=cube_hi.shape)
+    out[start:stop] = combo
+    out.flush()
+
+
+def feather_cube_parallel(hires, lores, outname,
+                          highresextnum=0,
+                          lowresextnum=0,
+                          highresscalefactor=1.0,
+                          lowresscalefactor=1.0, lowresfwhm=1*u.arcmin,
+                          nprocs=None,
+                          max_memory=1*u.GB,
+                          overwrite=False,
+                          rfft=True, fft_backend=None, kernel_method='fft',
+                          tmpdir=None, dtype=np.float64):
+    """
+    Fourier combine two spectral cubes, spreading blocks of channels over a
+    pool of processes.  The result is written to a FITS file.
+
+    Parameters
+    ----------
+    hires : `~spectral_cube.SpectralCube`, HDU or str
+        The high-resolution cube
+    lores : `~spectral_cube.SpectralCube`, HDU or str
+        The low-resolution (single-dish) cube, with the same spectral channels
+        as ``hires``
+    outname : str
+        Filename of the .fits output of the combined cube
+    highresextnum : int
+    lowresextnum : int
+        The extension numbers to use from the FITS files
+    highresscalefactor : float
+    lowresscalefactor : float
+        A factor to multiply the high- or low-resolution data by to match the
+        low- or high-resolution data
+    lowresfwhm : `astropy.units.Quantity`
+        The full-width-half-max of the single-dish (low-resolution) beam
+    nprocs : int or None
+        Number of worker processes; defaults to the number of CPUs.
+    max_memory : int or `astropy.units.Quantity`
+        The peak working memory of *each* worker, in bytes if not a quantity.
+    overwrite : bool
+        Overwrite ``outname`` if it exists?
+    rfft, kernel_method, dtype :
+        See `~uvcombine.uvcombine.feather_cube`.  ``dtype`` is also the data
+        type of the output file.
+    fft_backend : None, str or backend instance
+        The FFT backend used by the workers.  It is sent to every worker, so
+        pass a registered name (e.g. ``'pyfftw'``) rather than an instance
+        that cannot be pickled.
+    tmpdir : str or None
+        Where to write in-memory inputs; defaults to a new temporary
+        directory that is removed afterwards.
+
+    Returns
+    -------
+    outname : str
+        The name of the written file
+    """
+    if nprocs is None:
+        nprocs = os.cpu_count()
+    dtype = np.dtype(dtype)
+
+    cleanup = tmpdir is None
+    if cleanup:
+        tmpdir = tempfile.mkdtemp(prefix='uvcombine')
+
+    try:
+        hires, highresextnum = _shared_input(hires, highresextnum, tmpdir,
+                                             'hires')
+        lores, lowresextnum = _shared_input(lores, lowresextnum, tmpdir,
+                                            'lores')
+
+        cube_hi, header_hi = _cube_in(hires, highresextnum, lazy=True)
+        cube_low, header_low = _cube_in(lores, lowresextnum, lazy=True)
+        shape = cube_hi.shape
+        nchan, nax2, nax1 = shape
+        _check_spectral_axes(header_hi, header_low, shape, cube_low.shape)
+
+        # compute the spatial regridding once and share it with the workers
+        mapping = _cube_pixel_mapping(header_hi, header_low, shape,
+                                      cube_low.shape)
+        if mapping is not None:
+            mappingfile = os.path.join(tmpdir, 'mapping.npz')
+            mapping.save(mappingfile)
+            # each worker builds the interpolation weights from the grid;
+            # only their size is needed here
+            weights_nbytes = mapping._bilinear_nbytes()
+        else:
+            mappingfile = None
+            weights_nbytes = 0
+        del cube_hi, cube_low
+
+        kernel_nbytes = (2 * dtype.itemsize * nax2 *
+                         ((nax1//2 + 1) if rfft else nax1))
+        nblock = _channels_per_block(max_memory, shape,
+                                     kernel_nbytes + weights_nbytes,
+                                     rfft=rfft, dtype=dtype, mapping=mapping)
+        del mapping
+        # make sure every worker gets something to do
+        nblock = max(1, min(nblock, -(-nchan // nprocs)))
+
+        offset = _outfits_allocate(_outfits_header(header_hi, shape,
+                                                   bitpix=-8*dtype.itemsize),
+                                   outname, overwrite=overwrite)
+
+        tasks = [(hires, highresextnum, lores, lowresextnum, outname, offset,
+                  start, min(start+nblock, nchan), lowresfwhm,
+                  highresscalefactor, lowresscalefactor, rfft, fft_backend,
+                  kernel_method, mappingfile, dtype)
+                 for start in range(0, nchan, nblock)]
+        log.debug("Feathering {0} channels in {1} tasks on {2} processes"
+                  .format(nchan, len(tasks), nprocs))
+
+        _run_tasks(_feather_channels_task, tasks, nprocs)
+    finally:
+        if cleanup:
+            shutil.rmtree(tmpdir)
+
+    return outname
+
+
+def _feather_tile_task(hires, highresextnum, lores_regridded, outname,
+                       offset, core, padding, lowresfwhm, highresscalefactor,
+                       lowresscalefactor, rfft, fft_backend, kernel_method,
+                       dtype):
+    hdu_hi, im_hi, header_hi = file_in(hires, highresextnum, memmap=True)
+    # the low resolution image, already regridded onto the high resolution
+    # grid, so that only the tile is read
+    im_low = np.load(lores_regridded, mmap_mode='r')
+    shape = im_hi.shape
+
+    ycore0, ycore1, xcore0, xcore1 = core
+    y0, y1 = max(ycore0-padding, 0), min(ycore1+padding, shape[0])
+    x0, x1 = max(xcore0-padding, 0), min(xcore1+padding, shape[1])
+
+    import FITS_tools
+    pixscale = FITS_tools.header_tools.header_to_platescale(header_hi)
+    # the tiles mostly share a shape, so every worker keeps the kernel in its
+    # own cache
+    kfft, ikfft = feather_kernel(y1-y0, x1-x0, lowresfwhm, pixscale,
+                                 rfft=rfft, fft_backend=fft_backend,
+                                 method=kernel_method, cache=True,
+                                 dtype=dtype)
+
+    fftsum, combo = fftmerge(kfft, ikfft, np.array(im_hi[y0:y1,x0:x1]),
+                             np.array(im_low[y0:y1,x0:x1]), rfft=rfft,
+                             fft_backend=fft_backend, dtype=dtype,
+                             highresscalefactor=highresscalefactor,
+                             lowresscalefactor=lowresscalefactor)
+
+    out = np.memmap(outname, dtype=dtype.newbyteorder('>'), mode='r+',
+                    offset=offset, shape=shape)
+    out[ycore0:ycore1, xcore0:xcore1] = combo.real[ycore0-y0:ycore1-y0,
+                                                   xcore0-x0:xcore1-x0]
+    out.flush()
+
+
+def feather_tiles_parallel(hires, lores, outname,
+                           highresextnum=0,
+                           lowresextnum=0,
+                           highresscalefactor=1.0,
+                           lowresscalefactor=1.0, lowresfwhm=1*u.arcmin,
+                           tile_size=2048,
+                           padding=None,
+                           nprocs=None,
+                           overwrite=False,
+                           rfft=True, fft_backend=None, kernel_method='fft',
+                           tmpdir=None, dtype=np.float64):
+    """
+    Fourier combine two large single-plane images by feathering overlapping
+    tiles on a pool of processes.  The result is written to a FITS file.
+
+    The low resolution image is regridded onto the high resolution grid once,
+    up front.  Each tile of both images is then feathered like
+    `~uvcombine.uvcombine.feather_simple` after being padded by ``padding``
+    pixels on every side, and only the unpadded core is written out.
+    Because the weighting is done in the Fourier domain of each tile, the
+    result approaches that of feathering the whole image as the padding
+    grows compared with the low resolution beam.
+
+    Parameters
+    ----------
+    hires : HDU or str
+        The high-resolution image
+    lores : HDU or str
+        The low-resolution (single-dish) image
+    outname : str
+        Filename of the .fits output of the combined image
+    highresextnum : int
+    lowresextnum : int
+        The extension numbers to use from the FITS files
+    highresscalefactor : float
+    lowresscalefactor : float
+        A factor to multiply the high- or low-resolution data by to match the
+        low- or high-resolution data
+    lowresfwhm : `astropy.units.Quantity`
+        The full-width-half-max of the single-dish (low-resolution) beam
+    tile_size : int or (int, int)
+        The size in pixels of the tile cores, (ny, nx)
+    padding : int or None
+        The overlap in pixels added to each side of a tile.  Defaults to
+        three times ``lowresfwhm``.
+    nprocs : int or None
+        Number of worker processes; defaults to the number of CPUs.
+    overwrite : bool
+        Overwrite ``outname`` if it exists?
+    rfft, fft_backend, kernel_method, dtype :
+        See `feather_cube_parallel`.
+    tmpdir : str or None
+        Where to write in-memory inputs and the regridded low resolution
+        image; defaults to a new temporary directory that is removed
+        afterwards.
+
+    Returns
+    -------
+    outname : str
+        The name of the written file
+    """
+    if nprocs is None:
+        nprocs = os.cpu_count()
+    dtype = np.dtype(dtype)
+    if np.isscalar(tile_size):
+        tile_size = (tile_size, tile_size)
+
+    cleanup = tmpdir is None
+    if cleanup:
+        tmpdir = tempfile.mkdtemp(prefix='uvcombine')
+
+    try:
+        hires, highresextnum = _shared_input(hires, highresextnum, tmpdir,
+                                             'hires')
+        lores, lowresextnum = _shared_input(lores, lowresextnum, tmpdir,
+                                            'lores')
+
+        hdu_hi, im_hi, header_hi = file_in(hires, highresextnum, memmap=True)
+        shape = im_hi.shape
+        if len(shape) != 2:
+            raise ValueError("feather_tiles_parallel needs a single-plane "
+                             "high resolution image.")
+
+        # regrid the low resolution image once; the workers read their
+        # padded tiles of it
+        hdu_low, im_lowraw, header_low = file_in(lores, lowresextnum)
+        im_low = regrid(header_hi, im_hi, im_lowraw, header_low)[1]
+        lores_regridded = os.path.join(tmpdir, 'lores_regridded.npy')
+        np.save(lores_regridded, im_low)
+        del hdu_hi, im_hi, hdu_low, im_lowraw, im_low
+
+        if padding is None:
+            import FITS_tools
+            pixscale = FITS_tools.header_tools.header_to_platescale(header_hi)
+            padding = int(np.ceil((3*lowresfwhm/(pixscale*u.deg))
+                                  .decompose().value))
+
+        offset = _outfits_allocate(_outfits_header(header_hi, shape,
+                                                   bitpix=-8*dtype.itemsize),
+                                   outname, overwrite=overwrite)
+
+        tasks = [(hires, highresextnum, lores_regridded, outname, offset,
+                  (y0, min(y0+tile_size[0], shape[0]),
+                   x0, min(x0+tile_size[1], shape[1])),
+                  padding, lowresfwhm, highresscalefactor, lowresscalefactor,
+                  rfft, fft_backend, kernel_method, dtype)
+                 for y0 in range(0, shape[0], tile_size[0])
+                 for x0 in range(0, shape[1], tile_size[1])]
+        log.debug("Feathering {0} tiles with {1} pixels padding on {2} "
+                  "processes".format(len(tasks), padding, nprocs))
+
+        _run_tasks(_feather_tile_task, tasks, nprocs)
+    finally:
+        if cleanup:
+            shutil.rmtree(tmpdir)
+
+    return outname
@@ -0,0 +1,412 @@
+"""
+Per-pixel spectral energy distribution fits to multi-band maps.
+
+The fits are vectorized over all the pixels of the maps at once: the power
+law is a closed-form linear least-squares fit in log space, and the
+modified blackbody is fitted by a few Gauss-Newton steps in the temperature
+alone, since for a given temperature the amplitude and the emissivity index
+are again a linear least-squares fit.  Every band shares its frequency
+across the pixels, so the linear parts reduce to small matrices applied to
+the stack of log maps.
+
+With the passbands of the bands (names from `uvcombine.filters`), the fits
+account for the band shapes: the maps are taken to be quoted at the
+nominal band frequencies for a reference spectrum ``nu**-1`` (i.e.
+``nu*I_nu`` constant, the Herschel and Planck HFI convention), and the
+resulting color corrections are applied iteratively from lookup tables.
+
+Examples
+--------
+>>> from uvcombine.sedfit import sed_interpolate
+>>> im_345 = sed_interpolate([pacs160, spire250, spire350, spire500],
+...                          ['PACS_red', 'SPIRE_PSW', 'SPIRE_PMW',
+...                           'SPIRE_PLW'], 345., model='mbb',
+...                          beta=1.8) # doctest: +SKIP
+"""
+import functools
+import itertools
+
+import numpy as np
+from astropy import units as u
+
+from .uvcombine import _passband, _power_law_integrals, _power_law_coefficients
+
+__all__ = ['band_frequencies', 'fit_power_law', 'fit_modified_blackbody',
+           'sed_interpolate']
+
+#: The spectral index of the reference spectrum of the quoted map values
+reference_alpha = -1.
+
+#: The grids of the color correction tables: spectral index (power law),
+#: emissivity index and log temperature (modified blackbody)
+_alpha_grid = np.linspace(-4., 6., 201)
+_beta_grid = np.linspace(0., 4., 41)
+_logtemp_grid = np.linspace(np.log(2.), np.log(500.), 128)
+
+
+def _h_over_k():
+    """ h/k in K/GHz """
+    from astropy import constants
+    return (constants.h / constants.k_B).to_value(u.K / u.GHz)
+
+
+def band_frequencies(bands):
+    """
+    The nominal frequencies (GHz) of filters of `uvcombine.filters`, given
+    as names or `~uvcombine.filters.Filter` objects.
+    """
+    from .filters import get_filter
+    return [(get_filter(band) if isinstance(band, str) else band)
+            .frequency.to_value(u.GHz) for band in bands]
+
+
+def _log_planck(frequency, temperature):
+    """
+    log(B_nu(T)), up to a constant, for broadcastable arrays of frequency
+    (GHz) and temperature (K)
+    """
+    x = _h_over_k() * frequency / temperature
+    # log(exp(x) - 1) = x + log(1 - exp(-x)), without overflow
+    return 3*np.log(frequency) - x - np.log(-np.expm1(-x))
+
+
+def _multilinear(table, grids, coords):
+    """
+    Interpolate ``table`` of shape ``(nbands,) + grid shapes`` at the
+    per-pixel coordinates ``coords`` (one array per uniform grid), clamped
+    to the grids.  Returns an array of shape ``(nbands,) + coords shape``.
+    """
+    indices, fractions = [], []
+    for grid, coord in zip(grids, coords):
+        step = (grid[-1] - grid[0]) / (grid.size - 1)
+        position = np.clip((coord - grid[0]) / step, 0, grid.size - 1)
+        position = np.nan_to_num(position)
+        index = np.minimum(position.astype(np.intp), grid.size - 2)
+        indices.append(index)
+        fractions.append(position - index)
+
+    out = 0
+    for corner in itertools.product((0, 1), repeat=len(grids)):
+        weight = 1
+        for c, fraction in zip(corner, fractions):
+            weight = weight * (fraction if c else 1 - fraction)
+        index = tuple(index + c for index, c in zip(indices, corner))
+        out = out + weight * table[(slice(None),) + index]
+    return out
+
+
+def _color_table(function, bands, frequencies):
+    """
+    The table ``function(bands, frequencies)``, memoized when the bands are
+    filter names
+    """
+    if not all(isinstance(band, str) for band in bands):
+        return function(bands, frequencies)
+    return _named_color_table(function, tuple(bands), tuple(frequencies))
+
+
+@functools.lru_cache(maxsize=32)
+def _named_color_table(function, bands, frequencies):
+    """ The memo of `_color_table`, holding the most recent tables """
+    table = function(bands, frequencies)
+    table.flags.writeable = False
+    return table
+
+
+def _power_law_color_table(bands, frequencies):
+    """
+    log color correction of each band vs. spectral index: the log ratio of
+    the quoted value to the monochromatic value at the nominal frequency,
+    for ``I_nu ~ nu**alpha`` on `_alpha_grid`
+    """
+    alphas = np.append(_alpha_grid, reference_alpha)
+    table = np.empty((len(bands), _alpha_grid.size))
+    for ii, (band, frequency) in enumerate(zip(bands, frequencies)):
+        logratio, weights, _ = _passband(band, frequency)
+        integrals = _power_law_integrals(logratio, weights, alphas)
+        table[ii] = np.log(integrals[:-1] / integrals[-1])
+    return table
+
+
+def _blackbody_color_table(bands, frequencies):
+    """
+    log color correction of each band for ``I_nu ~ nu**beta B_nu(T)`` on
+    `_beta_grid` x `_logtemp_grid`
+    """
+    temperature = np.exp(_logtemp_grid)
+    table = np.empty((len(bands), _beta_grid.size, _logtemp_grid.size))
+    for ii, (band, frequency) in enumerate(zip(bands, frequencies)):
+        logratio, weights, _ = _passband(band, frequency)
+        keep = weights != 0
+        logratio, weights = logratio[keep], weights[keep]
+        freq = frequency * np.exp(logratio)
+        reference = np.dot(np.exp(reference_alpha*logratio), weights)
+        # log(B(nu,T)/B(nu_0,T)) for every temperature and sample
+        logbb = (_log_planck(freq[None, :], temperature[:, None]) -
+                 _log_planck(frequency, temperature)[:, None])
+        for jj, beta in enumerate(_beta_grid):
+            integrals = np.dot(np.exp(logbb + beta*logratio), weights)
+            table[ii, jj] = np.log(integrals / reference)
+    return table
+
+
+def _stack_logs(images, start, stop, out):
+    """ The logs of a chunk of the flattened images, NaN where not > 0 """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for image, row in zip(images, out):
+            np.log(image[start:stop], out=row, casting='unsafe')
+    out[np.isinf(out)] = np.nan
+    return out
+
+
+def _prepare(images, frequencies, bands):
+    if bands is not None and frequencies is None:
+        frequencies = band_frequencies(bands)
+    if frequencies is None or len(frequencies) != len(images):
+        raise ValueError("Give one frequency (or band) per image.")
+    shape = np.shape(images[0])
+    for image in images[1:]:
+        if np.shape(image) != shape:
+            raise ValueError("The images must be on the same grid; regrid "
+                             "them first.")
+    flat = [np.asarray(image).reshape(-1) for image in images]
+    return flat, np.asarray(frequencies, dtype=float), shape
+
+
+def fit_power_law(images, frequencies=None, reference_frequency=None,
+                  bands=None, color_iterations=3, chunk_size=2**20):
+    """
+    Fit a power law ``I_nu = amplitude * (nu/reference_frequency)**alpha``
+    to every pixel of maps at two or more frequencies.
+
+    Parameters
+    ----------
+    images : list of arrays
+        The maps, on the same grid and in the same units of intensity
+    frequencies : list of float or None
+        The frequencies of the maps in GHz; by default the nominal
+        frequencies of ``bands``
+    reference_frequency : float or None
+        The frequency (GHz) of the fitted amplitude, by default the first
+        frequency
+    bands : list or None
+        The passbands of the maps: names of filters in `uvcombine.filters`,
+        `~uvcombine.filters.Filter` objects or ``(wavelength, response)``
+        pairs.  If given, the maps are color corrected for the fitted index.
+    color_iterations : int
+        The number of refits with updated color corrections
+    chunk_size : int
+        The number of pixels fitted at once
+
+    Returns
+    -------
+    amplitude, alpha : arrays
+        Maps of the intensity at ``reference_frequency`` and of the spectral
+        index.  Pixels that are not positive in every map are NaN.
+    """
+    flat, frequencies, shape = _prepare(images, frequencies, bands)
+    if reference_frequency is None:
+        reference_frequency = frequencies[0]
+    interp_coef, alpha_coef = _power_law_coefficients(frequencies,
+                                                      reference_frequency)
+    coefficients = np.array([interp_coef, alpha_coef])
+    table = (None if bands is None
+             else _color_table(_power_law_color_table, bands, frequencies))
+
+    size = flat[0].size
+    amplitude = np.empty(size)
+    alpha = np.empty(size)
+    logs = np.empty((len(flat), min(chunk_size, size)))
+    for start in range(0, size, chunk_size):
+        stop = min(start + chunk_size, size)
+        y = _stack_logs(flat, start, stop, logs[:, :stop-start])
+        params = np.dot(coefficients, y)
+        if table is not None:
+            for _ in range(color_iterations):
+                correction = _multilinear(table, [_alpha_grid], [params[1]])
+                params = np.dot(coefficients, y - correction)
+        np.exp(params[0], out=amplitude[start:stop])
+        alpha[start:stop] = params[1]
+    return amplitude.reshape(shape), alpha.reshape(shape)
+
+
+def fit_modified_blackbody(images, frequencies=None,
+                           reference_frequency=None, beta=None, bands=None,
+                           temperature_range=(5., 200.), niter=6,
+                           color_iterations=3, chunk_size=2**18):
+    """
+    Fit a modified blackbody
+    ``I_nu = amplitude * (nu/nu_0)**beta * B_nu(T) / B_nu0(T)``, with
+    ``nu_0 = reference_frequency``, to every pixel of maps at several
+    frequencies.
+
+    For a given temperature, the log amplitude (and ``beta``) follow from a
+    linear least-squares fit whose matrix is the same for every pixel.  The
+    temperature alone is therefore fitted, by Gauss-Newton steps in
+    ``log(T)`` from the best temperature of a coarse grid, for all pixels at
+    once.
+
+    Parameters
+    ----------
+    images : list of arrays
+        The maps, on the same grid and in the same units of intensity.  At
+        least two are needed with a fixed ``beta`` and three otherwise.
+    frequencies : list of float or None
+        The frequencies of the maps in GHz; by default the nominal
+        frequencies of ``bands``
+    reference_frequency : float or None
+        The frequency (GHz) of the fitted amplitude, by default the first
+        frequency
+    beta : float or None
+        A fixed emissivity index; `None` fits it
+    bands : list or None
+        The passbands of the maps (see `fit_power_law`).  If given, the maps
+        are color corrected for the fitted temperature and index.
+    temperature_range : tuple
+        The range (K) of the fitted temperatures
+    niter : int
+        The number of Gauss-Newton steps
+    color_iterations : int
+        The number of refits with updated color corrections
+    chunk_size : int
+        The number of pixels fitted at once
+
+    Returns
+    -------
+    amplitude, beta, temperature : arrays
+        Maps of the intensity at ``reference_frequency``, the emissivity
+        index and the temperature.  Pixels that are not positive in every
+        map are NaN.
+    """
+    flat, frequencies, shape = _prepare(images, frequencies, bands)
+    if reference_frequency is None:
+        reference_frequency = frequencies[0]
+    nbands = frequencies.size
+    logfreq = np.log(frequencies / reference_frequency)
+
+    # the linear parameters: log amplitude (and beta)
+    if beta is None:
+        if nbands < 3:
+            raise ValueError("At least three maps are needed to fit beta.")
+        design = np.array([np.ones(nbands), logfreq]).T
+    else:
+        if nbands < 2:
+            raise ValueError("At least two maps are needed.")
+        design = np.ones((nbands, 1))
+    solve = np.linalg.pinv(design)
+    # projects out the linear parameters
+    projector = np.eye(nbands) - np.dot(design, solve)
+
+    hk = _h_over_k()
+    logtmin, logtmax = np.log(temperature_range)
+    start_grid = np.linspace(logtmin, logtmax, 24)
+    table = (None if bands is None
+             else _color_table(_blackbody_color_table, bands, frequencies))
+
+    def shape_terms(logtemp):
+        # log(B(nu,T)/B(nu_0,T)) - the part linear in the parameters - and
+        # its derivative with respect to log(T), using
+        # log(exp(x) - 1) = x + log(1 - exp(-x))
+        temperature = np.exp(logtemp)
+        x = hk * frequencies[:, None] / temperature
+        x0 = hk * reference_frequency / temperature
+        em = -np.expm1(-x)
+        em0 = -np.expm1(-x0)
+        terms = 3*logfreq[:, None] - x - np.log(em) + x0 + np.log(em0)
+        derivative = x / em - x0 / em0
+        return terms, derivative
+
+    def fit_temperature(y, logtemp=None, niter=niter):
+        # Gauss-Newton in log(T), by default from the best temperature of a
+        # coarse grid
+        projected = np.dot(projector, y)
+        if logtemp is None:
+            terms, _ = shape_terms(start_grid)
+            projected_terms = np.dot(projector, terms)
+            # |P(y - t)|^2 without the term |Py|^2 common to all t
+            cost = (np.einsum('ij,ij->j', projected_terms,
+                              projected_terms)[:, None] -
+                    2*np.dot(projected_terms.T, projected))
+            logtemp = start_grid[np.argmin(cost, axis=0)]
+        for _ in range(niter):
+            terms, derivative = shape_terms(logtemp)
+            residual = projected - np.dot(projector, terms)
+            jacobian = np.dot(projector, derivative)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                step = (np.einsum('ij,ij->j', jacobian, residual) /
+                        np.einsum('ij,ij->j', jacobian, jacobian))
+            logtemp += np.clip(np.nan_to_num(step), -0.5, 0.5)
+            np.clip(logtemp, logtmin, logtmax, out=logtemp)
+        terms, _ = shape_terms(logtemp)
+        return logtemp, np.dot(solve, y - terms)
+
+    size = flat[0].size
+    amplitude = np.empty(size)
+    beta_map = np.empty(size)
+    temperature = np.empty(size)
+    logs = np.empty((nbands, min(chunk_size, size)))
+    for start in range(0, size, chunk_size):
+        stop = min(start + chunk_size, size)
+        y = _stack_logs(flat, start, stop, logs[:, :stop-start])
+        bad = np.isnan(y).any(axis=0)
+        y[:, bad] = 0
+        if beta is not None:
+            y = y - beta*logfreq[:, None]
+        y_observed = y
+        logtemp, params = fit_temperature(y)
+        for _ in range(color_iterations if table is not None else 0):
+            chunk_beta = params[1] if beta is None else np.full_like(
+                logtemp, beta)
+            correction = _multilinear(table, [_beta_grid, _logtemp_grid],
+                                      [chunk_beta, logtemp])
+            y = y_observed - correction
+            # the corrections are small: refine the previous fit
+            logtemp, params = fit_temperature(y, logtemp, niter=3)
+        amplitude[start:stop] = np.exp(params[0])
+        beta_map[start:stop] = params[1] if beta is None else beta
+        temperature[start:stop] = np.exp(logtemp)
+        for arr in (amplitude, beta_map, temperature):
+            arr[start:stop][bad] = np.nan
+    return (amplitude.reshape(shape), beta_map.reshape(shape),
+            temperature.reshape(shape))
+
+
+def sed_interpolate(images, bands, target_frequency, model='powerlaw',
+                    frequencies=None, **kwargs):
+    """
+    Evaluate an SED fitted to every pixel of multi-band maps at
+    ``target_frequency`` (GHz), e.g. to make a single-dish image at the
+    frequency of a ground-based observation.
+
+    Parameters
+    ----------
+    images : list of arrays
+        The maps, on the same grid and in the same units of intensity
+    bands : list or None
+        Their passbands (see `fit_power_law`); `None` treats the maps as
+        monochromatic at ``frequencies``
+    target_frequency : float
+        The frequency to evaluate the SED at, in GHz
+    model : 'powerlaw' or 'mbb'
+        Fit a power law (`fit_power_law`) or a modified blackbody
+        (`fit_modified_blackbody`)
+    frequencies : list of float or None
+        The frequencies of the maps in GHz, by default the nominal
+        frequencies of ``bands``
+    kwargs
+        Passed to the fitting function
+
+    Returns
+    -------
+    image : array
+        The monochromatic intensity at ``target_frequency``
+    """
+    if model == 'powerlaw':
+        fit = fit_power_law
+    elif model == 'mbb':
+        fit = fit_modified_blackbody
+    else:
+        raise ValueError("model must be 'powerlaw' or 'mbb'.")
+    return fit(images, frequencies=frequencies,
+               reference_frequency=target_frequency, bands=bands,
+               **kwargs)[0]
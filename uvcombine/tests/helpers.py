@@ -0,0 +1,61 @@
+"""
+Synthetic images and cubes for the tests.
+"""
+import numpy as np
+from astropy.io import fits
+
+
+def celestial_header(nx, ny, pixscale=1/3600., nchan=None, crval3=1e11,
+                     cdelt3=1e6):
+    """
+    A TAN header of ``nx`` by ``ny`` pixels of ``pixscale`` degrees, with a
+    FREQ axis of ``nchan`` channels (in Hz) if ``nchan`` is given.
+    """
+    header = fits.Header()
+    header['NAXIS'] = 2 if nchan is None else 3
+    header['NAXIS1'] = nx
+    header['NAXIS2'] = ny
+    if nchan is not None:
+        header['NAXIS3'] = nchan
+    header['CTYPE1'] = 'RA---TAN'
+    header['CTYPE2'] = 'DEC--TAN'
+    header['CRPIX1'] = (nx + 1) / 2.
+    header['CRPIX2'] = (ny + 1) / 2.
+    header['CRVAL1'] = 10.
+    header['CRVAL2'] = 20.
+    header['CDELT1'] = -pixscale
+    header['CDELT2'] = pixscale
+    header['CUNIT1'] = 'deg'
+    header['CUNIT2'] = 'deg'
+    if nchan is not None:
+        header['CTYPE3'] = 'FREQ'
+        header['CRPIX3'] = 1.
+        header['CRVAL3'] = crval3
+        header['CDELT3'] = cdelt3
+        header['CUNIT3'] = 'Hz'
+    return header
+
+
+def image_pair(nx=64, ny=48, seed=0):
+    """
+    A high resolution image of ``nx`` by ``ny`` 1" pixels and a low
+    resolution image of the same field with 2" pixels, as HDUs.
+    """
+    rs = np.random.RandomState(seed)
+    hires = fits.PrimaryHDU(rs.randn(ny, nx), celestial_header(nx, ny))
+    lores = fits.PrimaryHDU(rs.randn(ny//2, nx//2),
+                            celestial_header(nx//2, ny//2, 2/3600.))
+    return hires, lores
+
+
+def cube_pair(nx=32, ny=24, nchan=5, seed=1):
+    """
+    Like `image_pair`, for cubes of ``nchan`` matching channels.
+    """
+    rs = np.random.RandomState(seed)
+    hires = fits.PrimaryHDU(rs.randn(nchan, ny, nx),
+                            celestial_header(nx, ny, nchan=nchan))
+    lores = fits.PrimaryHDU(rs.randn(nchan, ny//2, nx//2),
+                            celestial_header(nx//2, ny//2, 2/3600.,
+                                             nchan=nchan))
+    return hires, lores
@@ -0,0 +1,100 @@
+import os
+
+import pytest
+from numpy.testing import assert_allclose
+from astropy.io import fits
+from astropy import units as u
+
+from ..uvcombine import feather_simple
+from ..batch import feather_batch, read_manifest
+from .helpers import image_pair
+
+
+def _write_pairs(tmpdir, nfields=3):
+    pairs = []
+    for ii in range(nfields):
+        hires, lores = image_pair(seed=ii)
+        names = []
+        for kind, hdu in (('hires', hires), ('lores', lores)):
+            name = str(tmpdir.join('{0}{1}.fits'.format(kind, ii)))
+            hdu.writeto(name)
+            names.append(name)
+        pairs.append((hires, lores, names))
+    return pairs
+
+
+@pytest.mark.parametrize('nprocs', [1, 2])
+def test_feather_batch_matches_feather_simple(tmpdir, nprocs):
+    pairs = _write_pairs(tmpdir)
+    manifest = [dict(hires=names[0], lores=names[1]) for _, _, names in pairs]
+    # a missing file fails its field only
+    manifest.append(dict(hires=str(tmpdir.join('missing.fits')),
+                         lores=pairs[0][2][1]))
+    outdir = str(tmpdir.join('out'))
+    results = feather_batch(manifest, outdir=outdir, nprocs=nprocs,
+                            lowresfwhm=10*u.arcsec)
+
+    assert [result['status'] for result in results] == ['ok'] * 3 + ['failed']
+    assert 'FileNotFoundError' in results[-1]['error']
+    # the three fields share their setup
+    assert len(set(result['group'] for result in results[:3])) == 1
+    for (hires, lores, _), result in zip(pairs, results):
+        assert result['time'] > 0
+        assert result['outname'] == os.path.join(
+            outdir, result['name'] + '_feathered.fits')
+        expected = feather_simple(hires, lores, lowresfwhm=10*u.arcsec,
+                                  rfft=True)
+        assert_allclose(fits.getdata(result['outname']), expected,
+                        atol=1e-10)
+
+
+def test_feather_batch_hdus_and_settings(tmpdir):
+    hires, lores = image_pair()
+    outname = str(tmpdir.join('combo.fits'))
+    results = feather_batch([dict(hires=hires, lores=lores, outname=outname,
+                                  lowresscalefactor=2.)],
+                            nprocs=1, lowresfwhm=10*u.arcsec)
+    assert results[0]['status'] == 'ok'
+    assert results[0]['name'] == 'field0'
+    expected = feather_simple(hires, lores, lowresfwhm=10*u.arcsec,
+                              rfft=True, lowresscalefactor=2.)
+    assert_allclose(fits.getdata(outname), expected, atol=1e-10)
+
+    with pytest.raises(ValueError):
+        feather_batch([(hires, lores)], nprocs=1)
+    with pytest.raises(TypeError):
+        feather_batch([(hires, lores, outname)], nprocs=1, lowresfwhn=1)
+
+
+def test_read_manifest_csv(tmpdir):
+    filename = str(tmpdir.join('fields.csv'))
+    with open(filename, 'w') as fh:
+        fh.write("hires,lores,outname,lowresfwhm,lowresscalefactor\n"
+                 "a.fits,b.fits,ab.fits,30,\n"
+                 "c.fits, d.fits ,,1 arcmin,0.5\n")
+    manifest = read_manifest(filename)
+    assert manifest[0] == dict(hires='a.fits', lores='b.fits',
+                               outname='ab.fits', lowresfwhm=30*u.arcsec)
+    assert manifest[1]['lores'] == 'd.fits'
+    assert 'outname' not in manifest[1]
+    assert manifest[1]['lowresfwhm'] == 1*u.arcmin
+    assert manifest[1]['lowresscalefactor'] == 0.5
+
+
+def test_read_manifest_yaml(tmpdir):
+    pytest.importorskip('yaml')
+    filename = str(tmpdir.join('fields.yaml'))
+    with open(filename, 'w') as fh:
+        fh.write("fields:\n"
+                 "  - hires: a.fits\n"
+                 "    lores: b.fits\n"
+                 "    lowresextnum: 1\n"
+                 "    lowresfwhm: 30 arcsec\n")
+    manifest = read_manifest(filename)
+    assert manifest == [dict(hires='a.fits', lores='b.fits', lowresextnum=1,
+                             lowresfwhm=30*u.arcsec)]
+
+    with open(filename, 'w') as fh:
+        fh.write("- hires: a.fits\n")
+    with pytest.raises(ValueError):
+        read_manifest(filename)
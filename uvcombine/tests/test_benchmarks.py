@@ -0,0 +1,63 @@
+"""
+Run every benchmark of the asv suite once, at its smallest parameters, so
+that the suite keeps working as the package changes.
+"""
+import os
+import sys
+import inspect
+import importlib
+
+import pytest
+
+BENCHMARK_DIR = os.path.join(os.path.dirname(__file__), '..', '..',
+                             'benchmarks')
+BENCHMARK_MODULES = ('color_correction', 'feather', 'imports', 'precision',
+                     'regrid', 'sed')
+PREFIXES = ('time_', 'peakmem_', 'mem_', 'track_', 'timeraw_')
+
+pytestmark = pytest.mark.skipif(not os.path.isdir(BENCHMARK_DIR),
+                                reason="the benchmarks are not installed")
+
+
+def _benchmarks(modname):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(BENCHMARK_DIR)))
+    try:
+        module = importlib.import_module('benchmarks.' + modname)
+    finally:
+        sys.path.pop(0)
+    for name, obj in sorted(vars(module).items()):
+        if inspect.isclass(obj) and obj.__module__ == module.__name__:
+            yield obj
+        elif name.startswith(PREFIXES) and inspect.isfunction(obj):
+            yield obj
+
+
+def _smallest(params):
+    if not params:
+        return ()
+    if not isinstance(params, tuple):
+        params = (params,)
+    # the first value of every parameter, which is the smallest size
+    return tuple(values[0] for values in params)
+
+
+@pytest.mark.parametrize('modname', BENCHMARK_MODULES)
+def test_benchmarks_run(modname):
+    pytest.importorskip('scipy')
+    if modname == 'regrid':
+        pytest.importorskip('spectral_cube')
+    for benchmark in _benchmarks(modname):
+        if inspect.isfunction(benchmark):
+            benchmark()
+            continue
+        args = _smallest(getattr(benchmark, 'params', None))
+        instance = benchmark()
+        if hasattr(instance, 'setup'):
+            instance.setup(*args)
+        try:
+            for name in dir(instance):
+                if name.startswith(PREFIXES):
+                    getattr(instance, name)(*args)
+        finally:
+            if hasattr(instance, 'teardown'):
+                instance.teardown(*args)
@@ -0,0 +1,139 @@
+import os
+
+import numpy as np
+import pytest
+from astropy import units as u
+
+from ..cache import ArrayCache, KernelCache, RegridCache, regrid_cache_key
+from ..uvcombine import feather_kernel, feather_simple, regrid
+from .helpers import image_pair
+
+
+def _array(nbytes):
+    return np.zeros(nbytes, dtype=np.uint8)
+
+
+def test_lru_eviction():
+    cache = ArrayCache(maxbytes=300)
+    for key in 'abc':
+        cache.put(key, _array(100))
+    assert len(cache) == 3 and cache.nbytes == 300
+    # 'a' becomes the most recently used, so 'b' is evicted next
+    assert cache.get('a') is not None
+    cache.put('d', _array(100))
+    assert 'b' not in cache
+    assert all(key in cache for key in 'acd')
+    assert cache.nbytes == 300
+    stats = cache.stats()
+    assert stats['evictions'] == 1 and stats['hits'] == 1
+    assert cache.get('b') is None
+    assert cache.stats()['misses'] == 1
+
+
+def test_byte_limit():
+    cache = ArrayCache(maxbytes=250)
+    cache.put('a', (_array(80), _array(80)))
+    assert cache.nbytes == 160
+    cache.put('b', _array(160))
+    # both entries do not fit: the older one goes
+    assert 'a' not in cache and cache.nbytes == 160
+    # an entry larger than the whole budget is never stored...
+    big = _array(400)
+    cache.put('big', big)
+    assert 'big' not in cache and 'b' in cache
+    # ...and is left writeable
+    assert big.flags.writeable
+    # lowering the budget evicts
+    cache.maxbytes = 100
+    assert len(cache) == 0 and cache.nbytes == 0
+
+
+def test_replace_entry():
+    cache = ArrayCache(maxbytes=1000)
+    cache.put('a', _array(400))
+    cache.put('a', _array(200))
+    assert len(cache) == 1 and cache.nbytes == 200
+
+
+def test_stored_arrays_are_read_only():
+    cache = ArrayCache(maxbytes=1000)
+    arr = _array(80)
+    cache.put('a', arr)
+    assert cache.get('a') is arr
+    with pytest.raises(ValueError):
+        arr[0] = 1
+    cache.clear()
+    assert len(cache) == 0 and cache.stats()['hits'] == 0
+
+
+def test_feather_kernel_cache():
+    cache = KernelCache(maxbytes=2**20)
+    first = feather_kernel(48, 64, 10*u.arcsec, 1/3600., rfft=True,
+                           cache=cache)
+    second = feather_kernel(48, 64, 10*u.arcsec, 1/3600., rfft=True,
+                            cache=cache)
+    assert second[0] is first[0] and second[1] is first[1]
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+    # a different beam, shape, engine or dtype is a different entry
+    feather_kernel(48, 64, 20*u.arcsec, 1/3600., rfft=True, cache=cache)
+    feather_kernel(48, 64, 10*u.arcsec, 1/3600., cache=cache)
+    feather_kernel(48, 64, 10*u.arcsec, 1/3600., rfft=True, cache=cache,
+                   dtype=np.float32)
+    assert len(cache) == 4
+
+
+def test_feather_simple_kernel_cache_off_by_default():
+    from .. import cache as cache_module
+    shared = cache_module.kernel_cache
+    shared.clear()
+    hires, lores = image_pair()
+    feather_simple(hires, lores, lowresfwhm=10*u.arcsec)
+    assert len(shared) == 0
+    cache = KernelCache()
+    combo = feather_simple(hires, lores, lowresfwhm=10*u.arcsec,
+                           kernel_cache=cache)
+    again = feather_simple(hires, lores, lowresfwhm=10*u.arcsec,
+                           kernel_cache=cache)
+    assert cache.stats()['hits'] == 1
+    np.testing.assert_array_equal(combo, again)
+
+
+def test_regrid_cache_memory_only():
+    cache = RegridCache()
+    # the disk layer is opt-in
+    assert cache.cachedir is False
+    hires, lores = image_pair()
+    uncached = regrid(hires.header, hires.data, lores.data, lores.header)[1]
+    first = regrid(hires.header, hires.data, lores.data, lores.header,
+                   cache=cache)[1]
+    second = regrid(hires.header, hires.data, lores.data, lores.header,
+                    cache=cache)[1]
+    np.testing.assert_array_equal(first, uncached)
+    assert second is first and not second.flags.writeable
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+    # another low resolution image is another entry
+    regrid(hires.header, hires.data, 2 * lores.data, lores.header,
+           cache=cache)
+    assert len(cache) == 2
+
+
+def test_regrid_cache_on_disk(tmpdir):
+    cachedir = str(tmpdir.join('regrid'))
+    hires, lores = image_pair()
+    key = regrid_cache_key(lores.data, lores.header, hires.header)
+    cache = RegridCache(cachedir=cachedir)
+    first = regrid(hires.header, hires.data, lores.data, lores.header,
+                   cache=cache)[1]
+    assert os.listdir(cachedir) == [key + '.npy']
+
+    # a new session finds the image on disk
+    cache = RegridCache(cachedir=cachedir)
+    again = regrid(hires.header, hires.data, lores.data, lores.header,
+                   cache=cache)[1]
+    np.testing.assert_array_equal(again, first)
+    assert cache.stats()['disk_hits'] == 1 and cache.stats()['misses'] == 0
+
+    cache.clear()
+    assert os.listdir(cachedir) == [key + '.npy']
+    cache.clear(disk=True)
+    assert os.listdir(cachedir) == []
@@ -0,0 +1,122 @@
+import json
+
+import pytest
+from numpy.testing import assert_allclose
+from astropy.io import fits
+from astropy import units as u
+
+from ..cli import main, _parser
+from ..uvcombine import feather_simple, feather_cube, AKB_combine
+from .helpers import image_pair, cube_pair
+
+
+def _write(tmpdir, hires, lores):
+    names = []
+    for kind, hdu in (('hires', hires), ('lores', lores)):
+        name = str(tmpdir.join(kind + '.fits'))
+        hdu.writeto(name)
+        names.append(name)
+    return names
+
+
+def test_parser():
+    args = _parser().parse_args(['feather', 'a.fits', 'b.fits', '-o',
+                                 'c.fits', '--lowresfwhm', '0.5 arcmin',
+                                 '--max-memory', '2 GB', '-j', '4',
+                                 '--no-rfft'])
+    assert args.hires == 'a.fits' and args.outname == 'c.fits'
+    assert args.lowresfwhm == 30*u.arcsec
+    assert args.max_memory == 2e9*u.byte
+    assert args.jobs == 4 and not args.rfft
+    assert _parser().parse_args(['feather', '--lowresfwhm',
+                                 '12']).lowresfwhm == 12*u.arcsec
+    for bad in (['feather', '--lowresfwhm', '30 parsec'],
+                ['feather', '--mode', 'fast']):
+        with pytest.raises(SystemExit):
+            _parser().parse_args(bad)
+
+
+def test_feather_pair(tmpdir, capsys):
+    hires, lores = image_pair()
+    hiresname, loresname = _write(tmpdir, hires, lores)
+    outname = str(tmpdir.join('combo.fits'))
+    status = main(['feather', hiresname, loresname, '-o', outname,
+                   '--lowresfwhm', '10', '--timing', '-'])
+    assert status == 0
+    expected = feather_simple(hires, lores, lowresfwhm=10*u.arcsec,
+                              rfft=True)
+    assert_allclose(fits.getdata(outname), expected, atol=1e-10)
+    report = json.loads(capsys.readouterr().out)
+    assert report['n_ok'] == 1 and report['n_failed'] == 0
+    assert report['fields'][0]['outname'] == outname
+
+
+def test_feather_manifest(tmpdir):
+    hires, lores = image_pair()
+    hiresname, loresname = _write(tmpdir, hires, lores)
+    manifest = str(tmpdir.join('fields.csv'))
+    with open(manifest, 'w') as fh:
+        fh.write("hires,lores,name\n"
+                 "{0},{1},good\n"
+                 "{0},{2},bad\n".format(hiresname, loresname,
+                                        tmpdir.join('missing.fits')))
+    timing = str(tmpdir.join('timing.json'))
+    status = main(['feather', '--manifest', manifest, '--outdir',
+                   str(tmpdir), '--lowresfwhm', '10 arcsec', '--timing',
+                   timing, '--dtype', 'float32'])
+    # one field failed
+    assert status == 1
+    with open(timing) as fh:
+        report = json.load(fh)
+    assert [field['status'] for field in report['fields']] == ['ok',
+                                                                'failed']
+    with fits.open(str(tmpdir.join('good_feathered.fits'))) as hdul:
+        assert hdul[0].header['BITPIX'] == -32
+
+
+def test_feather_akb(tmpdir):
+    hires, lores = image_pair()
+    hiresname, loresname = _write(tmpdir, hires, lores)
+    outname = str(tmpdir.join('combo.fits'))
+    expected = str(tmpdir.join('expected.fits'))
+    with tmpdir.as_cwd():
+        status = main(['feather', '--mode', 'akb', hiresname, loresname,
+                       '-o', outname, '--lowresfwhm', '10'])
+        assert status == 0
+        AKB_combine(hiresname, loresname, lowresfwhm=10*u.arcsec,
+                    outfitsname=expected)
+        # existing outputs are kept unless --overwrite is given
+        assert main(['feather', '--mode', 'akb', hiresname, loresname,
+                     '-o', outname]) == 1
+        assert main(['feather', '--mode', 'akb', hiresname, loresname,
+                     '-o', outname, '--lowresfwhm', '10',
+                     '--overwrite']) == 0
+    assert_allclose(fits.getdata(outname), fits.getdata(expected))
+    # AKB_combine feathers like feather_simple
+    assert_allclose(fits.getdata(outname),
+                    feather_simple(hires, lores, lowresfwhm=10*u.arcsec,
+                                   rfft=True), atol=1e-10)
+
+
+def test_feather_cube(tmpdir):
+    hires, lores = cube_pair()
+    hiresname, loresname = _write(tmpdir, hires, lores)
+    outname = str(tmpdir.join('combo.fits'))
+    trace = str(tmpdir.join('stages.json'))
+    status = main(['feather', '--mode', 'cube', hiresname, loresname, '-o',
+                   outname, '--lowresfwhm', '5', '--max-memory', '100 kB',
+                   '--trace', trace])
+    assert status == 0
+    expected = feather_cube(hires, lores, lowresfwhm=5*u.arcsec)
+    assert_allclose(fits.getdata(outname), expected, atol=1e-10)
+    with open(trace) as fh:
+        assert json.load(fh)
+
+
+def test_usage_errors(tmpdir):
+    assert main([]) == 2
+    with pytest.raises(SystemExit) as exc:
+        main(['feather', 'a.fits'])
+    assert exc.value.code == 2
+    with pytest.raises(SystemExit):
+        main(['feather', 'a.fits', 'b.fits', '--manifest', 'c.csv'])
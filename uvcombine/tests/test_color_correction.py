@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+from astropy import units as u
+
+from ..uvcombine import color_correction_factors, ColorCorrectionTable
+from ..filters import get_filter
+
+_trapz = getattr(np, 'trapezoid', None) or np.trapz
+
+
+def _scalar_factors(n_center_hi, n_center_lo, pb_hi, pb_lo, alpha):
+    """ The passband integrals of a single alpha, one np.trapz at a time """
+    wv_hi, response_hi = pb_hi
+    wv_lo, response_lo = pb_lo
+    freq_hi = (wv_hi*u.um).to(u.GHz, equivalencies=u.spectral()).value
+    freq_lo = (wv_lo*u.um).to(u.GHz, equivalencies=u.spectral()).value
+    cc_hi = (_trapz(response_hi*(freq_hi/n_center_hi)**2, freq_hi) /
+             _trapz(response_hi*(freq_hi/n_center_hi)**alpha, freq_hi))
+    cc_lo = (_trapz(response_lo*(freq_lo/n_center_lo)**(-1), freq_lo) /
+             _trapz(response_lo*(freq_lo/n_center_lo)**alpha, freq_lo))
+    return cc_hi, cc_lo*(n_center_hi/n_center_lo)**alpha
+
+
+def _gaussian_band(center, width, npoints=200):
+    """ A gaussian passband around ``center`` GHz, on a wavelength grid """
+    freq = np.linspace(center - 3*width, center + 3*width, npoints)
+    wv = (freq*u.GHz).to_value(u.um, equivalencies=u.spectral())
+    return wv, np.exp(-0.5*((freq - center)/width)**2)
+
+
+def test_factors_match_scalar_integrals():
+    pb_hi = _gaussian_band(230., 8.)
+    pb_lo = _gaussian_band(353., 30.)
+    alpha = np.array([[-1., 0.], [2., 3.7]])
+    cc_hi, cc_lo = color_correction_factors(230., 353., pb_hi, pb_lo, alpha)
+    assert cc_hi.shape == cc_lo.shape == alpha.shape
+    for index in np.ndindex(alpha.shape):
+        expected = _scalar_factors(230., 353., pb_hi, pb_lo, alpha[index])
+        assert_allclose((cc_hi[index], cc_lo[index]), expected, rtol=1e-12)
+
+    # the calibration indices need no correction
+    cc_hi, cc_lo = color_correction_factors(230., 353., pb_hi, pb_lo, 2.)
+    assert np.ndim(cc_hi) == 0
+    assert_allclose(cc_hi, 1)
+    cc_lo = color_correction_factors(230., 353., pb_hi, pb_lo, -1.)[1]
+    assert_allclose(cc_lo, 353./230.)
+
+
+def test_factors_of_list_passbands():
+    # a single (wavelength, response) pair may be given as a list
+    pb_hi = _gaussian_band(230., 8.)
+    pb_lo = _gaussian_band(353., 30.)
+    alpha = np.array([1., 2.5])
+    expected = color_correction_factors(230., 353., pb_hi, pb_lo, alpha)
+    cc_hi, cc_lo = color_correction_factors(230., 353., list(pb_hi),
+                                            list(pb_lo), alpha)
+    assert cc_hi.shape == alpha.shape
+    assert_allclose((cc_hi, cc_lo), expected, rtol=1e-15)
+    cc_hi, cc_lo = color_correction_factors(230., 353., list(pb_hi),
+                                            list(pb_lo), 2.5)
+    assert np.ndim(cc_hi) == 0
+    assert_allclose((cc_hi, cc_lo), (expected[0][1], expected[1][1]))
+
+
+def test_factors_of_band_pairs():
+    spire, planck = get_filter('SPIRE_PLW'), get_filter('HFI_353')
+    pb_hi = [spire, _gaussian_band(230., 8.)]
+    pb_lo = [planck, _gaussian_band(353., 30.)]
+    alpha = np.linspace(1, 4, 7)
+    cc_hi, cc_lo = color_correction_factors([None, 230.], [None, 353.],
+                                            pb_hi, pb_lo, alpha, pairs=True)
+    assert cc_hi.shape == (2, 7)
+    for ii, (center_hi, center_lo) in enumerate([(599.585, 353.),
+                                                 (230., 353.)]):
+        for jj, value in enumerate(alpha):
+            expected = _scalar_factors(center_hi, center_lo,
+                                       tuple(pb_hi[ii]), tuple(pb_lo[ii]),
+                                       value)
+            assert_allclose((cc_hi[ii, jj], cc_lo[ii, jj]), expected,
+                            rtol=1e-12)
+    # filters can also be given by name
+    named = color_correction_factors(None, None, 'SPIRE_PLW', 'HFI_353',
+                                     alpha)
+    assert_allclose(named, (cc_hi[0], cc_lo[0]))
+
+    with pytest.raises(ValueError):
+        color_correction_factors(None, None, pb_hi, pb_lo[:1], alpha,
+                                 pairs=True)
+    with pytest.raises(ValueError):
+        color_correction_factors(None, 353., _gaussian_band(230., 8.),
+                                 planck, alpha)
+
+
+def test_table_matches_factors():
+    pb_hi = _gaussian_band(230., 8.)
+    pb_lo = _gaussian_band(353., 30.)
+    table = ColorCorrectionTable.from_passbands(230., 353., pb_hi, pb_lo)
+    alpha_map = np.random.RandomState(0).uniform(-1.5, 5.5, (40, 50))
+    cc_hi, cc_lo = table(alpha_map)
+    expected_hi, expected_lo = color_correction_factors(230., 353., pb_hi,
+                                                        pb_lo, alpha_map)
+    assert cc_hi.shape == alpha_map.shape
+    # the documented interpolation error of the default 0.01 grid
+    assert_allclose(cc_hi, expected_hi, rtol=1e-6)
+    assert_allclose(cc_lo, expected_lo, rtol=1e-6)
+    # grid points are exact, including both ends
+    assert_allclose(table(table.alpha)[0], table.cc_hi, rtol=1e-14)
+
+
+def test_table_outside_and_dtype(tmpdir):
+    table = ColorCorrectionTable.from_passbands(
+        230., 353., _gaussian_band(230., 8.), _gaussian_band(353., 30.),
+        alpha_min=0, alpha_max=4, step=0.1)
+    cc_hi = table.interpolate([-0.1, np.nan, 2., 4.1], dtype=np.float32)
+    assert cc_hi.dtype == np.float32
+    assert np.isnan(cc_hi[[0, 1, 3]]).all()
+    assert np.isfinite(cc_hi[2])
+    assert np.ndim(table.interpolate(2., 'lo')) == 0
+
+    filename = str(tmpdir.join('table.npz'))
+    table.save(filename)
+    loaded = ColorCorrectionTable.load(filename)
+    assert_allclose(loaded(1.234), table(1.234))
+
+    with pytest.raises(ValueError):
+        ColorCorrectionTable([0., 1., 3.], [1., 1., 1.], [1., 1., 1.])
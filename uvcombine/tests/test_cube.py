@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+from astropy.io import fits
+from astropy import units as u
+
+from ..uvcombine import (feather_cube, feather_cube_to_fits, feather_kernel,
+                         fftmerge, regrid_cube, PixelMapping,
+                         _channels_per_block, _cube_pixel_mapping,
+                         _feather_bytes_per_channel)
+from .helpers import cube_pair
+
+
+def test_feather_cube_matches_plane_by_plane():
+    # on a common grid, so that the low resolution cube is not regridded
+    hires, _ = cube_pair()
+    lores = fits.PrimaryHDU(np.random.RandomState(2).randn(*hires.shape),
+                            hires.header)
+    combo = feather_cube(hires, lores, lowresfwhm=5*u.arcsec,
+                         highresscalefactor=1.5, lowresscalefactor=0.5)
+    assert combo.shape == hires.shape
+    kfft, ikfft = feather_kernel(24, 32, 5*u.arcsec, 1/3600., rfft=True)
+    for channel in range(hires.shape[0]):
+        plane = fftmerge(kfft, ikfft, hires.data[channel],
+                         lores.data[channel], rfft=True,
+                         highresscalefactor=1.5, lowresscalefactor=0.5)[1]
+        assert_allclose(combo[channel], plane, atol=1e-12)
+
+
+def test_feather_cube_regrids_with_one_mapping():
+    hires, lores = cube_pair()
+    combo = feather_cube(hires, lores, lowresfwhm=5*u.arcsec)
+
+    mapping = PixelMapping.from_headers(lores.header, hires.header)
+    lores_regridded = mapping.apply(lores.data)
+    assert_allclose(regrid_cube(hires.header, lores.data, lores.header,
+                                hires.shape), lores_regridded)
+    kfft, ikfft = feather_kernel(24, 32, 5*u.arcsec, 1/3600., rfft=True)
+    for channel in range(hires.shape[0]):
+        plane = fftmerge(kfft, ikfft, hires.data[channel],
+                         lores_regridded[channel], rfft=True)[1]
+        assert_allclose(combo[channel], plane, atol=1e-12)
+
+
+def test_feather_cube_return_hdu_and_dtype():
+    hires, lores = cube_pair()
+    hdu = feather_cube(hires, lores, lowresfwhm=5*u.arcsec, return_hdu=True)
+    assert isinstance(hdu, fits.PrimaryHDU)
+    assert hdu.header['NAXIS3'] == hires.header['NAXIS3']
+    combo32 = feather_cube(hires, lores, lowresfwhm=5*u.arcsec,
+                           dtype=np.float32)
+    assert combo32.dtype == np.float32
+    assert_allclose(combo32, hdu.data, rtol=1e-4, atol=1e-4)
+
+
+def test_feather_cube_single_channel():
+    hires, lores = cube_pair(nchan=1)
+    combo = feather_cube(hires, lores, lowresfwhm=5*u.arcsec)
+    assert combo.shape == hires.shape
+
+
+def test_feather_cube_to_fits_matches_feather_cube(tmpdir):
+    hires, lores = cube_pair(nchan=7)
+    combo = feather_cube(hires, lores, lowresfwhm=5*u.arcsec)
+    # room for about two channels per block, so that the last block is
+    # partial
+    outname = str(tmpdir.join('combo.fits'))
+    feather_cube_to_fits(hires, lores, outname, lowresfwhm=5*u.arcsec,
+                         max_memory=200*u.kB)
+    with fits.open(outname) as hdul:
+        assert hdul[0].header['BITPIX'] == -64
+        assert_allclose(hdul[0].data, combo, atol=1e-12)
+
+    feather_cube_to_fits(hires, lores, outname, lowresfwhm=5*u.arcsec,
+                         overwrite=True, dtype=np.float32)
+    with fits.open(outname) as hdul:
+        assert hdul[0].header['BITPIX'] == -32
+        assert_allclose(hdul[0].data, combo, rtol=1e-4, atol=1e-4)
+
+
+def test_feather_cube_to_fits_spectral_mismatch(tmpdir):
+    hires, lores = cube_pair()
+    # the same number of channels, on a different spectral grid
+    lores.header['CDELT3'] = 2 * hires.header['CDELT3']
+    with pytest.raises(ValueError) as exc:
+        feather_cube_to_fits(hires, lores, str(tmpdir.join('combo.fits')),
+                             lowresfwhm=5*u.arcsec)
+    assert 'spectral_regrid' in str(exc.value)
+
+
+def test_channels_per_block_counts_the_mapping():
+    hires, lores = cube_pair(nchan=100)
+    shape = hires.shape
+    mapping = _cube_pixel_mapping(hires.header, lores.header, shape,
+                                  lores.shape)
+    mapping._bilinear_weights()
+    perchannel = _feather_bytes_per_channel(24, 32)
+    regrid_perchannel = _feather_bytes_per_channel(24, 32,
+                                                   shape_in=mapping.shape_in)
+    assert regrid_perchannel > perchannel
+
+    budget = 10 * regrid_perchannel + 1000 + mapping.nbytes
+    assert _channels_per_block(budget, shape, 1000, mapping=mapping) == 10
+    assert _channels_per_block(budget, shape, 1000) > 10
+    # never less than one channel, nor more than the cube
+    assert _channels_per_block(1, shape, 1000, mapping=mapping) == 1
+    assert _channels_per_block(1e12, shape, 1000, mapping=mapping) == 100
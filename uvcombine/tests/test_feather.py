@@ -0,0 +1,129 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+from astropy import units as u
+
+from ..uvcombine import feather_simple, feather_kernel, fftmerge
+from .helpers import image_pair
+
+
+def test_rfft_kernel_is_half_plane():
+    kfft, ikfft = feather_kernel(48, 64, 10*u.arcsec, 1/3600.)
+    rkfft, rikfft = feather_kernel(48, 64, 10*u.arcsec, 1/3600., rfft=True)
+    assert rkfft.shape == (48, 33)
+    assert_allclose(rkfft, kfft[:, :33], atol=1e-12)
+    assert_allclose(rikfft, 1 - rkfft)
+
+
+def test_fftmerge_rfft_matches_full_fft():
+    rs = np.random.RandomState(0)
+    im_hi, im_lo = rs.randn(2, 48, 64)
+    full = fftmerge(*feather_kernel(48, 64, 10*u.arcsec, 1/3600.),
+                    im_hi=im_hi, im_lo=im_lo)[1]
+    half = fftmerge(*feather_kernel(48, 64, 10*u.arcsec, 1/3600., rfft=True),
+                    im_hi=im_hi, im_lo=im_lo, rfft=True)[1]
+    assert not np.iscomplexobj(half)
+    assert_allclose(half, full.real, atol=1e-12)
+    assert np.abs(full.imag).max() < 1e-12
+
+
+def test_feather_simple_rfft_matches_full_fft():
+    hires, lores = image_pair()
+    full = feather_simple(hires, lores, lowresfwhm=10*u.arcsec)
+    half = feather_simple(hires, lores, lowresfwhm=10*u.arcsec, rfft=True)
+    assert half.shape == hires.data.shape
+    assert_allclose(half, full.real, atol=1e-12)
+
+
+def test_feather_simple_odd_shape_rfft():
+    # irfft2 needs the output shape for odd axes
+    hires, lores = image_pair(nx=63, ny=47)
+    full = feather_simple(hires, lores, lowresfwhm=10*u.arcsec)
+    half = feather_simple(hires, lores, lowresfwhm=10*u.arcsec, rfft=True)
+    assert half.shape == (47, 63)
+    assert_allclose(half, full.real, atol=1e-12)
+
+
+@pytest.mark.parametrize('rfft', [False, True])
+def test_analytic_kernel_matches_fft_kernel(rfft):
+    # a beam well sampled and well inside the image, so that the aliasing
+    # and truncation of the sampled beam are negligible
+    analytic = feather_kernel(48, 64, 10*u.arcsec, 1/3600., rfft=rfft,
+                              method='analytic')
+    sampled = feather_kernel(48, 64, 10*u.arcsec, 1/3600., rfft=rfft)
+    assert analytic[0][0, 0] == 1
+    for ka, ks in zip(analytic, sampled):
+        assert ka.shape == ks.shape
+        assert_allclose(ka, ks, atol=1e-6)
+
+
+def test_analytic_kernel_dtype_and_method():
+    kfft, ikfft = feather_kernel(48, 64, 10*u.arcsec, 1/3600.,
+                                 method='analytic', dtype=np.float32)
+    assert kfft.dtype == ikfft.dtype == np.float32
+    with pytest.raises(ValueError):
+        feather_kernel(48, 64, 10*u.arcsec, 1/3600., method='gaussian')
+
+
+def test_feather_simple_analytic_kernel():
+    hires, lores = image_pair()
+    sampled = feather_simple(hires, lores, lowresfwhm=10*u.arcsec, rfft=True)
+    analytic = feather_simple(hires, lores, lowresfwhm=10*u.arcsec,
+                              rfft=True, kernel_method='analytic')
+    assert_allclose(analytic, sampled, atol=1e-5)
+
+
+def test_fftmerge_leaves_inputs_alone():
+    rs = np.random.RandomState(1)
+    im_hi, im_lo = rs.randn(2, 48, 64)
+    im_hi[3, 4] = np.nan
+    hi_copy, lo_copy = im_hi.copy(), im_lo.copy()
+    kernels = feather_kernel(48, 64, 10*u.arcsec, 1/3600., rfft=True)
+    fftsum, combo, nanmask = fftmerge(*kernels, im_hi=im_hi, im_lo=im_lo,
+                                      rfft=True, highresscalefactor=2.,
+                                      lowresscalefactor=0.5,
+                                      return_nanmask=True)
+    assert_allclose(im_hi, hi_copy, equal_nan=True)
+    assert_allclose(im_lo, lo_copy)
+    assert nanmask.sum() == 1 and nanmask[3, 4]
+
+    # scaling in the buffer equals scaling the zero-filled images first
+    expected = fftmerge(*kernels, im_hi=2*np.nan_to_num(im_hi),
+                        im_lo=0.5*im_lo, rfft=True)[1]
+    assert_allclose(combo, expected, atol=1e-12)
+
+
+def test_fftmerge_buffer_and_array_scale():
+    rs = np.random.RandomState(2)
+    im_hi, im_lo = rs.randn(2, 48, 64)
+    scale = rs.uniform(0.5, 1.5, (48, 64))
+    kernels = feather_kernel(48, 64, 10*u.arcsec, 1/3600., rfft=True)
+    buffer = np.empty((48, 64))
+    combo = fftmerge(*kernels, im_hi=im_hi, im_lo=im_lo, rfft=True,
+                     lowresscalefactor=scale, buffer=buffer)[1]
+    expected = fftmerge(*kernels, im_hi=im_hi, im_lo=im_lo*scale,
+                        rfft=True)[1]
+    assert_allclose(combo, expected, atol=1e-12)
+
+
+def test_fftmerge_complex_inputs():
+    rs = np.random.RandomState(3)
+    im_hi = rs.randn(48, 64) + 1j * rs.randn(48, 64)
+    im_lo = rs.randn(48, 64)
+    kernels = feather_kernel(48, 64, 10*u.arcsec, 1/3600.)
+    combo = fftmerge(*kernels, im_hi=im_hi, im_lo=im_lo)[1]
+    real = fftmerge(*kernels, im_hi=im_hi.real, im_lo=im_lo)[1]
+    imag = fftmerge(*kernels, im_hi=im_hi.imag, im_lo=np.zeros_like(im_lo))[1]
+    # the imaginary part is not dropped
+    assert_allclose(combo, real + 1j * imag, atol=1e-12)
+
+
+def test_feather_simple_restore_nans():
+    hires, lores = image_pair()
+    hires.data[10, 20] = np.nan
+    combo = feather_simple(hires, lores, lowresfwhm=10*u.arcsec, rfft=True)
+    assert np.isfinite(combo).all()
+    restored = feather_simple(hires, lores, lowresfwhm=10*u.arcsec,
+                              rfft=True, restore_nans=True)
+    assert np.isnan(restored[10, 20])
+    assert np.isfinite(np.delete(restored.ravel(), 10*64 + 20)).all()
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+from astropy import units as u
+
+from .. import fft_backends
+from ..fft_backends import (NumpyFFTBackend, get_fft_backend,
+                            set_fft_backend, register_fft_backend,
+                            available_fft_backends)
+from ..uvcombine import feather_simple
+from .helpers import image_pair
+
+
+def _backends():
+    backends = ['numpy']
+    for name, module in (('scipy', 'scipy.fft'), ('pyfftw', 'pyfftw')):
+        try:
+            __import__(module)
+        except ImportError:
+            continue
+        backends.append(name)
+    return backends
+
+
+@pytest.mark.parametrize('name', _backends())
+def test_backend_transforms_match_numpy(name):
+    backend = get_fft_backend(name)
+    rs = np.random.RandomState(0)
+    data = rs.randn(3, 12, 15)
+    assert_allclose(backend.fft2(data), np.fft.fft2(data), atol=1e-10)
+    assert_allclose(backend.ifft2(data), np.fft.ifft2(data), atol=1e-10)
+    assert_allclose(backend.rfft2(data), np.fft.rfft2(data), atol=1e-10)
+    half = np.fft.rfft2(data)
+    assert_allclose(backend.irfft2(half, s=(12, 15)),
+                    np.fft.irfft2(half, s=(12, 15)), atol=1e-10)
+
+
+@pytest.mark.parametrize('name', _backends())
+def test_feather_simple_backends_agree(name):
+    hires, lores = image_pair()
+    reference = feather_simple(hires, lores, lowresfwhm=10*u.arcsec,
+                               rfft=True)
+    combo = feather_simple(hires, lores, lowresfwhm=10*u.arcsec, rfft=True,
+                           fft_backend=name)
+    assert_allclose(combo, reference, atol=1e-10)
+
+
+def test_get_fft_backend():
+    assert isinstance(get_fft_backend('numpy'), NumpyFFTBackend)
+    backend = NumpyFFTBackend()
+    assert get_fft_backend(backend) is backend
+    assert 'numpy' in available_fft_backends()
+    with pytest.raises(ValueError):
+        get_fft_backend('nosuchfft')
+
+
+def test_set_and_register_fft_backend():
+
+    class CountingBackend(NumpyFFTBackend):
+        calls = 0
+
+        def rfft2(self, a, axes=(-2,-1)):
+            CountingBackend.calls += 1
+            return super(CountingBackend, self).rfft2(a, axes=axes)
+
+    register_fft_backend('counting', CountingBackend)
+    previous = get_fft_backend()
+    try:
+        set_fft_backend('counting')
+        assert isinstance(get_fft_backend(), CountingBackend)
+        hires, lores = image_pair()
+        feather_simple(hires, lores, lowresfwhm=10*u.arcsec, rfft=True)
+        assert CountingBackend.calls > 0
+    finally:
+        set_fft_backend(previous)
+        del fft_backends._fft_backends['counting']
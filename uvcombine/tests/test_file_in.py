@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_array_equal
+from astropy.io import fits
+
+from ..uvcombine import file_in, open_file_in
+from .helpers import celestial_header
+
+
+@pytest.fixture
+def cubefile(tmpdir):
+    # a cube with a degenerate STOKES-like axis in front, as from CASA
+    header = celestial_header(8, 6, nchan=4)
+    data = np.arange(4*6*8, dtype=float).reshape(1, 4, 6, 8)
+    filename = str(tmpdir.join('cube.fits'))
+    fits.PrimaryHDU(data, header).writeto(filename)
+    return filename, data[0]
+
+
+def test_file_in_squeezes(cubefile):
+    filename, data = cubefile
+    hdu, im, header = file_in(filename)
+    assert im.shape == (4, 6, 8)
+    assert_array_equal(im, data)
+    # the header is flattened to the celestial axes
+    assert header['NAXIS'] == 2
+    assert header['ANAXIS3'] == 4 and header['ACTYPE3'] == 'FREQ'
+
+
+@pytest.mark.parametrize('memmap', [None, True])
+def test_file_in_section(cubefile, memmap):
+    filename, data = cubefile
+    section = (slice(1, 3), slice(2, 5), slice(None, 4))
+    hdu, im, header = file_in(filename, memmap=memmap, section=section)
+    assert_array_equal(im, data[1:3, 2:5, :4])
+    assert header['ANAXIS3'] == 2 and header['NAXIS2'] == 3
+    assert header['NAXIS1'] == 4
+    assert header['ACRPIX3'] == 0
+    assert header['CRPIX2'] == 3.5 - 2
+    assert header['CRPIX1'] == 4.5
+
+
+def test_file_in_section_of_hdu():
+    header = celestial_header(8, 6)
+    hdu = fits.PrimaryHDU(np.arange(48.).reshape(6, 8), header)
+    _, im, header = file_in(hdu, section=(slice(2, 4),))
+    assert_array_equal(im, hdu.data[2:4])
+    assert header['NAXIS2'] == 2 and header['NAXIS1'] == 8
+
+
+def test_file_in_bad_section(cubefile):
+    filename, _ = cubefile
+    with pytest.raises(ValueError):
+        file_in(filename, section=(slice(0, 4, 2),))
+    with pytest.raises(ValueError):
+        file_in(filename, section=(slice(None),)*4)
+
+
+def test_open_file_in_memmap(cubefile):
+    filename, data = cubefile
+    with open_file_in(filename, section=(slice(1, 2),)) as (hdu, im, header):
+        # a view onto the memory-mapped file, not a copy
+        assert not im.flags.owndata
+        assert np.shares_memory(im, hdu.data)
+        assert_array_equal(im, data[1:2])
+        assert header['ANAXIS3'] == 1
+        kept = np.array(im)
+    assert_array_equal(kept, data[1:2])
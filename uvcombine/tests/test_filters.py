@@ -0,0 +1,83 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose, assert_array_equal
+from astropy import units as u
+
+from ..filters import (Filter, FilterRegistry, filter_dir, get_filter,
+                       list_filters, read_filter_file)
+
+
+def test_packaged_filters():
+    # the passbands are package data, not files of the source tree
+    assert os.path.isdir(filter_dir)
+    assert os.path.dirname(os.path.dirname(filter_dir)) == os.path.dirname(
+        os.path.abspath(__import__('uvcombine').__file__))
+    names = list_filters()
+    assert len(names) == 14
+    for name in ('HFI_353', 'SPIRE_PSW', 'SPIRE_PMW', 'SPIRE_PLW',
+                 'PACS_red', 'PACS_blue', 'LFI_30'):
+        assert name in names
+
+
+@pytest.mark.parametrize(('name', 'wavelength'),
+                         [('SPIRE_PLW', 500), ('PACS_160', 160),
+                          ('HFI_353', 850), ('planck_30', 1e4)])
+def test_filter_contents(name, wavelength):
+    filt = get_filter(name)
+    assert isinstance(filt, Filter)
+    assert np.all(np.diff(filt.wavelength) >= 0)
+    wav, trans = filt
+    # the transmission-weighted mean wavelength is near the band's name
+    integrate = getattr(np, 'trapezoid', None) or np.trapz
+    centre = integrate(wav*trans, wav) / integrate(trans, wav)
+    assert abs(centre/wavelength - 1) < 0.25
+    assert_allclose(filt.frequency.to(u.um, u.spectral()).value,
+                    wavelength, rtol=0.25)
+
+
+def test_planck_columns():
+    filt = get_filter('HFI_353')
+    assert filt.units == 'cm-1'
+    assert filt.uncertainty is not None and filt.flag.dtype == bool
+    assert filt.spectral_axis.unit == u.Unit('cm-1')
+    assert get_filter('SPIRE_PLW').uncertainty is None
+
+
+def test_registry_cache(tmpdir):
+    directory = str(tmpdir.join('filter'))
+    os.mkdir(directory)
+    for filename in ('SPIRE_PLW_exd.fad', 'HFI_planck_857.txt'):
+        shutil.copy(os.path.join(filter_dir, filename), directory)
+    cachedir = str(tmpdir.join('cache'))
+
+    registry = FilterRegistry(directory, cachedir=cachedir)
+    assert registry.names() == ['HFI_857', 'SPIRE_PLW']
+    assert 'spire_500' in registry and 'PACS_red' not in registry
+    parsed = registry['SPIRE_500']
+    assert registry.get('SPIRE_PLW') is parsed
+    assert sorted(os.listdir(cachedir)) == ['HFI_857.npy', 'SPIRE_PLW.npy',
+                                            'index.json']
+    with pytest.raises(KeyError):
+        registry.get('nosuchfilter')
+
+    # a new registry reads the binary cache, memory-mapped
+    cached = FilterRegistry(directory, cachedir=cachedir).get('SPIRE_PLW')
+    assert isinstance(cached.transmission, np.memmap)
+    assert_array_equal(cached.wavelength, parsed.wavelength)
+
+    # a changed file is parsed again
+    filename = os.path.join(directory, 'SPIRE_PLW_exd.fad')
+    data, _ = read_filter_file(filename)
+    np.savetxt(filename, np.array([data[0], 2*data[1]]).T)
+    changed = FilterRegistry(directory, cachedir=cachedir).get('SPIRE_PLW')
+    assert_allclose(changed.transmission, 2*parsed.transmission)
+
+
+def test_registry_without_cache(tmpdir):
+    registry = FilterRegistry(cachedir=False)
+    assert len(registry) == 14
+    assert_array_equal(registry.get('PACS_blue').wavelength,
+                       get_filter('PACS_70').wavelength)
@@ -0,0 +1,37 @@
+import sys
+import subprocess
+
+import pytest
+
+# the heavy dependencies that importing uvcombine must not load
+HEAVY_MODULES = ('spectral_cube', 'FITS_tools', 'image_tools',
+                 'astropy.convolution', 'astropy.utils.console',
+                 'astropy.wcs', 'scipy.ndimage')
+
+
+def _loaded(statement):
+    """ The heavy modules loaded by ``statement`` in a fresh interpreter """
+    code = ("import sys; {0}; "
+            "print(' '.join(name for name in {1!r} if name in sys.modules))"
+            .format(statement, HEAVY_MODULES))
+    return subprocess.check_output([sys.executable, '-c', code]).decode().split()
+
+
+@pytest.mark.parametrize('statement', ['import uvcombine',
+                                       'import uvcombine.cli',
+                                       'from uvcombine import feather_simple'])
+def test_import_is_lazy(statement):
+    assert _loaded(statement) == []
+
+
+def test_lazy_attributes():
+    from astropy.convolution import convolve
+    from .. import uvcombine as module
+    import uvcombine
+    assert module.convolve is convolve
+    assert uvcombine.convolve is convolve
+    assert uvcombine.cache.__name__ == 'uvcombine.cache'
+    with pytest.raises(AttributeError):
+        uvcombine.no_such_attribute
+    with pytest.raises(AttributeError):
+        module.no_such_attribute
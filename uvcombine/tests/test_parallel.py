@@ -0,0 +1,48 @@
+import pytest
+from numpy.testing import assert_allclose
+from astropy.io import fits
+from astropy import units as u
+
+from ..uvcombine import feather_cube, feather_simple
+from ..parallel import feather_cube_parallel, feather_tiles_parallel
+from .helpers import image_pair, cube_pair
+
+
+def test_feather_cube_parallel_matches_feather_cube(tmpdir):
+    hires, lores = cube_pair(nchan=5)
+    combo = feather_cube(hires, lores, lowresfwhm=5*u.arcsec)
+    outname = str(tmpdir.join('combo.fits'))
+    feather_cube_parallel(hires, lores, outname, lowresfwhm=5*u.arcsec,
+                          nprocs=2, tmpdir=str(tmpdir))
+    assert_allclose(fits.getdata(outname), combo, atol=1e-12)
+
+
+def test_feather_cube_parallel_spectral_mismatch(tmpdir):
+    hires, lores = cube_pair()
+    lores.header['CRVAL3'] = 2 * hires.header['CRVAL3']
+    with pytest.raises(ValueError):
+        feather_cube_parallel(hires, lores, str(tmpdir.join('combo.fits')),
+                              lowresfwhm=5*u.arcsec, nprocs=1)
+
+
+def test_feather_tiles_parallel_single_tile(tmpdir):
+    hires, lores = image_pair()
+    combo = feather_simple(hires, lores, lowresfwhm=10*u.arcsec, rfft=True)
+    outname = str(tmpdir.join('combo.fits'))
+    feather_tiles_parallel(hires, lores, outname, lowresfwhm=10*u.arcsec,
+                           tile_size=64, nprocs=1)
+    assert_allclose(fits.getdata(outname), combo, atol=1e-12)
+
+
+def test_feather_tiles_parallel_tiles(tmpdir):
+    # away from the image edges, where the whole-image FFT wraps around,
+    # tiles padded by several beams reproduce the whole-image feathering
+    hires, lores = image_pair(nx=128, ny=128)
+    combo = feather_simple(hires, lores, lowresfwhm=10*u.arcsec, rfft=True)
+    outname = str(tmpdir.join('combo.fits'))
+    feather_tiles_parallel(hires, lores, outname, lowresfwhm=10*u.arcsec,
+                           tile_size=32, padding=32, nprocs=2)
+    tiled = fits.getdata(outname)
+    assert tiled.shape == (128, 128)
+    assert_allclose(tiled[32:-32, 32:-32], combo[32:-32, 32:-32],
+                    atol=1e-10)
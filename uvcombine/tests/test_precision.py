@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+from astropy.io import fits
+from astropy import units as u
+
+from ..uvcombine import (feather_simple, feather_cube_to_fits, feather_kernel,
+                         fftmerge)
+from .helpers import image_pair, cube_pair
+
+# single precision carries about 7 significant digits; the FFTs and the
+# regridding lose at most one or two of them.  Errors are relative to the
+# peak of the image, since single pixels can be arbitrarily close to zero.
+RTOL = 1e-5
+
+
+def _assert_close(single, double):
+    assert_allclose(single, double, rtol=RTOL,
+                    atol=RTOL * np.abs(double).max())
+
+
+@pytest.mark.parametrize('rfft', [False, True])
+def test_fftmerge_float32(rfft):
+    rs = np.random.RandomState(0)
+    im_hi, im_lo = rs.randn(2, 48, 64)
+    kernels64 = feather_kernel(48, 64, 10*u.arcsec, 1/3600., rfft=rfft)
+    kernels32 = feather_kernel(48, 64, 10*u.arcsec, 1/3600., rfft=rfft,
+                               dtype=np.float32)
+    fftsum, combo = fftmerge(*kernels32, im_hi=im_hi, im_lo=im_lo, rfft=rfft,
+                             dtype=np.float32)
+    assert fftsum.dtype == np.complex64
+    assert combo.dtype == (np.float32 if rfft else np.complex64)
+    double = fftmerge(*kernels64, im_hi=im_hi, im_lo=im_lo, rfft=rfft)[1]
+    _assert_close(combo, double)
+
+
+@pytest.mark.parametrize('rfft', [False, True])
+def test_feather_simple_float32(rfft):
+    hires, lores = image_pair()
+    double = feather_simple(hires, lores, lowresfwhm=10*u.arcsec, rfft=rfft)
+    single = feather_simple(hires, lores, lowresfwhm=10*u.arcsec, rfft=rfft,
+                            dtype=np.float32)
+    assert single.dtype == (np.float32 if rfft else np.complex64)
+    _assert_close(single, double)
+
+
+def test_feather_cube_to_fits_float32(tmpdir):
+    hires, lores = cube_pair(nchan=4)
+    name64 = str(tmpdir.join('combo64.fits'))
+    name32 = str(tmpdir.join('combo32.fits'))
+    feather_cube_to_fits(hires, lores, name64, lowresfwhm=5*u.arcsec)
+    feather_cube_to_fits(hires, lores, name32, lowresfwhm=5*u.arcsec,
+                         dtype=np.float32)
+    double = fits.getdata(name64)
+    with fits.open(name32) as hdul:
+        assert hdul[0].header['BITPIX'] == -32
+        single = hdul[0].data
+        _assert_close(single, double)
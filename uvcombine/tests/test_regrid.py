@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose, assert_array_equal
+
+from ..uvcombine import PixelMapping
+from .helpers import image_pair
+
+
+def _map_coordinates(mapping, image):
+    import scipy.ndimage
+    bad = ~np.isfinite(image)
+    newdata = scipy.ndimage.map_coordinates(np.where(bad, 0, image),
+                                            mapping.grid, order=1)
+    newbad = scipy.ndimage.map_coordinates(bad, mapping.grid, order=0,
+                                           mode='constant', cval=True)
+    newdata[newbad] = np.nan
+    return newdata
+
+
+def test_bilinear_matches_map_coordinates():
+    hires, lores = image_pair()
+    mapping = PixelMapping.from_headers(lores.header, hires.header)
+    assert mapping.shape_in == lores.shape
+    assert mapping.shape_out == hires.shape
+    # the output grid is wider than the input one, so some output pixels
+    # fall off the input grid
+    regridded = mapping.apply(lores.data)
+    assert np.isnan(regridded).any()
+    assert_allclose(regridded, _map_coordinates(mapping, lores.data),
+                    atol=1e-6, equal_nan=True)
+
+
+def test_bilinear_stack_and_bad_pixels():
+    hires, lores = image_pair()
+    mapping = PixelMapping.from_headers(lores.header, hires.header)
+    stack = np.array([lores.data, 2 * lores.data, lores.data])
+    stack[2, 10, 12] = np.nan
+    regridded = mapping.apply(stack)
+    assert regridded.shape == (3,) + hires.shape
+    for plane, image in zip(regridded, stack):
+        assert_allclose(plane, _map_coordinates(mapping, image), atol=1e-6,
+                        equal_nan=True)
+    # the bad pixel only blanks its own plane
+    assert np.isnan(regridded[2]).sum() > np.isnan(regridded[0]).sum()
+
+    zeroed = mapping.apply(stack, preserve_bad_pixels=False)
+    assert np.isfinite(zeroed).all()
+
+
+def test_single_row_input():
+    mapping = PixelMapping(np.array([[[0., 0., 0.]], [[0., 0.5, 1.]]]),
+                           (1, 2))
+    assert_allclose(mapping.apply(np.array([[1., 3.]])), [[1., 2., 3.]])
+
+
+def test_higher_order():
+    hires, lores = image_pair()
+    mapping = PixelMapping.from_headers(lores.header, hires.header)
+    cubic = mapping.apply(lores.data, order=3)
+    assert cubic.shape == hires.shape
+    with pytest.raises(ValueError):
+        mapping.apply(hires.data)
+
+
+def test_nbytes_and_save(tmpdir):
+    hires, lores = image_pair()
+    mapping = PixelMapping.from_headers(lores.header, hires.header)
+    npix = hires.data.size
+    assert mapping.nbytes == 8 * npix
+    assert mapping._bilinear_nbytes() == 12 * npix
+    mapping.apply(lores.data)
+    # an int32 index and two float32 offsets per output pixel
+    assert mapping.nbytes == 20 * npix
+
+    filename = str(tmpdir.join('mapping.npz'))
+    mapping.save(filename)
+    loaded = PixelMapping.load(filename)
+    assert loaded.shape_in == mapping.shape_in
+    assert_array_equal(loaded.grid, mapping.grid)
+    assert_array_equal(loaded.apply(lores.data), mapping.apply(lores.data))
@@ -0,0 +1,120 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+from astropy.io import fits
+
+from ..uvcombine import (spectral_index_interpolate, freq_filling,
+                         header_frequency, file_in)
+from .helpers import celestial_header
+
+
+def _power_law_maps(frequencies, shape=(30, 40), seed=0):
+    rs = np.random.RandomState(seed)
+    amplitude = rs.uniform(1, 10, shape)
+    alpha = rs.uniform(1, 4, shape)
+    return [amplitude*(freq/100.)**alpha for freq in frequencies], amplitude, alpha
+
+
+@pytest.mark.parametrize('frequencies', [[857., 545.], [857., 545., 353.]])
+def test_spectral_index_interpolate_exact(frequencies):
+    maps, amplitude, alpha = _power_law_maps(frequencies)
+    interpol, alpha_map = spectral_index_interpolate(maps, frequencies, 230.,
+                                                     return_alpha=True)
+    assert_allclose(interpol, amplitude*2.3**alpha, rtol=1e-12)
+    assert_allclose(alpha_map, alpha, rtol=1e-12)
+
+
+def test_spectral_index_interpolate_chunks_and_blanks():
+    frequencies = [857., 545.]
+    maps, _, _ = _power_law_maps(frequencies)
+    maps[0][3, 4] = 0
+    maps[1][5, 6] = -1
+    maps[1][7, 8] = np.nan
+    whole = spectral_index_interpolate(maps, frequencies, 230.,
+                                       chunk_size=None)
+    chunked = spectral_index_interpolate(maps, frequencies, 230.,
+                                         chunk_size=77)
+    assert_allclose(chunked, whole, rtol=1e-15)
+    out = np.empty((30, 40), dtype=np.float32)
+    single = spectral_index_interpolate(maps, frequencies, 230.,
+                                        chunk_size=77, out=out,
+                                        dtype=np.float32)
+    assert single is out
+    # the logs of the maps lose a few digits in single precision
+    assert_allclose(single, whole, rtol=1e-5)
+    for index in ((3, 4), (5, 6), (7, 8)):
+        assert np.isnan(whole[index]) and np.isnan(chunked[index])
+    assert np.isfinite(whole).sum() == 30*40 - 3
+
+    with pytest.raises(ValueError):
+        spectral_index_interpolate(maps, [857.], 230.)
+    with pytest.raises(ValueError):
+        spectral_index_interpolate(maps, [545., 545.], 230.)
+    with pytest.raises(ValueError):
+        spectral_index_interpolate([maps[0], maps[1][:10]], frequencies,
+                                   230.)
+
+
+def test_header_frequency():
+    header = fits.Header()
+    header['RESTFRQ'] = 3.53e11
+    assert_allclose(header_frequency(header), 353.)
+    header = fits.Header()
+    header['WAVELNTH'] = 500.
+    assert_allclose(header_frequency(header), 599.585, rtol=1e-6)
+    header = celestial_header(4, 4, nchan=1, crval3=2.3e11)
+    header['RESTFRQ'] = 1e11
+    # the FREQ axis comes first
+    assert_allclose(header_frequency(header), 230.)
+    header['CUNIT3'] = 'GHz'
+    header['CRVAL3'] = 100.
+    assert_allclose(header_frequency(header), 100.)
+    with pytest.raises(ValueError):
+        header_frequency(fits.Header())
+
+
+def test_freq_filling_with_cube_headers(tmpdir):
+    # three single channel maps with FREQ axes, read (and flattened) by
+    # file_in as AKB_interpol does
+    frequencies = [300., 200., 100.]
+    maps, amplitude, alpha = _power_law_maps(frequencies[:2])
+    names = []
+    for ii, freq in enumerate(frequencies):
+        name = str(tmpdir.join('map{0}.fits'.format(ii)))
+        data = maps[ii] if ii < 2 else np.zeros((30, 40))
+        fits.PrimaryHDU(data[None],
+                        celestial_header(40, 30, nchan=1,
+                                         crval3=freq*1e9)).writeto(name)
+        names.append(name)
+    (_, im1, hd1), (_, im2, hd2), (_, _, hd3) = [file_in(name)
+                                                 for name in names]
+    assert 'ACRVAL3' in hd1
+    assert_allclose(header_frequency(hd1), 300.)
+
+    interpol, header, hdu, alpha_map = freq_filling(im1, im2, hd1, hd2, hd3,
+                                                    return_alpha=True)
+    assert_allclose(interpol, amplitude, rtol=1e-12)
+    assert_allclose(alpha_map, alpha, rtol=1e-12)
+    assert header['ACRVAL3'] == 1e11
+    assert header['RESTFRQ'] == 1e11
+    assert_allclose(header_frequency(header), 100.)
+    assert hdu.data is interpol
+
+
+def test_freq_filling_regrids():
+    maps, amplitude, alpha = _power_law_maps([300., 200.], shape=(32, 32))
+    hd1 = celestial_header(32, 32)
+    hd1['RESTFRQ'] = 3e11
+    # the second map covers the same field with pixels twice as large
+    hd2 = celestial_header(16, 16, 2/3600.)
+    hd2['RESTFRQ'] = 2e11
+    im2 = np.full((16, 16), 2.)
+    im1 = np.full((32, 32), 2.*1.5**2)
+    hd3 = fits.Header()
+    hd3['RESTFRQ'] = 1e11
+    interpol = freq_filling(im1, im2, hd1, hd2, hd3)[0]
+    assert interpol.shape == (32, 32)
+    # a constant alpha of 2 away from the edges of the regridded map
+    assert_allclose(interpol[4:-4, 4:-4], 2./4, rtol=1e-6)
+    with pytest.raises(ValueError):
+        freq_filling(im1, im2, hd1, hd2, hd3, model='blackbody')
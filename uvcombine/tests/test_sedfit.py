@@ -0,0 +1,208 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+from astropy.io import fits
+from astropy import units as u
+from astropy import constants
+
+from .. import sedfit
+from ..sedfit import (fit_power_law, fit_modified_blackbody, sed_interpolate,
+                      band_frequencies)
+from ..uvcombine import flux_unit, AKB_interpol, AKB_combine
+from ..filters import get_filter
+from .helpers import celestial_header
+
+BANDS = ['PACS_red', 'SPIRE_PSW', 'SPIRE_PMW', 'SPIRE_PLW']
+
+_trapz = getattr(np, 'trapezoid', None) or np.trapz
+
+
+def _log_mbb(frequency, reference, beta, temperature):
+    """ log(nu**beta B_nu(T)) relative to the reference frequency """
+    hk = (constants.h / constants.k_B).to_value(u.K / u.GHz)
+    def logb(nu):
+        return (3 + beta)*np.log(nu) - np.log(np.expm1(hk*nu/temperature))
+    return logb(frequency) - logb(reference)
+
+
+def _quoted(band, spectrum):
+    """
+    The value quoted at the nominal frequency of ``band`` for an intensity
+    ``spectrum(nu)``, for a reference spectrum nu**-1
+    """
+    filt = get_filter(band)
+    nu0 = filt.frequency.to_value(u.GHz)
+    freq = (filt.wavelength*u.um).to_value(u.GHz, equivalencies=u.spectral())
+    trans = np.asarray(filt.transmission)
+    return (_trapz(trans*spectrum(freq), freq) /
+            _trapz(trans*(freq/nu0)**-1, freq))
+
+
+def test_power_law_monochromatic():
+    rs = np.random.RandomState(0)
+    amplitude = rs.uniform(1, 10, (20, 30))
+    alpha = rs.uniform(1, 4, (20, 30))
+    frequencies = [1875., 1200., 857., 600.]
+    maps = [amplitude*(freq/1000.)**alpha for freq in frequencies]
+    maps[0][2, 3] = -1
+    fit_amplitude, fit_alpha = fit_power_law(maps, frequencies, 1000.,
+                                             chunk_size=100)
+    good = np.ones(amplitude.shape, dtype=bool)
+    good[2, 3] = False
+    assert_allclose(fit_amplitude[good], amplitude[good], rtol=1e-12)
+    assert_allclose(fit_alpha[good], alpha[good], rtol=1e-12)
+    assert np.isnan(fit_amplitude[2, 3]) and np.isnan(fit_alpha[2, 3])
+
+
+def test_power_law_through_passbands():
+    alphas = np.array([1.5, 2.5, 3.5])
+    maps = [np.array([_quoted(band, lambda nu: (nu/1000.)**alpha)
+                      for alpha in alphas]) for band in BANDS]
+    amplitude, alpha = fit_power_law(maps, reference_frequency=1000.,
+                                     bands=BANDS)
+    # limited by the interpolation of the color correction tables
+    assert_allclose(alpha, alphas, rtol=1e-4)
+    assert_allclose(amplitude, 1, rtol=1e-4)
+    # ignoring the band shapes is much worse
+    naive = fit_power_law(maps, band_frequencies(BANDS), 1000.)[1]
+    assert np.abs(naive - alphas).max() > 10*np.abs(alpha - alphas).max()
+
+
+@pytest.mark.parametrize('beta', [None, 1.8])
+def test_modified_blackbody_monochromatic(beta):
+    frequencies = np.array([4283., 1875., 1200., 857., 600.])
+    temperature = np.array([[12., 18.], [25., 40.]])
+    true_beta = np.array([[1.5, 1.8], [2.0, 1.8]]) if beta is None else beta
+    amplitude = np.array([[1., 5.], [20., 3.]])
+    maps = [amplitude*np.exp(_log_mbb(freq, 600., true_beta, temperature))
+            for freq in frequencies]
+    fit = fit_modified_blackbody(maps, frequencies, 600., beta=beta)
+    assert_allclose(fit[0], amplitude, rtol=1e-6)
+    assert_allclose(fit[1], true_beta, rtol=1e-6)
+    assert_allclose(fit[2], temperature, rtol=1e-6)
+
+    # evaluated elsewhere
+    interpol = sed_interpolate(maps, None, 345., model='mbb',
+                               frequencies=frequencies, beta=beta)
+    expected = amplitude*np.exp(_log_mbb(345., 600., true_beta, temperature))
+    assert_allclose(interpol, expected, rtol=1e-6)
+
+
+def test_modified_blackbody_through_passbands():
+    temperature, beta = 20., 1.8
+    maps = [np.array([_quoted(band, lambda nu: np.exp(
+        _log_mbb(nu, 600., beta, temperature)))]) for band in BANDS]
+    amplitude, fit_beta, fit_temperature = fit_modified_blackbody(
+        maps, reference_frequency=600., beta=beta, bands=BANDS)
+    assert_allclose(fit_temperature, temperature, rtol=1e-3)
+    assert_allclose(amplitude, 1, rtol=1e-3)
+
+
+def test_fit_errors():
+    maps = [np.ones(4)] * 2
+    with pytest.raises(ValueError):
+        fit_modified_blackbody(maps, [600., 857.])
+    with pytest.raises(ValueError):
+        fit_power_law(maps, [600.])
+    with pytest.raises(ValueError):
+        sed_interpolate(maps, None, 345., model='greybody',
+                        frequencies=[600., 857.])
+
+
+def test_color_tables_are_memoized():
+    sedfit._named_color_table.cache_clear()
+    frequencies = band_frequencies(BANDS)
+    table = sedfit._color_table(sedfit._power_law_color_table, BANDS,
+                                frequencies)
+    again = sedfit._color_table(sedfit._power_law_color_table, list(BANDS),
+                                frequencies)
+    assert again is table and not table.flags.writeable
+    info = sedfit._named_color_table.cache_info()
+    assert info.hits == 1 and info.maxsize == 32
+    # tables of passband arrays are not memoized
+    bands = [tuple(get_filter(band)) for band in BANDS]
+    assert sedfit._color_table(sedfit._power_law_color_table, bands,
+                               frequencies) is not table
+
+
+def test_flux_unit():
+    image = np.ones((4, 4))
+    header = celestial_header(4, 4)
+    assert flux_unit(image, header)[0] is image
+
+    header['BUNIT'] = 'MJy/sr'
+    converted, newheader = flux_unit(image, header)
+    assert_allclose(converted, (1*u.MJy/u.sr).to_value(u.Jy/u.arcsec**2))
+    assert u.Unit(newheader['BUNIT']) == u.Jy/u.arcsec**2
+    assert header['BUNIT'] == 'MJy/sr'
+
+    header['BUNIT'] = 'Jy/beam'
+    with pytest.raises(ValueError):
+        flux_unit(image, header)
+    header['BMAJ'] = header['BMIN'] = 10/3600.
+    assert_allclose(flux_unit(image, header)[0],
+                    1/(np.pi/(4*np.log(2))*100))
+
+    # upper-case units are common in FITS headers
+    header['BUNIT'] = 'JY/BEAM'
+    assert_allclose(flux_unit(image, header)[0],
+                    1/(np.pi/(4*np.log(2))*100))
+
+    header['BUNIT'] = 'Jy/pixel'
+    # 1" pixels
+    assert_allclose(flux_unit(image, header)[0], 1)
+    header['BUNIT'] = 'JY/PIXEL'
+    assert_allclose(flux_unit(image, header)[0], 1)
+    header['BUNIT'] = 'MJY/SR'
+    assert_allclose(flux_unit(image, header)[0],
+                    (1*u.MJy/u.sr).to_value(u.Jy/u.arcsec**2))
+
+    header['BUNIT'] = 'K'
+    header['RESTFRQ'] = 1e11
+    expected = (1*u.K).to_value(u.Jy/u.arcsec**2,
+                                equivalencies=u.brightness_temperature(
+                                    100*u.GHz))
+    assert_allclose(flux_unit(image, header)[0], expected)
+
+    for bunit in ('furlongs', 'm/s'):
+        header['BUNIT'] = bunit
+        with pytest.raises(ValueError):
+            flux_unit(image, header)
+
+
+def test_akb_combine_bunit(tmpdir):
+    header = celestial_header(32, 32, 5/3600.)
+    header['BUNIT'] = 'MJY/SR'
+    hires = fits.PrimaryHDU(np.ones((32, 32)), header)
+    lores = fits.PrimaryHDU(np.ones((32, 32)), header)
+    with tmpdir.as_cwd():
+        AKB_combine(hires, lores, lowresfwhm=30*u.arcsec)
+        header = fits.getheader('output.fits')
+    # the output is labelled with the unit it was converted to
+    assert u.Unit(header['BUNIT']) == u.Jy/u.arcsec**2
+    assert hires.header['BUNIT'] == 'MJY/SR'
+
+
+def test_akb_interpol(tmpdir):
+    def hdu(data, restfrq, bmaj):
+        header = celestial_header(64, 64, 5/3600.)
+        header['RESTFRQ'] = restfrq
+        header['BMAJ'] = header['BMIN'] = bmaj/3600.
+        header['BUNIT'] = 'MJy/sr'
+        return fits.PrimaryHDU(data, header)
+
+    amplitude = 1.5
+    lores1 = hdu(np.full((64, 64), amplitude), 857e9, 20.)
+    lores2 = hdu(np.full((64, 64), amplitude*(545/857.)**3), 545e9, 30.)
+    hires = hdu(np.zeros((64, 64)), 100e9, 5.)
+    outname = str(tmpdir.join('interpolated.fits'))
+    result = AKB_interpol(lores1, lores2, hires, outfitsname=outname)
+
+    expected = ((1*u.MJy/u.sr).to_value(u.Jy/u.arcsec**2) *
+                amplitude*(100/857.)**3)
+    # lores1 is smoothed to the 30" beam, which spoils the edges
+    assert_allclose(result.data[10:-10, 10:-10], expected, rtol=1e-10)
+    assert u.Unit(result.header['BUNIT']) == u.Jy/u.arcsec**2
+    assert result.header['BMAJ'] == 30/3600.
+    assert_allclose(result.header['RESTFRQ'], 1e11)
+    assert_allclose(fits.getdata(outname), result.data)
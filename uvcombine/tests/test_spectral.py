@@ -0,0 +1,163 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose, assert_array_equal
+from astropy import units as u
+from astropy.io import fits
+
+from ..uvcombine import (spectral_regrid, spectral_smooth_and_downsample,
+                         _spectral_interp, _spectral_interp_weights)
+from .helpers import celestial_header
+
+pytest.importorskip('spectral_cube')
+
+
+def _cube(nchan=20, nx=7, ny=5, seed=3, cdelt3=1e6):
+    from spectral_cube import SpectralCube
+    from astropy.wcs import WCS
+    header = celestial_header(nx, ny, nchan=nchan, cdelt3=cdelt3)
+    header['BUNIT'] = 'K'
+    data = np.random.RandomState(seed).randn(nchan, ny, nx)
+    return SpectralCube(data=data * u.K, wcs=WCS(header)), data
+
+
+def _interp_loop(inaxis, outaxis, data):
+    """ The per-spectrum loop that the vectorized interpolation replaces """
+    newdata = np.empty((outaxis.size,) + data.shape[1:])
+    for jj in range(data.shape[1]):
+        for ii in range(data.shape[2]):
+            newdata[:, jj, ii] = np.interp(outaxis, inaxis, data[:, jj, ii])
+    return newdata
+
+
+def test_spectral_interp_matches_numpy():
+    rs = np.random.RandomState(0)
+    inaxis = np.cumsum(rs.uniform(0.5, 1.5, 30))
+    # off both ends, on input channels and in between
+    outaxis = np.concatenate([[inaxis[0] - 1], inaxis[::3],
+                              np.linspace(inaxis[0], inaxis[-1], 41),
+                              [inaxis[-1] + 1]])
+    outaxis.sort()
+    data = rs.randn(30, 4, 6)
+    data[5, 1, 2] = np.nan
+    data[0, 3, 0] = np.nan
+    data[-1, 2, 5] = np.nan
+    weights = _spectral_interp_weights(inaxis, outaxis)
+    assert_array_equal(_spectral_interp(data, weights),
+                       _interp_loop(inaxis, outaxis, data))
+
+
+def test_spectral_interp_out():
+    inaxis = np.arange(10.)
+    outaxis = np.linspace(0, 9, 19)
+    data = np.random.RandomState(1).randn(10, 3)
+    out = np.empty((19, 3))
+    result = _spectral_interp(data, _spectral_interp_weights(inaxis, outaxis),
+                              out=out)
+    assert result is out
+    for spectrum, newspectrum in zip(data.T, out.T):
+        assert_array_equal(newspectrum, np.interp(outaxis, inaxis, spectrum))
+
+
+def test_spectral_regrid_matches_interp():
+    cube, data = _cube()
+    inaxis = cube.spectral_axis.to(u.Hz).value
+    outgrid = np.linspace(inaxis[1], inaxis[-2], 25) * u.Hz
+    hdu = spectral_regrid(cube, outgrid)
+    assert hdu.data.shape == (25, 5, 7)
+    assert_allclose(hdu.data, _interp_loop(inaxis, outgrid.value, data),
+                    rtol=1e-14)
+    assert hdu.header['CRPIX3'] == 1
+    assert_allclose(hdu.header['CRVAL3'], outgrid[0].value)
+    assert_allclose(hdu.header['CDELT3'], np.diff(outgrid.value).mean())
+
+
+def test_spectral_regrid_decreasing_axes():
+    cube, data = _cube(cdelt3=-1e6)
+    inaxis = cube.spectral_axis.to(u.Hz).value
+    outgrid = np.linspace(inaxis[1], inaxis[-2], 25) * u.Hz
+    hdu = spectral_regrid(cube, outgrid)
+    # the output is increasing
+    expected = _interp_loop(inaxis[::-1], outgrid.value[::-1], data[::-1])
+    assert_allclose(hdu.data, expected, rtol=1e-14)
+    assert hdu.header['CDELT3'] > 0
+
+
+def test_spectral_regrid_too_coarse():
+    cube, _ = _cube()
+    inaxis = cube.spectral_axis.to(u.Hz).value
+    with pytest.raises(ValueError):
+        spectral_regrid(cube, np.linspace(inaxis[0], inaxis[-1], 5) * u.Hz)
+
+
+def test_spectral_regrid_tiles_and_file(tmpdir):
+    cube, _ = _cube(nx=9, ny=7)
+    inaxis = cube.spectral_axis.to(u.Hz).value
+    outgrid = np.linspace(inaxis[0], inaxis[-1], 30) * u.Hz
+    whole = spectral_regrid(cube, outgrid)
+
+    tiled = spectral_regrid(cube, outgrid, tile_size=4)
+    assert_array_equal(tiled.data, whole.data)
+
+    outname = str(tmpdir.join('regridded.fits'))
+    ondisk = spectral_regrid(cube, outgrid, tile_size=4, outname=outname,
+                             dtype=np.float32)
+    assert ondisk.header['BITPIX'] == -32
+    assert_allclose(ondisk.data, whole.data, rtol=1e-6)
+    with fits.open(outname) as hdul:
+        assert hdul[0].data.shape == (30, 7, 9)
+        assert hdul[0].header['CRVAL3'] == whole.header['CRVAL3']
+
+    with pytest.raises(OSError):
+        spectral_regrid(cube, outgrid, outname=outname)
+    spectral_regrid(cube, outgrid, outname=outname, overwrite=True)
+
+
+def _smooth_full(data, kernelwidth, dsfactor):
+    """ Smooth every channel, normalizing over valid channels, then decimate """
+    sigma = kernelwidth / np.sqrt(8*np.log(2))
+    half = int(np.ceil(4*sigma))
+    taps = np.arange(-half, half+1)
+    kernel = np.exp(-0.5 * (taps / sigma)**2)
+    nchan = data.shape[0]
+    out = np.empty(data.shape)
+    for jj in range(data.shape[1]):
+        for ii in range(data.shape[2]):
+            spectrum = data[:, jj, ii]
+            valid = np.isfinite(spectrum)
+            total = np.convolve(np.where(valid, spectrum, 0), kernel, 'same')
+            weight = np.convolve(valid.astype(float), kernel, 'same')
+            out[:, jj, ii] = total / weight
+    assert out.shape[0] == nchan
+    return out[::dsfactor]
+
+
+@pytest.mark.parametrize(('kernelwidth', 'dsfactor'),
+                         [(3.5, None), (4, 2), (2, 5), (1, 1)])
+def test_smooth_and_downsample_matches_full_smoothing(kernelwidth, dsfactor):
+    cube, data = _cube(nchan=23)
+    data[4, 2, 3] = np.nan
+    cube = cube._new_cube_with(data=data)
+    hdu = spectral_smooth_and_downsample(cube, kernelwidth, dsfactor)
+    expected = _smooth_full(data, kernelwidth,
+                            dsfactor or int(np.floor(kernelwidth)))
+    assert hdu.data.shape == expected.shape
+    assert_allclose(hdu.data, expected, rtol=1e-12, atol=1e-14)
+
+
+def test_smooth_and_downsample_header(tmpdir):
+    from astropy.wcs import WCS
+    cube, _ = _cube(nchan=23)
+    dsfactor = 3
+    hdu = spectral_smooth_and_downsample(cube, 3.2, dsfactor)
+    assert hdu.data.shape[0] == 8
+    # output channel k is input channel k*dsfactor
+    outaxis = WCS(hdu.header).spectral.pixel_to_world_values(np.arange(8))
+    assert_allclose(outaxis, cube.spectral_axis.to(u.Hz).value[::dsfactor])
+
+    outname = str(tmpdir.join('smoothed.fits'))
+    ondisk = spectral_smooth_and_downsample(cube, 3.2, dsfactor, tile_size=3,
+                                            outname=outname)
+    assert_allclose(ondisk.data, hdu.data, rtol=1e-14)
+
+    with pytest.raises(ValueError):
+        spectral_smooth_and_downsample(cube, 0.5)
@@ -0,0 +1,93 @@
+import json
+import tracemalloc
+
+import numpy as np
+from astropy import units as u
+
+from ..tracing import Tracer, trace, stage, get_tracer
+from ..uvcombine import feather_simple
+from .helpers import image_pair
+
+MB = 1024**2
+
+
+def _allocate(nbytes):
+    data = np.ones(nbytes // 8)
+    return data.sum()
+
+
+def test_stage_without_tracer():
+    assert get_tracer() is None
+    with stage('nothing'):
+        pass
+
+
+def test_per_stage_peak_memory():
+    with trace() as tracer:
+        assert tracemalloc.is_tracing()
+        with stage('outer'):
+            with stage('big'):
+                _allocate(8*MB)
+            with stage('small'):
+                _allocate(1*MB)
+    assert not tracemalloc.is_tracing()
+
+    records = dict((record['name'], record) for record in tracer.records)
+    assert records['big']['peak_memory_increase'] >= 8*MB
+    # the peak is reset between stages, so the small stage does not inherit
+    # the peak of the big one
+    assert 1*MB <= records['small']['peak_memory_increase'] < 2*MB
+    assert records['outer']['peak_memory'] >= records['big']['peak_memory']
+    assert records['outer']['depth'] == 0 and records['big']['depth'] == 1
+    assert records['big']['wall_time'] >= 0 and records['big']['cpu_time'] >= 0
+
+
+def test_summary_takes_the_largest_peak():
+    with trace() as tracer:
+        for nbytes in (2*MB, 4*MB, 1*MB):
+            with stage('allocate', nbytes=nbytes):
+                _allocate(nbytes)
+    summary = tracer.summary()['allocate']
+    assert summary['calls'] == 3
+    assert 4*MB <= summary['peak_memory_increase'] < 5*MB
+    assert summary['wall_time'] == sum(record['wall_time']
+                                       for record in tracer.records)
+    assert tracer.records[1]['metadata'] == dict(nbytes=4*MB)
+
+
+def test_memory_off_and_callback():
+    seen = []
+    with Tracer(callback=seen.append, memory=False) as tracer:
+        assert not tracemalloc.is_tracing()
+        with stage('stage'):
+            _allocate(MB)
+    assert seen == tracer.records
+    assert seen[0]['peak_memory'] is None
+    assert tracer.summary()['stage']['peak_memory'] is None
+
+
+def test_leaves_running_tracemalloc_on():
+    tracemalloc.start()
+    try:
+        with trace():
+            pass
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+
+def test_feather_simple_stages(tmpdir):
+    hires, lores = image_pair()
+    with trace() as tracer:
+        feather_simple(hires, lores, lowresfwhm=10*u.arcsec, rfft=True)
+    names = list(tracer.summary())
+    for name in ('file_in', 'regrid', 'feather_kernel', 'fftmerge'):
+        assert name in names
+
+    report = json.loads(tracer.to_json())
+    assert len(report['records']) == len(tracer.records)
+    filename = str(tmpdir.join('feather.trace.json'))
+    tracer.to_chrome_trace(filename)
+    with open(filename) as fh:
+        events = json.load(fh)['traceEvents']
+    assert set(event['ph'] for event in events) == set('XC')
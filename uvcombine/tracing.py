@@ -0,0 +1,284 @@
+"""
+Per-stage timing and memory instrumentation of the combination pipeline.
+
+The pipeline functions (`~uvcombine.uvcombine.AKB_combine`,
+`~uvcombine.uvcombine.feather_simple`) mark their stages with `stage`.
+Nothing is recorded unless a `Tracer` is active, so the markers cost next to
+nothing in normal runs::
+
+    >>> from uvcombine import tracing
+    >>> with tracing.trace() as tracer:               # doctest: +SKIP
+    ...     combo = feather_simple('hires.fits', 'lores.fits',
+    ...                            lowresfwhm=30*u.arcsec)
+    >>> print(tracer.summary())                       # doctest: +SKIP
+    >>> tracer.to_chrome_trace('feather.trace.json')  # doctest: +SKIP
+
+The Chrome trace can be loaded in ``chrome://tracing`` or
+https://ui.perfetto.dev.
+"""
+import os
+import sys
+import json
+import time
+import threading
+import contextlib
+import tracemalloc
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+__all__ = ['Tracer', 'trace', 'stage', 'get_tracer', 'peak_rss']
+
+_local = threading.local()
+
+# Python >= 3.9; before, each peak is the largest since tracing started
+_reset_peak = getattr(tracemalloc, 'reset_peak', lambda: None)
+
+
+def peak_rss():
+    """
+    The peak resident set size of this process so far, in bytes, or `None`
+    where it is not available.  This is the lifetime peak; `Tracer` measures
+    the peak memory of each stage instead.
+    """
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+class Tracer(object):
+    """
+    Record the wall time, CPU time and peak memory of the stages run while it
+    is active.
+
+    The memory is measured with `tracemalloc`, which sees the numpy arrays
+    as well as Python objects, and is started by the tracer while it is
+    active (unless it is already running).  tracing allocations slows down
+    code that creates many small Python objects, but hardly the array
+    operations of the pipeline.  Its peak is process-wide, so stages run
+    concurrently in other threads count towards each other's peaks.
+
+    Each stage is recorded as a dictionary with the keys
+
+    ``name``
+        The stage name
+    ``start``
+        The start time, in seconds since the tracer was created
+    ``wall_time``, ``cpu_time``
+        The elapsed wall-clock and process CPU time in seconds.  The CPU time
+        includes every thread of the process, so it exceeds the wall time
+        when the FFT backend or numpy is multithreaded.
+    ``peak_memory``
+        The peak traced memory of the process during the stage, in bytes
+    ``peak_memory_increase``
+        The peak traced memory during the stage beyond that allocated when it
+        started, i.e. the working memory the stage needed
+    ``depth``
+        The nesting level (0 for stages outside any other stage)
+    ``pid``, ``tid``
+        The process and thread that ran the stage
+    ``metadata``
+        The keyword arguments given to `stage`
+
+    Parameters
+    ----------
+    callback : callable or None
+        Called with each record as its stage ends, e.g. to log the stages of
+        a long run as they happen.
+    memory : bool
+        Measure the memory of the stages.  Otherwise ``peak_memory`` and
+        ``peak_memory_increase`` are `None`.
+    """
+
+    def __init__(self, callback=None, memory=True):
+        self.callback = callback
+        self.memory = memory
+        self.records = []
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+        self._depth = threading.local()
+        # the running peaks of the open stages of every thread
+        self._open = []
+        self._started_tracemalloc = False
+
+    def _update_peaks(self):
+        """
+        Fold the peak traced memory since the last stage boundary into the
+        peaks of the open stages and restart the peak.  Returns the current
+        traced memory.
+        """
+        current, peak = tracemalloc.get_traced_memory()
+        for entry in self._open:
+            entry['peak'] = max(entry['peak'], peak)
+        _reset_peak()
+        return current
+
+    @contextlib.contextmanager
+    def stage(self, name, **metadata):
+        """
+        A context manager recording the enclosed code as stage ``name``.
+        """
+        depth = getattr(self._depth, 'value', 0)
+        self._depth.value = depth + 1
+        memory = self.memory and tracemalloc.is_tracing()
+        if memory:
+            with self._lock:
+                current = self._update_peaks()
+                entry = dict(start=current, peak=current)
+                self._open.append(entry)
+        cpu0 = time.process_time()
+        wall0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall1 = time.perf_counter()
+            cpu1 = time.process_time()
+            peak = increase = None
+            if memory:
+                with self._lock:
+                    self._update_peaks()
+                    self._open.remove(entry)
+                peak = entry['peak']
+                increase = peak - entry['start']
+            self._depth.value = depth
+            record = dict(name=name, start=wall0 - self._t0,
+                          wall_time=wall1 - wall0, cpu_time=cpu1 - cpu0,
+                          peak_memory=peak, peak_memory_increase=increase,
+                          depth=depth, pid=os.getpid(),
+                          tid=threading.current_thread().ident,
+                          metadata=metadata)
+            with self._lock:
+                self.records.append(record)
+            if self.callback is not None:
+                self.callback(record)
+
+    def __enter__(self):
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        stack = getattr(_local, 'tracers', None)
+        if stack is None:
+            stack = _local.tracers = []
+        stack.append(self)
+        return self
+
+    def __exit__(self, *exc):
+        _local.tracers.remove(self)
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def summary(self):
+        """
+        Return an ordered dictionary of the number of calls, the total wall
+        and CPU time, and the largest peak memory and peak memory increase of
+        any call of every stage, in order of first appearance.  The peaks are
+        not added up, since the memory of one call is freed before the next.
+        """
+        summary = OrderedDict()
+        for record in sorted(self.records, key=lambda rec: rec['start']):
+            entry = summary.setdefault(record['name'],
+                                       dict(calls=0, wall_time=0.,
+                                            cpu_time=0.,
+                                            peak_memory=None,
+                                            peak_memory_increase=None))
+            entry['calls'] += 1
+            entry['wall_time'] += record['wall_time']
+            entry['cpu_time'] += record['cpu_time']
+            for key in ('peak_memory', 'peak_memory_increase'):
+                if record[key] is not None:
+                    entry[key] = max(entry[key] or 0, record[key])
+        return summary
+
+    def to_dict(self):
+        """ The records and their summary, as plain Python objects """
+        return dict(records=sorted(self.records,
+                                   key=lambda rec: rec['start']),
+                    summary=self.summary())
+
+    def to_json(self, filename=None, **kwargs):
+        """
+        Return the records and summary (see `to_dict`) as a JSON string, or
+        write them to ``filename``.  ``kwargs`` are passed to `json.dumps`.
+        """
+        kwargs.setdefault('indent', 2)
+        text = json.dumps(self.to_dict(), default=str, **kwargs)
+        if filename is None:
+            return text
+        with open(filename, 'w') as fh:
+            fh.write(text)
+
+    def chrome_trace_events(self):
+        """
+        The records as Chrome trace events: a complete (``"X"``) event per
+        stage, with the CPU time and memory in its ``args``, and a
+        ``peak_memory`` counter (``"C"``) event at the end of each stage.
+        """
+        events = []
+        for record in sorted(self.records, key=lambda rec: rec['start']):
+            args = dict(record['metadata'], cpu_time=record['cpu_time'],
+                        peak_memory=record['peak_memory'],
+                        peak_memory_increase=record['peak_memory_increase'])
+            events.append(dict(name=record['name'], cat='uvcombine',
+                               ph='X', ts=record['start']*1e6,
+                               dur=record['wall_time']*1e6,
+                               pid=record['pid'], tid=record['tid'],
+                               args=args))
+            if record['peak_memory'] is not None:
+                events.append(dict(name='peak_memory', ph='C',
+                                   ts=(record['start'] +
+                                       record['wall_time'])*1e6,
+                                   pid=record['pid'],
+                                   args=dict(bytes=record['peak_memory'])))
+        return events
+
+    def to_chrome_trace(self, filename=None):
+        """
+        Return the records in the Chrome trace event format as a JSON
+        string, or write them to ``filename``.
+        """
+        text = json.dumps(dict(traceEvents=self.chrome_trace_events(),
+                               displayTimeUnit='ms'),
+                          default=str)
+        if filename is None:
+            return text
+        with open(filename, 'w') as fh:
+            fh.write(text)
+
+
+def get_tracer():
+    """
+    The innermost active `Tracer` of this thread, or `None`.
+    """
+    stack = getattr(_local, 'tracers', None)
+    return stack[-1] if stack else None
+
+
+def trace(callback=None, memory=True):
+    """
+    Return a new `Tracer`, to be used as a context manager that records the
+    pipeline stages run in the ``with`` block (in this thread).
+    """
+    return Tracer(callback=callback, memory=memory)
+
+
+@contextlib.contextmanager
+def _nostage():
+    yield
+
+
+def stage(name, **metadata):
+    """
+    A context manager marking the enclosed code as pipeline stage ``name``.
+    It is recorded by the active `Tracer` if there is one and does nothing
+    otherwise.
+    """
+    tracer = get_tracer()
+    if tracer is None:
+        return _nostage()
+    return tracer.stage(name, **metadata)
@@ -1,18 +1,59 @@
-import image_tools
-from FITS_tools.hcongrid import hcongrid_hdu
-import FITS_tools
-from spectral_cube import SpectralCube
 from astropy.io import fits
 from astropy import units as u
 from astropy import log
-from astropy.convolution import convolve, Gaussian2DKernel
-from astropy.utils.console import ProgressBar
 import numpy as np
+import os
+import re
+import sys
+import importlib
+import contextlib
+
+from .fft_backends import get_fft_backend
+from .cache import kernel_cache, regrid_cache, regrid_cache_key
+from .tracing import stage
+
+# Heavy dependencies are imported by the functions that need them, so that
+# importing uvcombine stays fast.  They remain available as attributes of
+# this module, imported on first access (PEP 562).
+_lazy_attributes = {'WCS': ('astropy.wcs', 'WCS'),
+                    'image_tools': ('image_tools', None),
+                    'FITS_tools': ('FITS_tools', None),
+                    'hcongrid_hdu': ('FITS_tools.hcongrid', 'hcongrid_hdu'),
+                    'SpectralCube': ('spectral_cube', 'SpectralCube'),
+                    'convolve': ('astropy.convolution', 'convolve'),
+                    'Gaussian2DKernel': ('astropy.convolution',
+                                         'Gaussian2DKernel'),
+                    'ProgressBar': ('astropy.utils.console', 'ProgressBar'),
+                   }
+
+
+def __getattr__(name):
+    if name not in _lazy_attributes:
+        raise AttributeError("module {0!r} has no attribute {1!r}"
+                             .format(__name__, name))
+    modname, attr = _lazy_attributes[name]
+    value = importlib.import_module(modname)
+    if attr is not None:
+        value = getattr(value, attr)
+    globals()[name] = value
+    return value
+
+
+def _is_spectral_cube(obj):
+    """
+    Whether ``obj`` is a `~spectral_cube.SpectralCube`, without importing
+    spectral_cube: if it has not been imported, ``obj`` cannot be one.
+    """
+    spectral_cube = sys.modules.get('spectral_cube')
+    return (spectral_cube is not None and
+            isinstance(obj, spectral_cube.SpectralCube))
 
-def file_in(filename, extnum=0):
+def file_in(filename, extnum=0, memmap=None, section=None):
     """
     Take the input files. If input is already HDU, then return it.
     If input is a .fits filename, then read the .fits file.
+
+    The file is left open; use `open_file_in` to close it when done.
    
     Return
     ----------
@@ -29,23 +70,125 @@ def file_in(filename, extnum=0):
          The input .fits filename or a HDU variable name
     extnum   : int
          The extension number to use from the input .fits file
+    memmap   : bool or None
+         Passed to `astropy.io.fits.open`.  With ``memmap=True`` the returned
+         image is a view onto the memory-mapped file and is only read from
+         disk when it is accessed.
+    section  : tuple of slices or None
+         Only return this part of the image, e.g. a spatial cutout
+         ``(slice(y0,y1), slice(x0,x1))`` or a channel range
+         ``(slice(c0,c1),)``.  The slices index the image after its
+         degenerate axes are dropped.  With ``memmap=True`` the section is a
+         view onto the file; otherwise only the section is read from disk.
+         The returned header is updated to describe the section.
     """
     if isinstance(filename, (fits.ImageHDU, fits.PrimaryHDU)):
         hdu = filename
     else:
-        hdu = fits.open(filename)[extnum]
-   
-    im = hdu.data.squeeze()
-    header = FITS_tools.strip_headers.flatten_header(hdu.header)
-   
+        hdu = fits.open(filename, memmap=memmap)[extnum]
+
+    if section is None:
+        im = hdu.data.squeeze()
+        header = hdu.header
+    else:
+        key, header = _section_key(hdu.shape, hdu.header, section)
+        if memmap or isinstance(filename, (fits.ImageHDU, fits.PrimaryHDU)):
+            im = hdu.data[key]
+        else:
+            im = hdu.section[key]
+
+    import FITS_tools
+    header = FITS_tools.strip_headers.flatten_header(header)
+
     return hdu, im, header
 
 
 
+@contextlib.contextmanager
+def open_file_in(filename, extnum=0, memmap=True, section=None):
+    """
+    Context-managed version of `file_in` that closes the file on exit.
+    By default the data are memory-mapped, so nothing is read until the image
+    is accessed.  The image must not be used after the ``with`` block; copy
+    it (e.g. ``np.array(im)``) to keep it.
+
+    Example
+    -------
+    >>> with open_file_in('cube.fits', section=(slice(0, 10),)) as (hdu, im, header): # doctest: +SKIP
+    ...     spectrum_mean = im.mean(axis=(1,2))
+    """
+    if isinstance(filename, (fits.ImageHDU, fits.PrimaryHDU)):
+        yield file_in(filename, extnum, memmap=memmap, section=section)
+        return
+
+    with fits.open(filename, memmap=memmap) as hdul:
+        yield file_in(hdul[extnum], memmap=memmap, section=section)
+
+
+
+def _section_key(shape, header, section):
+    """
+    Convert ``section``, a tuple of slices over the non-degenerate axes of an
+    image of ``shape``, into an index over all of its axes, and return it
+    with a copy of ``header`` whose NAXISn and CRPIXn describe the section.
+    """
+    if not isinstance(section, tuple):
+        section = (section,)
+    axes = [ii for ii, size in enumerate(shape) if size != 1]
+    if len(section) > len(axes):
+        raise ValueError("The section has more axes than the image.")
+
+    header = header.copy()
+    key = [0 if size == 1 else slice(None) for size in shape]
+    for axis, slc in zip(axes, section):
+        if not isinstance(slc, slice) or slc.step not in (None, 1):
+            raise ValueError("Sections must be contiguous slices.")
+        start, stop, _ = slc.indices(shape[axis])
+        key[axis] = slice(start, stop)
+        # numpy axes are in the reverse order of the FITS axes
+        fitsaxis = len(shape) - axis
+        header['NAXIS{0}'.format(fitsaxis)] = max(stop - start, 0)
+        if 'CRPIX{0}'.format(fitsaxis) in header:
+            header['CRPIX{0}'.format(fitsaxis)] -= start
+
+    return tuple(key), header
+
+
+
+#: Unit names of upper-case BUNITs (e.g. JY/BEAM), by upper-case name
+_bunit_aliases = {'JY': 'Jy', 'MJY': 'MJy', 'BEAM': 'beam', 'SR': 'sr',
+                  'PIXEL': 'pixel', 'PIX': 'pix', 'ARCSEC': 'arcsec',
+                  'DEG': 'deg', 'K': 'K'}
+
+
+def _parse_bunit(bunit):
+    """
+    Parse a BUNIT as a FITS unit string, falling back to case-insensitive
+    unit names (`_bunit_aliases`) for upper-case headers.
+    """
+    unit = u.Unit(bunit, format='fits', parse_strict='silent')
+    if isinstance(unit, u.UnrecognizedUnit):
+        aliased = re.sub('[A-Za-z]+',
+                         lambda name: _bunit_aliases.get(name.group().upper(),
+                                                         name.group()),
+                         bunit)
+        unit = u.Unit(aliased, parse_strict='silent')
+    if isinstance(unit, u.UnrecognizedUnit):
+        raise ValueError("Unrecognized BUNIT '{0}'.".format(bunit))
+    return unit
+
+
+
 def flux_unit(image, header):
     """
     Convert all possible units to un-ambiguous unit like Jy/pixel or Jy/arcsec^2.
 
+    The unit is read from the BUNIT keyword, in any case (e.g. JY/BEAM).
+    Surface brightness units (e.g. MJy/sr) are converted directly; Jy/beam
+    needs the BMAJ and BMIN keywords, Jy/pixel the celestial WCS and
+    brightness temperatures (K) the observing frequency (see
+    `header_frequency`).  Images without a BUNIT are returned unchanged.
+
     Parameter/Return
     ----------------
     image : (float point?) array
@@ -54,13 +197,44 @@ def flux_unit(image, header):
     header : header object
        Header of the input/output image
     """
-    raise NotImplementedError
+    bunit = header.get('BUNIT', '').strip()
+    if not bunit:
+        log.debug("No BUNIT in the header; keeping the image units.")
+        return image, header
+
+    target = u.Jy / u.arcsec**2
+    unit = _parse_bunit(bunit)
+
+    if unit.is_equivalent(target):
+        factor = unit.to(target)
+    elif (unit * u.beam).is_equivalent(u.Jy):
+        if 'BMAJ' not in header or 'BMIN' not in header:
+            raise ValueError("Converting {0} needs the beam size (BMAJ and "
+                             "BMIN keywords).".format(bunit))
+        beam_area = (np.pi / (4*np.log(2)) * header['BMAJ'] *
+                     header['BMIN'] * u.deg**2)
+        factor = (unit * u.beam).to(u.Jy) / beam_area.to_value(u.arcsec**2)
+    elif (unit * u.pix).is_equivalent(u.Jy):
+        from astropy.wcs import WCS
+        from astropy.wcs.utils import proj_plane_pixel_area
+        pixel_area = (proj_plane_pixel_area(WCS(header).celestial) *
+                      u.deg**2)
+        factor = (unit * u.pix).to(u.Jy) / pixel_area.to_value(u.arcsec**2)
+    elif unit.is_equivalent(u.K):
+        frequency = header_frequency(header) * u.GHz
+        factor = unit.to(target,
+                         equivalencies=u.brightness_temperature(frequency))
+    else:
+        raise ValueError("Cannot convert BUNIT '{0}' to {1}."
+                         .format(bunit, target))
 
-    return image, header
+    header = header.copy()
+    header['BUNIT'] = target.to_string(format='fits')
+    return image * factor, header
 
 
 
-def regrid(hd1, im1, im2raw, hd2):
+def regrid(hd1, im1, im2raw, hd2, cache=None, mapping=None):
     """
     Regrid the low resolution image to have the same dimension and pixel size with the
     high resolution image.
@@ -75,6 +249,17 @@ def regrid(hd1, im1, im2raw, hd2):
        The pre-regridded low resolution image
     hd2 : header object
        header of the low resolution image
+    cache : None, bool or `~uvcombine.cache.RegridCache`
+       Reuse a previous regridding of the same low resolution image onto the
+       same header.  ``True`` uses the shared `uvcombine.cache.regrid_cache`,
+       which is kept in memory (and on disk if its ``cachedir`` is set).
+       Entries are keyed on a hash of ``im2raw`` and of both headers.  Cached
+       images are returned read-only.
+    mapping : `PixelMapping` or None
+       A precomputed mapping from ``hd2`` onto ``hd1`` (see
+       `PixelMapping.from_headers`).  If given, it is applied with the same
+       cubic interpolation as `FITS_tools.hcongrid.hcongrid` instead of
+       recomputing the coordinate transform.
 
     Returns
     -------
@@ -94,6 +279,8 @@ def regrid(hd1, im1, im2raw, hd2):
     assert hd2['NAXIS'] == im2raw.ndim == 2, 'Error: Input lores image dimension non-equal to 2.'
     assert hd1['NAXIS'] == im1.ndim == 2, 'Error: Input hires image dimension non-equal to 2.'
 
+    import FITS_tools
+
     # read pixel scale from the header of high resolution image
     pixscale = FITS_tools.header_tools.header_to_platescale(hd1)
     log.debug('pixscale = {0}'.format(pixscale))
@@ -103,18 +290,206 @@ def regrid(hd1, im1, im2raw, hd2):
                  hd1['NAXIS2'],
                 )
 
-    # create a new HDU object to store the regridded image
-    hdu2 = fits.PrimaryHDU(data=im2raw, header=hd2)
+    if cache is True:
+        cache = regrid_cache
+    elif cache is False:
+        cache = None
+    if cache is not None:
+        key = regrid_cache_key(im2raw, hd2, hd1)
+        im2 = cache.get(key)
+        if im2 is not None:
+            return fits.PrimaryHDU(data=im2, header=hd1), im2, nax1, nax2, pixscale
+        # hcongrid zeroes bad pixels in place, which would change the key
+        im2raw = im2raw.copy()
+
+    if mapping is not None:
+        im2 = mapping.apply(im2raw, order=3)
+        hdu2 = fits.PrimaryHDU(data=im2, header=hd1)
+    else:
+        # create a new HDU object to store the regridded image
+        hdu2 = fits.PrimaryHDU(data=im2raw, header=hd2)
+
+        # regrid the image
+        from FITS_tools.hcongrid import hcongrid_hdu
+        hdu2 = hcongrid_hdu(hdu2, hd1)
+        im2 = hdu2.data.squeeze()
 
-    # regrid the image
-    hdu2 = hcongrid_hdu(hdu2, hd1)
-    im2 = hdu2.data.squeeze()
+    if cache is not None:
+        cache.put(key, im2)
 
     # return variables
     return hdu2, im2, nax1, nax2, pixscale
 
 
 
+class PixelMapping(object):
+    """
+    A precomputed mapping from the pixels of one image grid onto another,
+    so that any number of images (or cube planes) sharing the input WCS can
+    be reprojected without repeating the WCS-to-WCS coordinate transform.
+
+    The mapping is stored as two float32 (by default) arrays giving, for
+    each output pixel, the (y, x) position in the input image.  In float32
+    these positions are precise to about 1e-7 of the input image size.
+
+    Parameters
+    ----------
+    grid : array
+        The (2, ny_out, nx_out) array of input-image (y, x) pixel positions
+    shape_in : tuple
+        The (ny_in, nx_in) shape of the images the mapping applies to
+
+    Examples
+    --------
+    >>> mapping = PixelMapping.from_headers(lores_header, hires_header) # doctest: +SKIP
+    >>> regridded_cube = mapping.apply(lores_cube) # doctest: +SKIP
+    """
+
+    def __init__(self, grid, shape_in):
+        self.grid = grid
+        self.shape_in = tuple(shape_in)
+        self._bilinear = None
+
+    @classmethod
+    def from_headers(cls, header_from, header_to, dtype=np.float32):
+        """
+        Compute the mapping of images with ``header_from`` onto
+        ``header_to``.  Only the two celestial axes of the headers are used.
+        """
+        import FITS_tools
+        header_from = FITS_tools.strip_headers.flatten_header(header_from)
+        header_to = FITS_tools.strip_headers.flatten_header(header_to)
+        grid = FITS_tools.hcongrid.get_pixel_mapping(header_from, header_to)
+        return cls(np.asarray(grid, dtype=dtype),
+                   (header_from['NAXIS2'], header_from['NAXIS1']))
+
+    @property
+    def shape_out(self):
+        return self.grid.shape[1:]
+
+    @property
+    def nbytes(self):
+        nbytes = self.grid.nbytes
+        if self._bilinear is not None:
+            nbytes += sum(arr.nbytes for arr in self._bilinear)
+        return nbytes
+
+    def save(self, filename):
+        """ Write the mapping to a .npz file """
+        np.savez(filename, grid=self.grid, shape_in=self.shape_in)
+
+    @classmethod
+    def load(cls, filename):
+        """ Read a mapping written by `save` """
+        with np.load(filename) as npz:
+            return cls(npz['grid'], npz['shape_in'])
+
+    def _bilinear_nbytes(self):
+        """
+        The size of `_bilinear_weights` without building it: an index and
+        two offsets per output pixel, 12 bytes for a float32 grid.
+        """
+        ny, nx = self.shape_in
+        index_itemsize = 4 if ny*nx < 2**31 else 8
+        return (int(np.prod(self.shape_out)) *
+                (index_itemsize + 2*self.grid.dtype.itemsize))
+
+    def _bilinear_weights(self):
+        """
+        The flat input index of the lower-left of the four neighbours of
+        every output pixel and the (y, x) offsets of the output pixel from
+        it, computed on first use.
+
+        The index is clipped so that all four neighbours are on the grid;
+        offsets outside [0, 1] (or beyond 0 along an axis of length one) mark
+        positions off the grid.  The other neighbours, the bilinear weights
+        and the nearest neighbour follow from these in `apply`, so only 12
+        bytes are kept per output pixel.
+        """
+        if self._bilinear is None:
+            ny, nx = self.shape_in
+            yy, xx = self.grid.reshape(2, -1)
+            itype = np.int32 if ny*nx < 2**31 else np.int64
+            y0 = np.clip(np.floor(yy), 0, max(ny-2, 0)).astype(itype)
+            x0 = np.clip(np.floor(xx), 0, max(nx-2, 0)).astype(itype)
+            # exact: the positions are float32 and the offsets small
+            offset = np.array([yy - y0, xx - x0], dtype=self.grid.dtype)
+            self._bilinear = (y0*nx + x0, offset)
+        return self._bilinear
+
+    def apply(self, data, order=1, preserve_bad_pixels=True):
+        """
+        Reproject an image, or a stack of images with the spatial axes last.
+
+        Parameters
+        ----------
+        data : array
+            An array of shape ``(..., ny_in, nx_in)``
+        order : int
+            Spline interpolation order.  ``order=1`` uses a vectorized gather
+            of precomputed bilinear weights over all planes at once; other
+            orders call `scipy.ndimage.map_coordinates` plane by plane.
+        preserve_bad_pixels : bool
+            As in `FITS_tools.hcongrid.hcongrid`: set output pixels off the
+            input grid, or whose nearest input neighbour is NaN/inf, to NaN.
+            Otherwise they are set to zero.
+
+        Returns
+        -------
+        newdata : array
+            An array of shape ``(..., ny_out, nx_out)``
+        """
+        data = np.asarray(data)
+        if data.shape[-2:] != self.shape_in:
+            raise ValueError("Image shape {0} does not match the mapping's "
+                             "input shape {1}.".format(data.shape[-2:],
+                                                       self.shape_in))
+        planes = data.reshape((-1,) + self.shape_in)
+        bad = ~np.isfinite(planes)
+        planes = np.where(bad, 0, planes)
+
+        if order == 1:
+            index, (fy, fx) = self._bilinear_weights()
+            ny, nx = self.shape_in
+            dy = nx if ny > 1 else 0
+            dx = 1 if nx > 1 else 0
+            flat = planes.reshape(planes.shape[0], -1)
+            newdata = (1-fy)*(1-fx) * flat[:, index]
+            newdata += (1-fy)*fx * flat[:, index+dx]
+            newdata += fy*(1-fx) * flat[:, index+dy]
+            newdata += fy*fx * flat[:, index+(dy+dx)]
+            # like map_coordinates(mode='constant'), positions outside the
+            # input grid interpolate to zero...
+            outside = ((fy < 0) | (fy > min(ny-1, 1)) |
+                       (fx < 0) | (fx > min(nx-1, 1)))
+            newdata[:, outside] = 0
+            if preserve_bad_pixels:
+                # ...and, like hcongrid, are blanked, as are pixels whose
+                # nearest neighbour is bad
+                nearest = (index + np.where(fy > 0.5, dy, 0) +
+                           np.where(fx > 0.5, dx, 0))
+                nearest[outside] = 0
+                newbad = outside | bad.reshape(flat.shape)[:, nearest]
+                newdata[newbad] = np.nan
+        else:
+            import scipy.ndimage
+            newdata = np.empty((planes.shape[0],) + self.shape_out,
+                               dtype=np.result_type(planes, np.float32))
+            for ii in range(planes.shape[0]):
+                newdata[ii] = scipy.ndimage.map_coordinates(planes[ii],
+                                                            self.grid,
+                                                            order=order)
+                if preserve_bad_pixels:
+                    newbad = scipy.ndimage.map_coordinates(bad[ii], self.grid,
+                                                           order=0,
+                                                           mode='constant',
+                                                           cval=True)
+                    newdata[ii][newbad] = np.nan
+
+        return newdata.reshape(data.shape[:-2] + self.shape_out)
+
+
+
 def pbcorr(fft2, hd1, hd2):
     """
     Divide the fourier transformed low resolution image with its fourier
@@ -164,12 +539,67 @@ def flux_match(fft1, fft2):
     return fft1
 
 
-def color_correction_factors(n_center_hi, n_center_lo, pb_hi, pb_lo, alpha):
+def _trapezoid_weights(x):
+    """
+    The weights ``w`` such that ``np.sum(w*y)`` is the trapezoid-rule
+    integral of ``y`` sampled at ``x``.
+    """
+    dx = np.diff(np.asarray(x, dtype=float))
+    weights = np.zeros(dx.size + 1)
+    weights[:-1] += dx/2
+    weights[1:] += dx/2
+    return weights
+
+
+def _passband(pb, n_center):
+    """
+    Return a passband as the log frequency ratios ``log(nu/n_center)`` and
+    the integration weights (trapezoid weights times response) in frequency.
+    ``pb`` may be a ``(wavelength, response)`` pair or the name of a filter
+    in `uvcombine.filters.filter_registry`; ``n_center`` defaults to the
+    nominal frequency of the filter.
+    """
+    if isinstance(pb, str):
+        from .filters import get_filter
+        pb = get_filter(pb)
+    if n_center is None:
+        if getattr(pb, 'frequency', None) is None:
+            raise ValueError("A nominal frequency is needed for a passband "
+                             "without one.")
+        n_center = pb.frequency.to_value(u.GHz)
+    wv, response = pb
+    freq = (np.asarray(wv)*u.um).to_value(u.GHz, equivalencies=u.spectral())
+    return (np.log(freq/n_center),
+            _trapezoid_weights(freq)*np.asarray(response), n_center)
+
+
+def _power_law_integrals(logratio, weights, alpha, maxsize=2**22):
+    """
+    The integrals ``trapz(response*(nu/n_center)**alpha, nu)`` of one
+    passband (see `_passband`) for every ``alpha`` in the 1-D array
+    ``alpha``, as matrix-vector products against the weights, in blocks of
+    at most ``maxsize`` elements.
+    """
+    out = np.empty(alpha.size)
+    block = max(1, maxsize // logratio.size)
+    for start in range(0, alpha.size, block):
+        powers = np.exp(np.multiply.outer(alpha[start:start+block],
+                                          logratio))
+        np.dot(powers, weights, out=out[start:start+block])
+    return out
+
+
+def color_correction_factors(n_center_hi, n_center_lo, pb_hi, pb_lo, alpha,
+                             pairs=False):
     """
     Calculate the color correction factors for the input images before combination.
     This is to account for different nominal center frequency for different instruments, as 
     well as different flux calibration process.
-    
+
+    The factors are evaluated for any number of spectral indices at once:
+    each passband is converted to frequency once, and its integrals for all
+    the indices are a single product with its trapezoid-rule weights.
+
     Parameters
     ----------
     n_center_hi:
@@ -178,40 +608,176 @@ def color_correction_factors(n_center_hi, n_center_lo, pb_hi, pb_lo, alpha):
     n_center_lo:
        The nominal frequency center of high resolution image (GHz).
     pb_hi:
-       The passband curve of high resolution observation (in ../filter/**).
+       The passband curve of high resolution observation (in data/filter/):
+       a ``(wavelength, response)`` pair, a `~uvcombine.filters.Filter` or
+       the name of one.  With ``n_center_hi=None`` the nominal frequency of
+       the filter is used.
     pb_lo:
        The passband curve of low resolution observation.
     alpha:
-       The assumed spetra index of source emission. 
-     
+       The assumed spetra index of source emission: a scalar or an array.
+    pairs:
+       To evaluate several band pairs, set ``pairs=True`` and give ``pb_hi``
+       and ``pb_lo`` as sequences of passbands and ``n_center_hi`` and
+       ``n_center_lo`` as sequences of the same length (or `None`).
+
     Return
     ------------
     cc_hi:
-       Color correction factor for the high resolution image.
+       Color correction factor for the high resolution image, with the shape
+       of ``alpha``, preceded by the number of band pairs with
+       ``pairs=True``.
     cc_lo:
        Color correction factor for the low resolution image.
     """
-    wv_hi, response_hi = pb_hi
-    wv_lo, response_lo = pb_lo
-    freq_hi = (wv_hi*u.um).to(u.GHz,equivalencies=u.spectral()).value
-    freq_lo = (wv_lo*u.um).to(u.GHz,equivalencies=u.spectral()).value
-    
-    #calculate the color corrections according to assumed source index
-    #here the default calibration for space telescope is Inum*num=const, for ground-based observations is Inum \propto num**2.
-    cc_hi = np.trapz(response_hi*(freq_hi/n_center_hi)**2, freq_hi)/np.trapz(response_hi*(freq_hi/n_center_hi)**alpha, freq_hi)
-    cc_lo = np.trapz(response_lo*(freq_lo/n_center_lo)**(-1), freq_lo)/np.trapz(response_lo*(freq_lo/n_center_lo)**alpha, freq_lo)
-    
-    #calculate the color correction for low resolution image to nominal frequency of high resolution image
-    cc_lo = cc_lo*(n_center_hi/n_center_lo)**alpha
-    
-    
+    if not pairs:
+        n_center_hi, n_center_lo = [n_center_hi], [n_center_lo]
+        pb_hi, pb_lo = [pb_hi], [pb_lo]
+    if len(pb_lo) != len(pb_hi):
+        raise ValueError("pb_hi and pb_lo must have the same number of "
+                         "passbands.")
+    if n_center_hi is None:
+        n_center_hi = [None] * len(pb_hi)
+    if n_center_lo is None:
+        n_center_lo = [None] * len(pb_lo)
+
+    alpha = np.asarray(alpha, dtype=float)
+    # the calibration indices are evaluated with the others: 2 for the high
+    # resolution band, -1 for the low resolution band
+    alphas = np.concatenate([alpha.ravel(), [2., -1.]])
+
+    cc_hi = np.empty((len(pb_hi), alpha.size))
+    cc_lo = np.empty((len(pb_lo), alpha.size))
+    for ii in range(len(pb_hi)):
+        logratio, weights, center_hi = _passband(pb_hi[ii], n_center_hi[ii])
+        integrals = _power_law_integrals(logratio, weights, alphas)
+        #calculate the color corrections according to assumed source index
+        #here the default calibration for space telescope is Inum*num=const, for ground-based observations is Inum \propto num**2.
+        cc_hi[ii] = integrals[-2] / integrals[:-2]
+
+        logratio, weights, center_lo = _passband(pb_lo[ii], n_center_lo[ii])
+        integrals = _power_law_integrals(logratio, weights, alphas)
+        #calculate the color correction for low resolution image to nominal frequency of high resolution image
+        cc_lo[ii] = (integrals[-1] / integrals[:-2] *
+                     (center_hi/center_lo)**alpha.ravel())
+
+    shape = ((len(pb_hi),) if pairs else ()) + alpha.shape
+    cc_hi = cc_hi.reshape(shape)
+    cc_lo = cc_lo.reshape(shape)
+    if not shape:
+        cc_hi, cc_lo = cc_hi[()], cc_lo[()]
+
     return cc_hi, cc_lo
 
     
     
 
 
-def feather_kernel(nax2, nax1, lowresfwhm, pixscale):
+class ColorCorrectionTable(object):
+    """
+    Color correction factors tabulated against the spectral index, for
+    per-pixel corrections from a map of spectral indices.
+
+    The logarithms of the factors are tabulated on a uniform grid of
+    ``alpha`` and interpolated linearly, so a whole alpha map is corrected
+    in one vectorized pass without any passband integrals.  The logarithms
+    are nearly linear in ``alpha``: with the default grid step of 0.01 the
+    relative interpolation error is of order 1e-7.
+
+    Parameters
+    ----------
+    alpha : array
+        The uniform, increasing grid of spectral indices
+    cc_hi, cc_lo : array
+        The factors of the high and low resolution images at ``alpha``
+
+    Examples
+    --------
+    The per-pixel factors can be passed to `feather_simple` as scale
+    factors, since they are applied on the high resolution grid:
+
+    >>> table = ColorCorrectionTable.from_passbands(
+    ...     None, None, 'SPIRE_PLW', 'HFI_353') # doctest: +SKIP
+    >>> cc_hi, cc_lo = table(alpha_map) # doctest: +SKIP
+    >>> combo = feather_simple(hires, lores, highresscalefactor=cc_hi,
+    ...                        lowresscalefactor=cc_lo) # doctest: +SKIP
+    """
+
+    def __init__(self, alpha, cc_hi, cc_lo):
+        alpha = np.asarray(alpha, dtype=float)
+        step = np.diff(alpha)
+        if alpha.ndim != 1 or alpha.size < 2 or not np.allclose(
+                step, step[0], rtol=1e-6, atol=0) or step[0] <= 0:
+            raise ValueError("alpha must be a uniform increasing grid.")
+        self.alpha = alpha
+        self.cc_hi = np.asarray(cc_hi, dtype=float)
+        self.cc_lo = np.asarray(cc_lo, dtype=float)
+        self._start = alpha[0]
+        self._step = (alpha[-1] - alpha[0]) / (alpha.size - 1)
+        self._log = {}
+        for band, cc in (('hi', self.cc_hi), ('lo', self.cc_lo)):
+            logcc = np.log(cc)
+            self._log[band] = (logcc[:-1], np.diff(logcc))
+
+    @classmethod
+    def from_passbands(cls, n_center_hi, n_center_lo, pb_hi, pb_lo,
+                       alpha_min=-2., alpha_max=6., step=0.01):
+        """
+        Tabulate `color_correction_factors` for a band pair between
+        ``alpha_min`` and ``alpha_max``.  The arguments are those of
+        `color_correction_factors`.
+        """
+        nalpha = int(round((alpha_max - alpha_min) / step)) + 1
+        alpha = np.linspace(alpha_min, alpha_max, nalpha)
+        cc_hi, cc_lo = color_correction_factors(n_center_hi, n_center_lo,
+                                                pb_hi, pb_lo, alpha)
+        return cls(alpha, cc_hi, cc_lo)
+
+    def save(self, filename):
+        """ Write the table to a .npz file """
+        np.savez(filename, alpha=self.alpha, cc_hi=self.cc_hi,
+                 cc_lo=self.cc_lo)
+
+    @classmethod
+    def load(cls, filename):
+        """ Read a table written by `save` """
+        with np.load(filename) as npz:
+            return cls(npz['alpha'], npz['cc_hi'], npz['cc_lo'])
+
+    def interpolate(self, alpha, band='hi', dtype=np.float64):
+        """
+        The factors of ``band`` ('hi' or 'lo') for an array of spectral
+        indices.  Indices outside the table or NaN give NaN.
+        """
+        logcc, slope = self._log[band]
+        shape = np.shape(alpha)
+        position = np.array(alpha, dtype=dtype, ndmin=1)
+        position -= self._start
+        position /= self._step
+        outside = ~((position >= 0) & (position <= self.alpha.size - 1))
+        position[outside] = 0
+        index = np.floor(position).astype(np.intp)
+        # the last grid point interpolates from the interval below it
+        np.clip(index, 0, self.alpha.size - 2, out=index)
+        position -= index
+        position *= slope[index]
+        position += logcc[index]
+        np.exp(position, out=position)
+        position[outside] = np.nan
+        return position.reshape(shape) if shape else position[0]
+
+    def __call__(self, alpha, dtype=np.float64):
+        """
+        Return the per-pixel factors ``(cc_hi, cc_lo)`` for the map of
+        spectral indices ``alpha``.
+        """
+        return (self.interpolate(alpha, 'hi', dtype=dtype),
+                self.interpolate(alpha, 'lo', dtype=dtype))
+
+
+def feather_kernel(nax2, nax1, lowresfwhm, pixscale, rfft=False,
+                   fft_backend=None, method='fft', cache=None,
+                   dtype=np.float64):
     """
     Construct the weight kernels (image arrays) for the fourier transformed low
     resolution and high resolution images.  The kernels are the fourier transforms
@@ -225,6 +791,28 @@ def feather_kernel(nax2, nax1, lowresfwhm, pixscale):
        Angular resolution of the low resolution image (FWHM)
     pixscale : float (?)
        pixel size in the input high resolution image.
+    rfft : bool
+       Return the half-plane kernels matching `numpy.fft.rfft2` output, with
+       shape ``(nax2, nax1//2+1)``, instead of the full ``(nax2, nax1)`` plane.
+    fft_backend : None, str or backend instance
+       The FFT backend to use; see `uvcombine.fft_backends.get_fft_backend`.
+       Not used when ``method='analytic'``.
+    method : 'fft' or 'analytic'
+       ``'fft'`` builds the gaussian beam in image space and Fourier
+       transforms it.  ``'analytic'`` evaluates the gaussian's Fourier
+       transform, ``exp(-2 pi^2 sigma^2 (u^2+v^2))``, directly on the
+       `numpy.fft.fftfreq` grid as the outer product of two 1-D factors, which
+       is O(N) and needs no image-sized temporaries.  The two agree except
+       for the aliasing and edge truncation of the sampled beam.
+    cache : None, bool or `~uvcombine.cache.KernelCache`
+       Memoize the kernels.  ``True`` uses the shared
+       `uvcombine.cache.kernel_cache`.  Entries are keyed on the image shape,
+       the beam size in pixels (i.e., ``lowresfwhm`` and ``pixscale``),
+       ``rfft``, ``method`` and ``dtype``.  Cached kernels are returned
+       read-only.
+    dtype : dtype
+       The floating-point type of the kernels.  With ``np.float32`` the
+       kernels are built and transformed in single precision.
 
     Return
     ----------
@@ -234,11 +822,6 @@ def feather_kernel(nax2, nax1, lowresfwhm, pixscale):
        An image array containing the weighting for the high resolution image
        (simply 1-kfft)
     """
-    # Construct arrays which hold the x and y coordinates (in unit of pixels)
-    # of the image
-    ygrid,xgrid = (np.indices([nax2,nax1]) -
-                   np.array([(nax2-1.)/2,(nax1-1.)/2.])[:,None,None])
-
     # constant converting "resolution" in fwhm to sigma
     fwhm = np.sqrt(8*np.log(2))
 
@@ -249,19 +832,60 @@ def feather_kernel(nax2, nax1, lowresfwhm, pixscale):
     #sigma_fftspace = (2*np.pi*sigma)**-1
     #log.debug('sigma = {0}, sigma_fftspace={1}'.format(sigma, sigma_fftspace))
 
-    kernel = np.fft.fftshift(np.exp(-(xgrid**2+ygrid**2)/(2*sigma**2)))
-    # convert the kernel, which is just a gaussian in image space,
-    # to its corresponding kernel in fourier space
-    kfft = np.abs(np.fft.fft2(kernel)) # should be mostly real
-    # normalize the kernel
-    kfft/=kfft.max()
+    if method not in ('fft', 'analytic'):
+        raise ValueError("method must be 'fft' or 'analytic'.")
+
+    if cache is True:
+        cache = kernel_cache
+    elif cache is False:
+        cache = None
+    if cache is not None:
+        key = (nax2, nax1, float(sigma), bool(rfft), method,
+               np.dtype(dtype).str)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    if method == 'analytic':
+        # frequencies in cycles per pixel, in the same order as the fft output
+        ufreq = np.fft.rfftfreq(nax1) if rfft else np.fft.fftfreq(nax1)
+        vfreq = np.fft.fftfreq(nax2)
+        # the gaussian is separable, so only the 1-D factors are evaluated;
+        # it peaks at 1 at zero frequency and so is already normalized
+        kfft = (np.exp(-2*(np.pi*sigma*vfreq)**2).astype(dtype)[:,None] *
+                np.exp(-2*(np.pi*sigma*ufreq)**2).astype(dtype)[None,:])
+    else:
+        # Construct arrays which hold the x and y coordinates (in unit of
+        # pixels) of the image
+        ygrid,xgrid = (np.indices([nax2,nax1], dtype=dtype) -
+                       np.array([(nax2-1.)/2,(nax1-1.)/2.],
+                                dtype=dtype)[:,None,None])
+
+        kernel = np.fft.fftshift(np.exp(-(xgrid**2+ygrid**2)/(2*sigma**2)))
+        # convert the kernel, which is just a gaussian in image space,
+        # to its corresponding kernel in fourier space
+        fft = get_fft_backend(fft_backend)
+        if rfft:
+            # the kernel is real, so its transform is hermitian and the
+            # half-plane holds every independent value (including the maximum)
+            kfft = np.abs(fft.rfft2(kernel)).astype(dtype, copy=False)
+        else:
+            # should be mostly real
+            kfft = np.abs(fft.fft2(kernel)).astype(dtype, copy=False)
+        # normalize the kernel
+        kfft/=kfft.max()
     ikfft = 1-kfft
 
+    if cache is not None:
+        cache.put(key, (kfft, ikfft))
+
     return kfft, ikfft
 
 
 
-def fftmerge(kfft,ikfft,im_hi,im_lo):
+def fftmerge(kfft,ikfft,im_hi,im_lo,rfft=False,fft_backend=None,
+             dtype=np.float64, highresscalefactor=1.0, lowresscalefactor=1.0,
+             buffer=None, return_nanmask=False):
     """
     Combine images in the fourier domain, and then output the combined image
     both in fourier domain and the image domain.
@@ -271,7 +895,38 @@ def fftmerge(kfft,ikfft,im_hi,im_lo):
     kernel1,2 : float array
        Weighting images.
     im1,im2: float array
-       Input images.
+       Input images.  These may also be stacks of images (e.g., cubes with
+       the spectral axis first), in which case every plane is transformed
+       in a single batched FFT over the last two axes and the kernels are
+       broadcast along the leading axis.
+    rfft : bool
+       Use the real-to-complex transforms (`numpy.fft.rfft2` and
+       `numpy.fft.irfft2`).  The kernels must then be the half-plane kernels
+       from ``feather_kernel(..., rfft=True)``.  This roughly halves the FFT
+       time and the memory of the complex arrays, and the combined image is
+       returned real-valued.
+    fft_backend : None, str or backend instance
+       The FFT backend to use; see `uvcombine.fft_backends.get_fft_backend`.
+    dtype : dtype
+       The floating-point type the images are transformed in.  With
+       ``np.float32`` the transforms and the weighted sum are single
+       precision (complex64), which halves their memory; the kernels should
+       then be built with the same ``dtype``.
+    highresscalefactor : float or array
+    lowresscalefactor : float or array
+       Factors to multiply the images by.  The scaling is done while copying
+       each image into the FFT input buffer, so the inputs are neither
+       modified nor copied.  Arrays broadcast against the images, e.g.
+       per-pixel color corrections from `ColorCorrectionTable`.
+    buffer : array or None
+       A preallocated array of ``dtype`` and the shape of the images, used
+       as the FFT input for both images in turn.  NaNs are replaced by zero
+       in this buffer rather than in copies of the images.  Passing one
+       avoids the allocation when merging many images of the same shape.
+       Its contents are overwritten.
+    return_nanmask : bool
+       Also return a boolean mask of the pixels that were NaN in either
+       input, e.g. to blank them in the combined image.
 
     Returns
     -------
@@ -279,16 +934,51 @@ def fftmerge(kfft,ikfft,im_hi,im_lo):
        Combined image in fourier domain.
     combo  : float array
        Combined image in image domain.
+    nanmask : bool array
+       (optional) pixels that were NaN in either input
     """
 
-    fft_hi = np.fft.fft2(np.nan_to_num(im_hi))
-    fft_lo = np.fft.fft2(np.nan_to_num(im_lo))
-
-    # Combine and inverse fourier transform the images
-    fftsum = kfft*fft_lo + ikfft*fft_hi
-
-    combo = np.fft.ifft2(fftsum)
+    fft = get_fft_backend(fft_backend)
+    if buffer is None:
+        if np.iscomplexobj(im_hi) or np.iscomplexobj(im_lo):
+            # complex inputs need a complex buffer (and the full transform)
+            dtype = np.result_type(dtype, np.complex64)
+        buffer = np.empty(np.shape(im_hi), dtype=dtype)
+    # some backends always transform in double precision
+    ctype = np.result_type(buffer.dtype, np.complex64)
+    transform = fft.rfft2 if rfft else fft.fft2
+
+    nanmask = None
+    fft_ims = []
+    for im, scale in ((im_hi, highresscalefactor),
+                      (im_lo, lowresscalefactor)):
+        # scale into the buffer, then zero its NaNs in place
+        np.multiply(im, scale, out=buffer, casting='unsafe')
+        if return_nanmask:
+            if nanmask is None:
+                nanmask = np.isnan(buffer)
+            else:
+                nanmask |= np.isnan(buffer)
+        np.nan_to_num(buffer, copy=False)
+        fft_ims.append(transform(buffer).astype(ctype, copy=False))
+    fft_hi, fft_lo = fft_ims
+
+    # Combine and inverse fourier transform the images, weighting the
+    # transforms in place
+    fft_lo *= kfft
+    fft_hi *= ikfft
+    fft_lo += fft_hi
+    fftsum = fft_lo
+    del fft_hi, fft_ims
+
+    if rfft:
+        # pass the shape explicitly so odd-sized images round-trip
+        combo = fft.irfft2(fftsum, s=im_hi.shape[-2:])
+    else:
+        combo = fft.ifft2(fftsum)
 
+    if return_nanmask:
+        return fftsum, combo, nanmask
     return fftsum, combo
 
 
@@ -313,8 +1003,10 @@ def smoothing(combo, targres, origfwhm, pixscale):
     combo : float array
        Smoothed image
     """
+    from astropy.convolution import convolve, Gaussian2DKernel
+
     fwhm = np.sqrt(8*np.log(2))
-    kernel_size = ((targres/fwhm)**2-(hiresfwhm/fwhm)**2)**0.5
+    kernel_size = ((targres/fwhm)**2-(origfwhm/fwhm)**2)**0.5
     pixel_n = kernel_size/pixscale
     
     #smooth the image using gaussian 2d kernel
@@ -372,31 +1064,356 @@ def outfits(image, header, outname="output.fits"):
     outname : str
        Filename of the .fits output of the combined image
     """
-    hdu = fits.PrimaryHDU(data=np.abs(image), header=header)
+    hdu = fits.PrimaryHDU(data=np.real(image), header=header)
     hdu.writeto(outname)
 
 
 
-def freq_filling(im1, im2, hd1, hd2, hd3):
+def _outfits_header(header, shape, bitpix=-64):
+    """
+    A primary header with the keywords of ``header`` describing a
+    floating-point image of ``shape``.
+    """
+    # PrimaryHDU resets the structural keywords (SIMPLE, BITPIX, NAXISn)
+    header = fits.PrimaryHDU(header=header).header
+    for key in ('BSCALE', 'BZERO', 'BLANK'):
+        header.pop(key, None)
+    header['BITPIX'] = bitpix
+    header['NAXIS'] = len(shape)
+    previous = 'NAXIS'
+    for ii, size in enumerate(shape[::-1]):
+        key = 'NAXIS{0}'.format(ii+1)
+        header.insert(previous, (key, size), after=True)
+        previous = key
+    return header
+
+
+
+def outfits_stream(header, outname="output.fits", overwrite=False):
+    """
+    Open a .fits output that the image data is written to incrementally,
+    e.g. one block of channels at a time.  This is the streaming counterpart
+    of `outfits`.
+
+    Parameters
+    ----------
+    header : header object
+       Header of the output image.  It must describe the full image shape
+       (NAXISn) and data type (BITPIX).
+    outname : str
+       Filename of the .fits output
+    overwrite : bool
+       Overwrite ``outname`` if it exists?
+
+    Returns
+    -------
+    stream : `astropy.io.fits.StreamingHDU`
+       Call ``stream.write(block)`` with big-endian blocks in file order
+       (slowest axis first), then ``stream.close()``.
+    """
+    if os.path.exists(outname):
+        if overwrite:
+            os.remove(outname)
+        else:
+            raise IOError("File {0} exists; use overwrite=True to replace it."
+                          .format(outname))
+    return fits.StreamingHDU(outname, header)
+
+
+
+def _outfits_allocate(header, outname="output.fits", overwrite=False):
+    """
+    Create a .fits file with ``header`` and an uninitialized (zero-filled,
+    sparse on most filesystems) data section of the size the header
+    describes, without holding the data in memory.  The data can then be
+    filled in by several processes through `numpy.memmap`.
+
+    Returns
+    -------
+    offset : int
+       The byte offset of the data section in ``outname``
+    """
+    if os.path.exists(outname):
+        if overwrite:
+            os.remove(outname)
+        else:
+            raise IOError("File {0} exists; use overwrite=True to replace it."
+                          .format(outname))
+    header.tofile(outname)
+    offset = os.path.getsize(outname)
+    shape = [header['NAXIS{0}'.format(ii)]
+             for ii in range(1, header['NAXIS']+1)]
+    datasize = int(np.prod(shape)) * abs(header['BITPIX']) // 8
+    # the data section is padded to a multiple of the 2880-byte FITS block
+    datasize = -(-datasize // 2880) * 2880
+    with open(outname, 'rb+') as fobj:
+        fobj.seek(offset + datasize - 1)
+        fobj.write(b'\0')
+    return offset
+
+
+
+def _frequency_axis(header):
+    """
+    The CRVAL and CUNIT keywords of the FREQ axis of ``header``, or `None`.
+    The axis is also found in headers flattened by `file_in`, where the
+    keywords of the third axis are renamed ACTYPE3, ACRVAL3 and so on.
+    """
+    for key in header.keys():
+        for prefix in ('', 'A'):
+            axis = key[len(prefix)+5:]
+            if (key.startswith(prefix + 'CTYPE') and axis.isdigit() and
+                    str(header[key]).startswith('FREQ')):
+                return prefix + 'CRVAL' + axis, prefix + 'CUNIT' + axis
+    return None
+
+
+def header_frequency(header):
+    """
+    The observing frequency of an image, in GHz, from its header: the
+    reference value of a FREQ axis (also of a header flattened by `file_in`),
+    the RESTFRQ (or RESTFREQ) keyword, or the WAVELNTH keyword (in microns,
+    as in Herschel maps).
+    """
+    freqaxis = _frequency_axis(header)
+    if freqaxis is not None:
+        crval, cunit = freqaxis
+        unit = u.Unit(header.get(cunit, 'Hz'))
+        return (header[crval]*unit).to_value(u.GHz)
+    for key in ('RESTFRQ', 'RESTFREQ'):
+        if key in header:
+            return (header[key]*u.Hz).to_value(u.GHz)
+    if 'WAVELNTH' in header:
+        return (header['WAVELNTH']*u.um).to_value(u.GHz,
+                                                 equivalencies=u.spectral())
+    raise ValueError("No frequency found in the header (a FREQ axis or a "
+                     "RESTFRQ, RESTFREQ or WAVELNTH keyword).")
+
+
+def _power_law_coefficients(frequencies, target_frequency):
+    """
+    The coefficients of the least-squares power law through the logs of
+    maps at ``frequencies``: ``log(I(target_frequency)) = sum(d*log(I))``
+    and ``alpha = sum(c*log(I))``.  With two maps the power law passes
+    through both.
+    """
+    logfreq = np.log(np.asarray(frequencies, dtype=float) / target_frequency)
+    if logfreq.size < 2:
+        raise ValueError("At least two maps are needed to derive a spectral "
+                         "index.")
+    centered = logfreq - logfreq.mean()
+    sxx = np.sum(centered**2)
+    if sxx == 0:
+        raise ValueError("The maps must be at different frequencies.")
+    alpha_coef = centered / sxx
+    interp_coef = 1./logfreq.size - alpha_coef*logfreq.mean()
+    return interp_coef, alpha_coef
+
+
+def spectral_index_interpolate(images, frequencies, target_frequency,
+                               chunk_size=2**20, out=None,
+                               return_alpha=False, dtype=np.float64):
+    """
+    Evaluate a per-pixel power law fitted to maps at several frequencies at
+    ``target_frequency``.
+
+    The power law is fitted in log space by least squares, which with two
+    maps is the power law through both.  As the frequencies are the same
+    for every pixel, both the spectral index and the interpolated value
+    are fixed linear combinations of the log images, evaluated in place
+    chunk by chunk.
+
+    Parameters
+    ----------
+    images : list of arrays
+        The maps, on the same grid and in the same flux units
+    frequencies : list of float
+        The frequencies of the maps
+    target_frequency : float
+        The frequency to evaluate the power law at, in the units of
+        ``frequencies``
+    chunk_size : int or None
+        The number of pixels evaluated at once, which bounds the temporary
+        memory; `None` evaluates the whole map at once
+    out : array or None
+        A C-contiguous output array (e.g. a memory-mapped file) of the
+        shape of the images
+    return_alpha : bool
+        Also return the map of spectral indices
+    dtype : dtype
+        The type of the output and of the computation
+
+    Returns
+    -------
+    interpol : array
+        The maps evaluated at ``target_frequency``.  Pixels that are not
+        positive (or NaN) in any map are NaN.
+    alpha : array
+        (optional) the spectral index map
+    """
+    if len(images) != len(frequencies):
+        raise ValueError("Give one frequency per image.")
+    interp_coef, alpha_coef = _power_law_coefficients(frequencies,
+                                                      target_frequency)
+    shape = np.shape(images[0])
+    for image in images[1:]:
+        if np.shape(image) != shape:
+            raise ValueError("The images must be on the same grid; regrid "
+                             "them first.")
+    flat = [np.asarray(image).reshape(-1) for image in images]
+    if out is None:
+        out = np.empty(shape, dtype=dtype)
+    elif out.shape != shape or not out.flags.c_contiguous:
+        raise ValueError("out must be a C-contiguous array of the shape of "
+                         "the images.")
+    alpha = np.empty(shape, dtype=dtype) if return_alpha else None
+    out_flat = out.reshape(-1)
+    alpha_flat = alpha.reshape(-1) if return_alpha else None
+
+    size = flat[0].size
+    chunk_size = size if chunk_size is None else max(1, int(chunk_size))
+    logim = np.empty(min(chunk_size, size), dtype=dtype)
+    result = np.empty_like(logim)
+    scaled = np.empty_like(logim) if return_alpha else None
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for start in range(0, size, chunk_size):
+            stop = min(start + chunk_size, size)
+            result_chunk = result[:stop-start]
+            logim_chunk = logim[:stop-start]
+            result_chunk[:] = 0
+            if return_alpha:
+                alpha_chunk = alpha_flat[start:stop]
+                alpha_chunk[:] = 0
+            for image, dk, ck in zip(flat, interp_coef, alpha_coef):
+                np.log(image[start:stop], out=logim_chunk,
+                       casting='unsafe')
+                if return_alpha:
+                    scaled_chunk = scaled[:stop-start]
+                    np.multiply(logim_chunk, ck, out=scaled_chunk)
+                    alpha_chunk += scaled_chunk
+                logim_chunk *= dk
+                result_chunk += logim_chunk
+            # log(0) is -inf and log(<0) is NaN; blank them both
+            result_chunk[np.isinf(result_chunk)] = np.nan
+            np.exp(result_chunk, out=result_chunk)
+            out_flat[start:stop] = result_chunk
+            if return_alpha:
+                alpha_chunk[~np.isfinite(alpha_chunk)] = np.nan
+
+    if return_alpha:
+        return out, alpha
+    return out
+
+
+def freq_filling(im1, im2, hd1, hd2, hd3, chunk_size=2**20,
+                 return_alpha=False, model='powerlaw', bands=None,
+                 beta=None):
     """
     Derive spectral index from image array, and make interpolation.
 
+    The per-pixel spectral index is derived from the maps at their
+    observing frequencies (see `header_frequency`) and the power law is
+    evaluated at the frequency of ``hd3``; see
+    `spectral_index_interpolate`.  ``im2`` is regridded onto the grid of
+    ``im1`` if their headers differ.
+
+    With the passbands of the maps (``bands``), or with
+    ``model='mbb'``, the SED is fitted by `uvcombine.sedfit` instead,
+    accounting for the band shapes.
+
     Parameters
     ----------
     im1,im2  : float array
-       The input images to be interpolated
+       The input images to be interpolated.  ``im2`` (and ``hd2``) may
+       also be lists of images, to fit a power law to more than two maps.
     hd1, hd2 : header object
        Headers of the input images
     hd3      : header object
        Header for extracting the targeted frequency for interpolation
-    """
-    interpol = im1
-    interpol_header = hd1
-    interpol_hdu = fits.PrimaryHDU(data=np.abs(im1), header=hd1)
+    chunk_size : int or None
+       The number of pixels evaluated at once
+    return_alpha : bool
+       Also return the spectral index map.  For ``model='mbb'`` it is
+       `None`; use `uvcombine.sedfit.fit_modified_blackbody` for the fitted
+       emissivity index and temperature maps.
+    model : 'powerlaw' or 'mbb'
+       Fit a power law or a modified blackbody to every pixel
+    bands : list or None
+       The passbands of ``[im1] + im2`` (names of filters in
+       `uvcombine.filters`); their nominal frequencies then replace those
+       of the headers
+    beta : float or None
+       A fixed emissivity index of the modified blackbody
 
+    Returns
+    -------
+    interpol : float array
+       The interpolated image, on the grid of ``im1``
+    interpol_header : header object
+       Its header
+    interpol_hdu : `~astropy.io.fits.PrimaryHDU`
+       The image and header as an HDU
+    alpha : float array or None
+       (optional) the spectral index map of a power law, `None` for a
+       modified blackbody
+    """
+    if not isinstance(im2, list):
+        im2, hd2 = [im2], [hd2]
+
+    images = [im1]
+    for image, header in zip(im2, hd2):
+        if image.shape != im1.shape or not _same_celestial_grid(hd1, header):
+            image = regrid(hd1, im1, image, header)[1]
+        images.append(image)
+    target_frequency = header_frequency(hd3)
+    frequencies = (None if bands is not None else
+                   [header_frequency(header) for header in [hd1] + hd2])
+
+    if model == 'powerlaw' and bands is None:
+        result = spectral_index_interpolate(images, frequencies,
+                                            target_frequency,
+                                            chunk_size=chunk_size,
+                                            return_alpha=return_alpha)
+        interpol = result[0] if return_alpha else result
+    elif model == 'powerlaw':
+        from .sedfit import fit_power_law
+        result = fit_power_law(images, frequencies, target_frequency,
+                               bands=bands, chunk_size=chunk_size)
+        interpol = result[0]
+    elif model == 'mbb':
+        from .sedfit import fit_modified_blackbody
+        interpol = fit_modified_blackbody(images, frequencies,
+                                          target_frequency, beta=beta,
+                                          bands=bands)[0]
+        result = (interpol, None)
+    else:
+        raise ValueError("model must be 'powerlaw' or 'mbb'.")
+
+    interpol_header = hd1.copy()
+    for key in ('RESTFRQ', 'RESTFREQ', 'WAVELNTH'):
+        interpol_header.remove(key, ignore_missing=True)
+    interpol_header['RESTFRQ'] = (target_frequency*1e9,
+                                  'Interpolated to this frequency (Hz)')
+    freqaxis = _frequency_axis(interpol_header)
+    if freqaxis is not None:
+        crval, cunit = freqaxis
+        unit = u.Unit(interpol_header.get(cunit, 'Hz'))
+        interpol_header[crval] = (target_frequency*u.GHz).to_value(unit)
+    interpol_hdu = fits.PrimaryHDU(data=interpol, header=interpol_header)
+
+    if return_alpha:
+        return interpol, interpol_header, interpol_hdu, result[1]
     return interpol, interpol_header, interpol_hdu
 
 
+def _same_celestial_grid(header1, header2):
+    """ Whether two headers describe the same celestial pixel grid """
+    keys = ['NAXIS1', 'NAXIS2', 'CTYPE1', 'CTYPE2', 'CRVAL1', 'CRVAL2',
+            'CRPIX1', 'CRPIX2', 'CDELT1', 'CDELT2', 'CD1_1', 'CD1_2',
+            'CD2_1', 'CD2_2', 'CROTA2']
+    return all(header1.get(key) == header2.get(key) for key in keys)
+
+
 
 #################################################################
 
@@ -407,18 +1424,24 @@ def AKB_interpol(lores1, lores2, hires,
                  scalefactor1=1.0,
                  scalefactor2=1.0,
                  output_fits=True,
-                 outfitsname='interpolate.fits'):
+                 outfitsname='interpolate.fits',
+                 model='powerlaw', bands=None, beta=None):
     """
     This procedure is provided for the case that we need to interpolate
     two space observatory image, to make the image at the observing
     frequency of the ground based one.
 
+    The images are converted to Jy/arcsec^2 where their BUNIT allows (see
+    `flux_unit`), and ``lores1`` is smoothed to the coarsest beam of
+    ``lores2`` when the headers give the beam sizes (BMAJ).
+
     Parameter
     ---------
     lores1, lores2 : str
        Filaname of the input images, either variable name of HDUs, or
        can be the .fits format files. lores2 should be at the lower observing
-       frequency.
+       frequency.  lores2 may also be a list of images, e.g. every PACS,
+       SPIRE and Planck HFI map of the field, to fit an SED to all of them.
     hires : str
        Filaname of the groundbased observing image. This is to supply header
        for obtaining the targeted frequency for interpolation.
@@ -427,11 +1450,14 @@ def AKB_interpol(lores1, lores2, hires,
     hiresextnum : int
        The extension number to use from the hi-res FITS file
     scalefactor1,2 : float
-       scaling factors of the input images.
+       scaling factors of the input images (scalefactor2 may be a list
+       matching lores2).
     fitsoutput     : bool
        Option to set whether we have .fits output
     outfitsname    : str
        The filename of .fits output.
+    model, bands, beta :
+       The SED fitted to every pixel; see `freq_filling`.
 
     Return
     ---------
@@ -441,21 +1467,35 @@ def AKB_interpol(lores1, lores2, hires,
 
     # Read images
     hdu1, im1, hd1 = file_in(lores1, extnum1)
-    hdu2, im2, hd2 = file_in(lores2, extnum2)
+    multi = isinstance(lores2, list)
+    if not multi:
+        lores2 = [lores2]
+    if not isinstance(scalefactor2, list):
+        scalefactor2 = [scalefactor2] * len(lores2)
+    ims2, hds2 = [], []
+    for lores, scalefactor in zip(lores2, scalefactor2):
+        hdu2, im2, hd2 = file_in(lores, extnum2)
+        im2, hd2 = flux_unit(im2, hd2)
+        ims2.append(im2 * scalefactor)
+        hds2.append(hd2)
     hdu3, im3, hd3 = file_in(hires, hiresextnum)
 
     # Match flux unit
     im1, hd1 = flux_unit(im1, hd1)
-    im2, hd2 = flux_unit(im2, hd2)
+    im1 = im1 * scalefactor1
+    im2, hd2 = (ims2, hds2) if multi else (ims2[0], hds2[0])
 
     # Smooth the high resolution image to the low resolution one
     # Here need to reead the header of the low resolution image,
-    # to know what is the targeted resolution
-    targres = 0.0
-    origfwhm =  0.0
-    pixscale = FITS_tools.header_tools.header_to_platescale(hd1)
-
-    im1 = smoothing(im1, targres, origfwhm, pixscale)
+    # to know what is the targeted resolution (BMAJ, in degrees)
+    targres = max(header.get('BMAJ', 0.0) for header in hds2) * 3600
+    origfwhm = hd1.get('BMAJ', 0.0) * 3600
+    if targres > origfwhm > 0:
+        import FITS_tools
+        pixscale = FITS_tools.header_tools.header_to_platescale(hd1) * 3600
+        im1 = smoothing(im1, targres, origfwhm, pixscale)
+        hd1 = hd1.copy()
+        hd1['BMAJ'] = hd1['BMIN'] = targres / 3600
 
     #* Image Registration (Match astrometry)
     #  [Should be an optional step]
@@ -464,7 +1504,10 @@ def AKB_interpol(lores1, lores2, hires,
     # Package exist, but not sure how to use it.
 
     # Derive Spectral index and Make interpolation
-    interpol, interpol_header, interpol_hdu = freq_filling(im1, im2, hd1, hd2, hd3)
+    interpol, interpol_header, interpol_hdu = freq_filling(im1, im2, hd1, hd2, hd3,
+                                                          model=model,
+                                                          bands=bands,
+                                                          beta=beta)
 
     # output .fits file
     if output_fits:
@@ -483,7 +1526,9 @@ def AKB_combine(hires, lores,
                 lowresfwhm=1*u.arcmin,
                 targres=-1.0,
                 return_hdu=False,
-                return_regridded_lores=False, output_fits=True):
+                return_regridded_lores=False, output_fits=True,
+                fft_backend=None, regrid_cache=False,
+                outfitsname='output.fits'):
     """
     Fourier combine two data cubes
 
@@ -508,11 +1553,27 @@ def AKB_combine(hires, lores,
         planes, one for the real and one for the imaginary data.
     return_regridded_cube2 : bool
         Return the 2nd cube regridded into the pixel space of the first?
+    fft_backend : None, str or backend instance
+        The FFT backend to use; see `uvcombine.fft_backends.get_fft_backend`.
+    regrid_cache : None, bool or `~uvcombine.cache.RegridCache`
+        Reuse the regridded low resolution image across calls; see `regrid`.
+    targres : float
+        If positive, the HPBW (in arcseconds) the combined image is smoothed
+        to from the BMAJ of the high resolution image.
+    output_fits : bool
+        Write the combined image to ``outfitsname``?
+    outfitsname : str
+        The filename of the .fits output.
+
+    Notes
+    -----
+    The stages are recorded by an active `uvcombine.tracing.Tracer`.
     """
 
     #* Input data
-    hdu1, im1,    hd1 = file_in(hires, highresextnum)
-    hdu2, im2raw, hd2 = file_in(lores, lowresextnum)
+    with stage('file_in'):
+        hdu1, im1,    hd1 = file_in(hires, highresextnum)
+        hdu2, im2raw, hd2 = file_in(lores, lowresextnum)
 
     # load default parameters (primary beam, the simultaneous FOV of the ground
     #                          based observations)
@@ -521,12 +1582,15 @@ def AKB_combine(hires, lores,
     # if it isn't there.
 
     #* Match flux unit (convert all possible units to un-ambiguous unit like Jy/pixel or Jy/arcsec^2)
-    im1,    hd1 = flux_unit(im1, hd1)
-    im2raw, hd2 = flux_unit(im2raw, hd2)
+    with stage('flux_unit'):
+        im1,    hd1 = flux_unit(im1, hd1)
+        im2raw, hd2 = flux_unit(im2raw, hd2)
 
     # Regrid the low resolution image to the same pixel scale and
     # field of view of the high resolution image
-    hdu2, im2, nax1, nax2, pixscale = regrid(hd1, im1, im2raw, hd2)
+    with stage('regrid'):
+        hdu2, im2, nax1, nax2, pixscale = regrid(hd1, im1, im2raw, hd2,
+                                                 cache=regrid_cache)
 
     #* Image Registration (Match astrometry)
     #  [Should be an optional step]
@@ -535,36 +1599,53 @@ def AKB_combine(hires, lores,
     # Package exist, but not sure how to use it.
 
     # Fourier transform the images
-    fft1 = np.fft.fft2(np.nan_to_num(im1*highresscalefactor))
-    fft2 = np.fft.fft2(np.nan_to_num(im2*lowresscalefactor))
+    fft = get_fft_backend(fft_backend)
+    with stage('fft'):
+        fft1 = fft.fft2(np.nan_to_num(im1*highresscalefactor))
+        fft2 = fft.fft2(np.nan_to_num(im2*lowresscalefactor))
 
     #* Correct for the primary beam attenuation in fourier domain
-    fft2 = pbcorr(fft2, hd1, hd2)
+    with stage('pbcorr'):
+        fft2 = pbcorr(fft2, hd1, hd2)
 
     #* flux matching [Use space observatory image to determine absolute flux]
     #  [should be an optional step]
-    fft1 = flux_match(fft1, fft2)
+    with stage('flux_match'):
+        fft1 = flux_match(fft1, fft2)
 
     # Constructing weight kernal (normalized to max=1)
-    kernel2, kernel1 = feather_kernel(nax2, nax1, lowresfwhm, pixscale)
+    with stage('feather_kernel'):
+        kfft, ikfft = feather_kernel(nax2, nax1, lowresfwhm, pixscale,
+                                     fft_backend=fft)
 
     #* Combine images in the fourier domain
-    fftsum, combo = fftmerge(kernel1, kernel2, fft1, fft2)
+    #  fftmerge transforms the scaled images itself; pbcorr and flux_match
+    #  leave the transforms unchanged for now, so nothing is lost
+    with stage('fftmerge'):
+        fftsum, combo = fftmerge(kfft, ikfft, im1, im2, fft_backend=fft,
+                                 highresscalefactor=highresscalefactor,
+                                 lowresscalefactor=lowresscalefactor)
+    # the imaginary part is round-off
+    combo = combo.real
 
     #* Final Smoothing
     # [should be an optional step]
     if (targres > 0.0):
-        combo = smoothing(combo, targres, origfwhm, pixscale)
+        origfwhm = hd1.get('BMAJ', 0.0) * 3600
+        with stage('smoothing'):
+            combo = smoothing(combo, targres, origfwhm, pixscale * 3600)
 
     #* generate amplitude plot and PDF output
-    akb_plot(fft1, fft2, fftsum)
+    with stage('akb_plot'):
+        akb_plot(fft1, fft2, fftsum)
 
-    #* Generate the CASA 4.3 compatible header
-    combo_header = casaheader(hdu1.header)
+    #* Generate the CASA 4.3 compatible header, in the converted flux unit
+    combo_header = casaheader(hd1)
 
     # fits output
     if output_fits:
-        outfits(combo, combo_header)
+        with stage('outfits'):
+            outfits(combo, combo_header, outname=outfitsname)
 
     # Return combined image array(s)
     if return_regridded_lores:
@@ -591,7 +1672,10 @@ def feather_simple(hires, lores,
                    highresscalefactor=1.0,
                    lowresscalefactor=1.0, lowresfwhm=1*u.arcmin,
                    return_hdu=False,
-                   return_regridded_lores=False):
+                   return_regridded_lores=False,
+                   rfft=False, fft_backend=None, kernel_method='fft',
+                   kernel_cache=False, regrid_cache=False, dtype=np.float64,
+                   restore_nans=False):
     """
     Fourier combine two single-plane images.
 
@@ -603,10 +1687,12 @@ def feather_simple(hires, lores,
         The low-resolution (single-dish) FITS file
     highresextnum : int
         The extension number to use from the high-res FITS file
-    highresscalefactor : float
-    lowresscalefactor : float
+    highresscalefactor : float or array
+    lowresscalefactor : float or array
         A factor to multiply the high- or low-resolution data by to match the
-        low- or high-resolution data
+        low- or high-resolution data.  Arrays of the shape of the high
+        resolution image apply per-pixel factors, e.g. color corrections
+        from a spectral index map (see `ColorCorrectionTable`).
     lowresfwhm : `astropy.units.Quantity`
         The full-width-half-max of the single-dish (low-resolution) beam;
         or the scale at which you want to try to match the low/high resolution
@@ -616,6 +1702,29 @@ def feather_simple(hires, lores,
         planes, one for the real and one for the imaginary data.
     return_regridded_lores : bool
         Return the 2nd image regridded into the pixel space of the first?
+    rfft : bool
+        Use the real-to-complex FFT engine (see `fftmerge`).  The combined
+        image is then real-valued.
+    fft_backend : None, str or backend instance
+        The FFT backend to use; see `uvcombine.fft_backends.get_fft_backend`.
+    kernel_method : 'fft' or 'analytic'
+        How to construct the weight kernels; see `feather_kernel`.
+    kernel_cache : None, bool or `~uvcombine.cache.KernelCache`
+        Cache the weight kernels so that repeated calls with the same image
+        shape, beam and pixel scale skip the kernel construction.  ``True``
+        uses the shared `uvcombine.cache.kernel_cache`.  Off by default, so
+        that one-off calls do not hold on to the kernels.
+    regrid_cache : None, bool or `~uvcombine.cache.RegridCache`
+        Reuse the regridded low resolution image across calls, e.g. when
+        sweeping ``lowresscalefactor`` or ``lowresfwhm``; see `regrid`.
+    dtype : dtype
+        The floating-point type of the computation.  ``np.float32`` keeps the
+        images, kernels and transforms (complex64) in single precision,
+        halving the memory, which is ample for most data.
+    restore_nans : bool
+        Blank (set to NaN) the pixels of the combined image that were NaN in
+        either input image, instead of returning the values feathered from
+        zero-filled inputs.
 
     Returns
     -------
@@ -623,17 +1732,36 @@ def feather_simple(hires, lores,
         The image of the combined low and high resolution data sets
     combo_hdu : fits.PrimaryHDU
         (optional) the image encased in a FITS HDU with the relevant header
-    """
-    hdu_hi, im_hi, header_hi = file_in(hires)
-    hdu_low, im_lowraw, header_low = file_in(lores)
 
-    hdu_low, im_low, nax1, nax2, pixscale = regrid(header_hi, im_hi,
-                                                   im_lowraw, header_low)
-
-    kfft, ikfft = feather_kernel(nax2, nax1, lowresfwhm, pixscale)
-
-    fftsum, combo = fftmerge(kfft, ikfft, im_hi*highresscalefactor,
-                             im_low*lowresscalefactor)
+    Notes
+    -----
+    The stages are recorded by an active `uvcombine.tracing.Tracer`.
+    """
+    with stage('file_in'):
+        hdu_hi, im_hi, header_hi = file_in(hires)
+        hdu_low, im_lowraw, header_low = file_in(lores)
+
+    with stage('regrid'):
+        hdu_low, im_low, nax1, nax2, pixscale = regrid(header_hi, im_hi,
+                                                       im_lowraw, header_low,
+                                                       cache=regrid_cache)
+
+    fft = get_fft_backend(fft_backend)
+    with stage('feather_kernel'):
+        kfft, ikfft = feather_kernel(nax2, nax1, lowresfwhm, pixscale,
+                                     rfft=rfft, fft_backend=fft,
+                                     method=kernel_method,
+                                     cache=kernel_cache, dtype=dtype)
+
+    with stage('fftmerge'):
+        merged = fftmerge(kfft, ikfft, im_hi, im_low, rfft=rfft,
+                          fft_backend=fft, dtype=dtype,
+                          highresscalefactor=highresscalefactor,
+                          lowresscalefactor=lowresscalefactor,
+                          return_nanmask=restore_nans)
+    combo = merged[1]
+    if restore_nans:
+        combo[merged[2]] = np.nan
 
     if return_hdu:
         combo_hdu = fits.PrimaryHDU(data=combo.real, header=hdu_hi.header)
@@ -644,11 +1772,435 @@ def feather_simple(hires, lores,
     else:
         return combo
 
+def _cube_in(cube, extnum=0, lazy=False):
+    """
+    Read a spectral cube given as a `~spectral_cube.SpectralCube`, an HDU or a
+    .fits filename, and return its 3-D data array (spectral axis first) and
+    header.
+
+    With ``lazy=True`` nothing is read: FITS files are memory-mapped and a
+    `~spectral_cube.SpectralCube` is returned as is.  Use `_read_channels` to
+    load blocks of channels from the returned object.
+    """
+    if _is_spectral_cube(cube):
+        data = cube if lazy else cube.filled_data[:].value
+        header = cube.header
+    else:
+        hdu, data, _ = file_in(cube, extnum, memmap=True if lazy else None)
+        header = hdu.header
+        if data.ndim == 2:
+            # a single-channel cube loses its spectral axis in the squeeze
+            data = data[None,:,:]
+
+    if data.ndim != 3:
+        raise ValueError("Input cube has {0} dimensions; expected 3."
+                         .format(data.ndim))
+
+    return data, header
+
+
+def _read_channels(data, start, stop):
+    """
+    Load channels ``start:stop`` of a cube returned by `_cube_in` into memory.
+    """
+    if _is_spectral_cube(data):
+        return data.filled_data[start:stop].value
+    return np.asarray(data[start:stop])
+
+
+def _cube_header(header, shape):
+    """
+    A copy of ``header`` with only the three cube axes, matching ``shape``.
+    """
+    from astropy.wcs import WCS
+    wcs = WCS(header).sub(3)
+    newheader = wcs.to_header()
+    newheader['NAXIS'] = 3
+    newheader['NAXIS1'] = shape[2]
+    newheader['NAXIS2'] = shape[1]
+    newheader['NAXIS3'] = shape[0]
+    return newheader
+
+
+def regrid_cube(hd1, cube2raw, hd2, shape1, mapping=None):
+    """
+    Regrid a low resolution cube onto the spatial and spectral grid of the
+    high resolution cube.  The cube is returned unchanged if the two grids
+    already match.  If only the spatial grids differ, one `PixelMapping` is
+    applied to every channel; otherwise the cube is interpolated in all three
+    dimensions with `FITS_tools.cube_regrid.regrid_cube_hdu`.
+
+    Parameters
+    ----------
+    hd1 : header object
+       The header of the high resolution cube
+    cube2raw : float array
+       The pre-regridded low resolution cube
+    hd2 : header object
+       The header of the low resolution cube
+    shape1 : tuple
+       The shape of the high resolution cube
+    mapping : `PixelMapping` or None
+       A precomputed spatial mapping from ``hd2`` onto ``hd1``.  The
+       spectral channels of the two cubes must then already match.
+
+    Returns
+    -------
+    cube2 : float array
+       The regridded low resolution cube, with shape ``shape1``
+    """
+    from astropy.wcs import WCS
+
+    hd1 = _cube_header(hd1, shape1)
+    hd2 = _cube_header(hd2, cube2raw.shape)
+
+    if cube2raw.shape == tuple(shape1) and WCS(hd1).wcs.compare(WCS(hd2).wcs):
+        return cube2raw
+
+    if mapping is None and _spectral_axes_match(hd1, hd2, shape1,
+                                                cube2raw.shape):
+        mapping = PixelMapping.from_headers(hd2, hd1)
+    if mapping is not None:
+        return mapping.apply(cube2raw)
+
+    hdu2 = fits.PrimaryHDU(data=cube2raw, header=hd2)
+    import FITS_tools
+    return FITS_tools.cube_regrid.regrid_cube_hdu(hdu2, hd1).data
+
+
+def _spectral_axes_match(hd1, hd2, shape1, shape2):
+    """
+    Do two cube headers describe the same spectral channels?
+    """
+    from astropy.wcs import WCS
+    return (shape1[0] == shape2[0] and
+            WCS(hd1).sub([3]).wcs.compare(WCS(hd2).sub([3]).wcs))
+
+
+def _check_spectral_axes(header_hi, header_low, shape_hi, shape_low):
+    """
+    Raise a ValueError unless two cubes have the same spectral channels, as
+    needed to feather them channel block by channel block.
+    """
+    hd1 = _cube_header(header_hi, shape_hi)
+    hd2 = _cube_header(header_low, shape_low)
+    if not _spectral_axes_match(hd1, hd2, shape_hi, shape_low):
+        raise ValueError("The spectral axis of the low resolution cube ({0} "
+                         "channels) does not match that of the high "
+                         "resolution cube ({1} channels).  Spectrally regrid "
+                         "the low resolution cube first (see "
+                         "spectral_regrid).".format(shape_low[0],
+                                                    shape_hi[0]))
+
+
+def _cube_pixel_mapping(header_hi, header_low, shape_hi, shape_low):
+    """
+    The `PixelMapping` of the low resolution cube onto the high resolution
+    one, or ``None`` if the spectral channels differ or no regridding is
+    needed.
+    """
+    from astropy.wcs import WCS
+
+    hd1 = _cube_header(header_hi, shape_hi)
+    hd2 = _cube_header(header_low, shape_low)
+    if not _spectral_axes_match(hd1, hd2, shape_hi, shape_low):
+        return None
+    if tuple(shape_low) == tuple(shape_hi) and WCS(hd1).wcs.compare(WCS(hd2).wcs):
+        return None
+    return PixelMapping.from_headers(hd2, hd1)
+
+
+def feather_cube(hires, lores,
+                 highresextnum=0,
+                 lowresextnum=0,
+                 highresscalefactor=1.0,
+                 lowresscalefactor=1.0, lowresfwhm=1*u.arcmin,
+                 return_hdu=False,
+                 rfft=True, fft_backend=None, kernel_method='fft',
+                 kernel_cache=False, dtype=np.float64):
+    """
+    Fourier combine two spectral cubes.
+
+    The weight kernels depend only on the spatial grid and the low resolution
+    beam, so they are built once and broadcast over every spectral channel,
+    and all channels are transformed together in batched FFTs.
+
+    Parameters
+    ----------
+    hires : `~spectral_cube.SpectralCube`, HDU or str
+        The high-resolution cube
+    lores : `~spectral_cube.SpectralCube`, HDU or str
+        The low-resolution (single-dish) cube.  It is regridded onto the
+        spatial and spectral grid of ``hires`` if necessary.
+    highresextnum : int
+    lowresextnum : int
+        The extension numbers to use from the FITS files
+    highresscalefactor : float
+    lowresscalefactor : float
+        A factor to multiply the high- or low-resolution data by to match the
+        low- or high-resolution data
+    lowresfwhm : `astropy.units.Quantity`
+        The full-width-half-max of the single-dish (low-resolution) beam;
+        or the scale at which you want to try to match the low/high resolution
+        data
+    return_hdu : bool
+        Return an HDU with the header of the high resolution cube instead of
+        just the data cube.
+    rfft : bool
+        Use the real-to-complex FFT engine (see `fftmerge`)
+    fft_backend : None, str or backend instance
+        The FFT backend to use; see `uvcombine.fft_backends.get_fft_backend`.
+    kernel_method : 'fft' or 'analytic'
+        How to construct the weight kernels; see `feather_kernel`.
+    kernel_cache : None, bool or `~uvcombine.cache.KernelCache`
+        Cache the weight kernels; see `feather_kernel`.
+    dtype : dtype
+        The floating-point type of the computation; see `feather_simple`.
+
+    Returns
+    -------
+    combo : array
+        The combined cube
+    combo_hdu : fits.PrimaryHDU
+        (optional) the cube encased in a FITS HDU with the relevant header
+    """
+    cube_hi, header_hi = _cube_in(hires, highresextnum)
+    cube_lowraw, header_low = _cube_in(lores, lowresextnum)
+
+    cube_low = regrid_cube(header_hi, cube_lowraw, header_low, cube_hi.shape)
+
+    import FITS_tools
+    pixscale = FITS_tools.header_tools.header_to_platescale(
+        FITS_tools.strip_headers.flatten_header(header_hi))
+    nax2, nax1 = cube_hi.shape[1:]
+
+    fft = get_fft_backend(fft_backend)
+    kfft, ikfft = feather_kernel(nax2, nax1, lowresfwhm, pixscale, rfft=rfft,
+                                 fft_backend=fft, method=kernel_method,
+                                 cache=kernel_cache, dtype=dtype)
+
+    fftsum, combo = fftmerge(kfft, ikfft, cube_hi, cube_low, rfft=rfft,
+                             fft_backend=fft, dtype=dtype,
+                             highresscalefactor=highresscalefactor,
+                             lowresscalefactor=lowresscalefactor)
+
+    if return_hdu:
+        combo = fits.PrimaryHDU(data=combo.real, header=header_hi)
+
+    return combo
+
+
+def _feather_bytes_per_channel(nax2, nax1, rfft=True, dtype=np.float64,
+                               shape_in=None):
+    """
+    Estimate the peak memory, in bytes, used per channel by `fftmerge` and
+    the regridding of the low-resolution plane, computing in ``dtype``.
+    ``shape_in`` is the (ny, nx) shape of the low-resolution planes if they
+    are regridded with a `PixelMapping`.
+    """
+    itemsize = np.dtype(dtype).itemsize
+    npix = nax2 * nax1
+    nfreq = nax2 * (nax1//2 + 1) if rfft else npix
+    # real planes: the high resolution input, the regridded low-resolution
+    # plane and its bad-pixel mask, the FFT input buffer and the output
+    nreal = 5
+    # complex planes: the two transforms (weighted and summed in place) and
+    # one temporary of the inverse transform
+    ncomplex = 3
+    nbytes = itemsize*nreal*npix + 2*itemsize*ncomplex*nfreq
+    if shape_in is not None:
+        # PixelMapping.apply: the input plane, its bad-pixel mask and
+        # NaN-free copy, then per output pixel the gathered neighbour values
+        # and their weighted product plus the gathered bad-pixel mask
+        npix_in = shape_in[0] * shape_in[1]
+        nbytes += npix_in*(2*itemsize + 1) + npix*(2*itemsize + 1)
+    return nbytes
+
+
+def feather_cube_to_fits(hires, lores, outname,
+                         highresextnum=0,
+                         lowresextnum=0,
+                         highresscalefactor=1.0,
+                         lowresscalefactor=1.0, lowresfwhm=1*u.arcmin,
+                         max_memory=1*u.GB,
+                         overwrite=False,
+                         rfft=True, fft_backend=None, kernel_method='fft',
+                         kernel_cache=False, dtype=np.float64):
+    """
+    Fourier combine two spectral cubes block by block, writing the result to
+    a FITS file as it goes.
+
+    The inputs are memory-mapped and read in blocks of channels.  Each block
+    is feathered like `feather_cube` and appended to ``outname``, so the peak
+    memory is set by ``max_memory`` rather than by the size of the cubes.
+
+    Parameters
+    ----------
+    hires : `~spectral_cube.SpectralCube`, HDU or str
+        The high-resolution cube
+    lores : `~spectral_cube.SpectralCube`, HDU or str
+        The low-resolution (single-dish) cube.  It must have the same spectral
+        channels as ``hires`` (see `spectral_regrid`); it is regridded
+        spatially block by block.
+    outname : str
+        Filename of the .fits output of the combined cube
+    highresextnum : int
+    lowresextnum : int
+        The extension numbers to use from the FITS files
+    highresscalefactor : float
+    lowresscalefactor : float
+        A factor to multiply the high- or low-resolution data by to match the
+        low- or high-resolution data
+    lowresfwhm : `astropy.units.Quantity`
+        The full-width-half-max of the single-dish (low-resolution) beam;
+        or the scale at which you want to try to match the low/high resolution
+        data
+    max_memory : int or `astropy.units.Quantity`
+        The peak working memory to aim for, in bytes if not a quantity.  The
+        number of channels per block is derived from it.
+    overwrite : bool
+        Overwrite ``outname`` if it exists?
+    rfft, fft_backend, kernel_method, kernel_cache :
+        See `feather_cube`.
+    dtype : dtype
+        The floating-point type of the computation and of the output file
+        (BITPIX -32 for ``np.float32``); see `feather_simple`.
+
+    Returns
+    -------
+    outname : str
+        The name of the written file
+    """
+    cube_hi, header_hi = _cube_in(hires, highresextnum, lazy=True)
+    cube_low, header_low = _cube_in(lores, lowresextnum, lazy=True)
+
+    nchan, nax2, nax1 = cube_hi.shape
+    _check_spectral_axes(header_hi, header_low, cube_hi.shape, cube_low.shape)
+
+    import FITS_tools
+    pixscale = FITS_tools.header_tools.header_to_platescale(
+        FITS_tools.strip_headers.flatten_header(header_hi))
+
+    fft = get_fft_backend(fft_backend)
+    kfft, ikfft = feather_kernel(nax2, nax1, lowresfwhm, pixscale, rfft=rfft,
+                                 fft_backend=fft, method=kernel_method,
+                                 cache=kernel_cache, dtype=dtype)
+
+    # the spatial mapping is the same for every block; its interpolation
+    # weights are built up front so that they count towards max_memory
+    mapping = _cube_pixel_mapping(header_hi, header_low, cube_hi.shape,
+                                  cube_low.shape)
+    if mapping is not None:
+        mapping._bilinear_weights()
+
+    nblock = _channels_per_block(max_memory, cube_hi.shape,
+                                 kfft.nbytes + ikfft.nbytes, rfft=rfft,
+                                 dtype=dtype, mapping=mapping)
+    log.debug("Feathering {0} channels in blocks of {1}".format(nchan, nblock))
+
+    dtype = np.dtype(dtype)
+    outheader = _outfits_header(header_hi, cube_hi.shape,
+                                bitpix=-8*dtype.itemsize)
+    stream = outfits_stream(outheader, outname, overwrite=overwrite)
+
+    # one FFT input buffer serves every block
+    buffer = np.empty((nblock, nax2, nax1), dtype=dtype)
+
+    from astropy.utils.console import ProgressBar
+    pb = ProgressBar(nchan)
+    for start in range(0, nchan, nblock):
+        stop = min(start + nblock, nchan)
+
+        combo = _feather_channel_block(cube_hi, header_hi, cube_low,
+                                       header_low, start, stop, kfft, ikfft,
+                                       highresscalefactor=highresscalefactor,
+                                       lowresscalefactor=lowresscalefactor,
+                                       rfft=rfft, fft_backend=fft,
+                                       mapping=mapping, dtype=dtype,
+                                       buffer=buffer)
+
+        stream.write(np.ascontiguousarray(combo,
+                                          dtype=dtype.newbyteorder('>')))
+        pb.update(stop)
+
+    stream.close()
+
+    return outname
+
+
+def _channels_per_block(max_memory, shape, kernel_nbytes, rfft=True,
+                        dtype=np.float64, mapping=None):
+    """
+    The number of channels of a cube of ``shape`` that can be feathered
+    together within ``max_memory`` (bytes or a `~astropy.units.Quantity`),
+    given weight kernels occupying ``kernel_nbytes`` and the `PixelMapping`
+    (if any) regridding the low resolution channels.
+    """
+    nchan, nax2, nax1 = shape
+    if hasattr(max_memory, 'unit'):
+        max_memory = max_memory.to(u.byte).value
+    fixed = kernel_nbytes
+    shape_in = None
+    if mapping is not None:
+        fixed += mapping.nbytes
+        shape_in = mapping.shape_in
+    budget = max_memory - fixed
+    perchannel = _feather_bytes_per_channel(nax2, nax1, rfft=rfft,
+                                            dtype=dtype, shape_in=shape_in)
+    nblock = int(budget // perchannel)
+    if nblock < 1:
+        log.warning("max_memory={0} bytes is smaller than the memory needed "
+                    "for a single channel ({1} bytes); feathering one channel "
+                    "at a time.".format(max_memory, perchannel + fixed))
+        nblock = 1
+    return min(nblock, nchan)
+
+
+def _feather_channel_block(cube_hi, header_hi, cube_low, header_low,
+                           start, stop, kfft, ikfft,
+                           highresscalefactor=1.0, lowresscalefactor=1.0,
+                           rfft=True, fft_backend=None, mapping=None,
+                           dtype=np.float64, buffer=None):
+    """
+    Read channels ``start:stop`` of two (lazily loaded, see `_cube_in`) cubes
+    with matching spectral channels, regrid the low resolution block onto the
+    high resolution grid (with ``mapping``, if given) and feather them.
+    Returns the real combined block, computed in ``dtype``.  ``buffer``, if
+    given, is the FFT input buffer (see `fftmerge`) for at least
+    ``stop-start`` channels.
+    """
+    block_hi = _read_channels(cube_hi, start, stop)
+    block_low = regrid_cube(_shift_spectral_header(header_hi, start),
+                            _read_channels(cube_low, start, stop),
+                            _shift_spectral_header(header_low, start),
+                            block_hi.shape, mapping=mapping)
+
+    if buffer is not None:
+        buffer = buffer[:stop-start]
+    fftsum, combo = fftmerge(kfft, ikfft, block_hi, block_low, rfft=rfft,
+                             fft_backend=fft_backend, dtype=dtype,
+                             highresscalefactor=highresscalefactor,
+                             lowresscalefactor=lowresscalefactor,
+                             buffer=buffer)
+
+    return combo.real
+
+
+def _shift_spectral_header(header, start):
+    """
+    A copy of ``header`` whose spectral axis begins at channel ``start``.
+    """
+    header = header.copy()
+    header['CRPIX3'] = header['CRPIX3'] - start
+    return header
+
+
 def feather_plot(hires, lores,
                  highresextnum=0,
                  lowresextnum=0,
                  highresscalefactor=1.0,
-                 lowresscalefactor=1.0, lowresfwhm=1*u.arcmin
+                 lowresscalefactor=1.0, lowresfwhm=1*u.arcmin,
+                 fft_backend=None,
                 ):
     """
     Plot the power spectra of two images that would be combined
@@ -670,6 +2222,8 @@ def feather_plot(hires, lores,
         The full-width-half-max of the single-dish (low-resolution) beam;
         or the scale at which you want to try to match the low/high resolution
         data
+    fft_backend : None, str or backend instance
+        The FFT backend to use; see `uvcombine.fft_backends.get_fft_backend`.
 
     Returns
     -------
@@ -681,22 +2235,28 @@ def feather_plot(hires, lores,
     hdu_hi, im_hi, header_hi = file_in(hires)
     hdu_low, im_lowraw, header_low = file_in(lores)
 
+    fft = get_fft_backend(fft_backend)
+
+    import image_tools
+    from astropy.utils.console import ProgressBar
+
     pb = ProgressBar(12)
 
     hdu_low, im_low, nax1, nax2, pixscale = regrid(header_hi, im_hi,
                                                    im_lowraw, header_low)
     pb.update()
 
-    kfft, ikfft = feather_kernel(nax2, nax1, lowresfwhm, pixscale)
+    kfft, ikfft = feather_kernel(nax2, nax1, lowresfwhm, pixscale,
+                                 fft_backend=fft)
     pb.update()
     kfft = np.fft.fftshift(kfft)
     pb.update()
     ikfft = np.fft.fftshift(ikfft)
     pb.update()
 
-    fft_hi = np.fft.fftshift(np.fft.fft2(np.nan_to_num(im_hi*highresscalefactor)))
+    fft_hi = np.fft.fftshift(fft.fft2(np.nan_to_num(im_hi*highresscalefactor)))
     pb.update()
-    fft_lo = np.fft.fftshift(np.fft.fft2(np.nan_to_num(im_low*lowresscalefactor)))
+    fft_lo = np.fft.fftshift(fft.fft2(np.nan_to_num(im_low*lowresscalefactor)))
     pb.update()
 
     rad,azavg_kernel = image_tools.radialprofile.azimuthalAverage(np.abs(kfft), returnradii=True)
@@ -767,26 +2327,46 @@ def feather_plot(hires, lores,
 
     return rad, rad_as, azavg_kernel, azavg_ikernel, azavg_lo, azavg_hi, azavg_lo_scaled, azavg_hi_scaled
 
-def spectral_regrid(cube, outgrid):
+def spectral_regrid(cube, outgrid, tile_size=None, outname=None,
+                    dtype=np.float64, overwrite=False):
     """
     Spectrally regrid a cube onto a new spectral output grid
 
     (this is redundant with regrid_cube_hdu, but will work independently if you
     already have spatially matched frames)
 
+    By default the whole cube is read and regridded in memory.  With
+    ``tile_size`` the cube is instead read and regridded in spatial tiles of
+    ``tile_size`` x ``tile_size`` pixels, and with ``outname`` the result is
+    written to a memory-mapped FITS file rather than held in memory, so that
+    cubes larger than RAM can be regridded.
+
     Parameters
     ----------
     cube : SpectralCube
         A SpectralCube object to regrid
     outgrid : array
         An array of the spectral positions to regrid onto
+    tile_size : int or None
+        The size of the spatial tiles to regrid at a time.  ``None`` regrids
+        the whole cube at once, unless ``outname`` is given, in which case it
+        defaults to 256.
+    outname : str or None
+        Filename of a .fits output to write the regridded cube to
+    dtype : dtype
+        The data type of the output cube, e.g. ``np.float32`` to halve its
+        size.  The interpolation itself is always done in double precision.
+    overwrite : bool
+        Overwrite ``outname`` if it exists?
 
     Returns
     -------
     cube : fits.PrimaryHDU
-        An HDU containing the output cube in FITS HDU form
+        An HDU containing the output cube in FITS HDU form.  If ``outname`` is
+        given, its data are memory-mapped from that file.
     """
 
+    from spectral_cube import SpectralCube
     assert isinstance(cube, SpectralCube)
 
     inaxis = cube.spectral_axis.to(outgrid.unit)
@@ -797,11 +2377,11 @@ def spectral_regrid(cube, outgrid):
         outgrid=outgrid[::-1]
         outdiff = np.mean(np.diff(outgrid))
     if indiff < 0:
-        cubedata = cube.filled_data[::-1]
+        spectral_slice = slice(None, None, -1)
         inaxis = cube.spectral_axis.to(outgrid.unit)[::-1]
         indiff = np.mean(np.diff(inaxis))
     else:
-        cubedata = cube.filled_data[:]
+        spectral_slice = slice(None)
     if indiff < 0 or outdiff < 0:
         raise ValueError("impossible.")
 
@@ -815,15 +2395,10 @@ def spectral_regrid(cube, outgrid):
         raise ValueError("Input grid has too small a spacing.  It needs to be "
                          "smoothed prior to resampling.")
 
-    newcube = np.empty([outgrid.size, cube.shape[1], cube.shape[2]])
-
-    yy,xx = np.indices(cube.shape[1:])
-
-    pb = ProgressBar(xx.size)
-    for ix, iy in (zip(xx.flat, yy.flat)):
-        newcube[:,iy,ix] = np.interp(outgrid.value, inaxis.value,
-                                     cubedata[:,iy,ix].value)
-        pb.update()
+    # the interpolation indices and weights are the same for every spectrum,
+    # so they are computed once and applied to the whole cube (or each tile)
+    # at once
+    weights = _spectral_interp_weights(inaxis.value, outgrid.value)
 
     newheader = cube.header
     newheader['CRPIX3'] = 1
@@ -831,34 +2406,189 @@ def spectral_regrid(cube, outgrid):
     newheader['CDELT3'] = outdiff.value
     newheader['CUNIT3'] = outgrid.unit.to_string('FITS')
 
-    return fits.PrimaryHDU(data=newcube, header=newheader)
-
-
-def spectral_smooth_and_downsample(cube, ):
-
-    tbcube_k_smooth = FITS_tools.cube_regrid.spectral_smooth_cube(tpcube_k,
-                                                                  kw/np.sqrt(8*np.log(2)))
-    log.debug("completed cube smooth")
-
-    integer_dsfactor = int(np.floor(kw))
-
-    tpcube_k_ds = tbcube_k_smooth[::integer_dsfactor,:,:]
-    log.debug("downsampled")
-    print(tpcube_k)
-    print(tpcube_k.hdu)
-    tpcube_k.hdu
-    log.debug("did nothing")
-    tpcube_k_ds_hdu = tpcube_k.hdu
-    log.debug("made hdu")
-    tpcube_k_ds_hdu.data = tpcube_k_ds
-    log.debug("put data in hdu")
-    tpcube_k_ds_hdu.header['CRPIX3'] = 1
-    # why min? because we're forcing CDELT3 to be positive, therefore the 0'th channel
-    # must be the reference value.  Since we're using a symmetric kernel to downsample,
-    # the reference channel - wherever we pick it - must stay fixed.
-    tpcube_k_ds_hdu.header['CRVAL3'] = tpcube_k.spectral_axis[0].to(u.Hz).value
-    tpcube_k_ds_hdu.header['CUNIT3'] = tpcube_k.spectral_axis[0].to(u.Hz).unit.to_string('FITS')
-    tpcube_k_ds_hdu.header['CDELT3'] = tpcube_k.wcs.wcs.cdelt[2] * integer_dsfactor
-    log.debug("completed header making")
-    #tpcube_k_ds_hdu.writeto('{0}_tp_freq_ds.fits', clobber=True)
-    #log.debug("wrote kelvin tp downsampled cube")
+    return _spectral_map(cube, lambda data: _spectral_interp(data, weights),
+                         outgrid.size, newheader, tile_size=tile_size,
+                         outname=outname, dtype=dtype, overwrite=overwrite,
+                         spectral_slice=spectral_slice)
+
+
+def _spectral_map(cube, function, nchan, header, tile_size=None,
+                  outname=None, dtype=np.float64, overwrite=False,
+                  spectral_slice=slice(None)):
+    """
+    Apply ``function``, which maps an array of spectra (spectral axis first)
+    to ``nchan`` output channels, to a `~spectral_cube.SpectralCube`, either
+    all at once or in spatial tiles, optionally writing the result into a
+    memory-mapped FITS file.  See `spectral_regrid` for the keywords;
+    ``spectral_slice`` is applied to the spectral axis of the input.
+    """
+    dtype = np.dtype(dtype)
+    shape = (nchan,) + cube.shape[1:]
+
+    if outname is None and tile_size is None:
+        cubedata = cube.filled_data[spectral_slice]
+        newcube = function(cubedata.value)
+        return fits.PrimaryHDU(data=newcube.astype(dtype, copy=False),
+                               header=header)
+
+    if tile_size is None:
+        tile_size = 256
+
+    if outname is None:
+        newcube = np.empty(shape, dtype=dtype)
+    else:
+        outheader = _outfits_header(header, shape,
+                                    bitpix=-8*dtype.itemsize)
+        offset = _outfits_allocate(outheader, outname, overwrite=overwrite)
+        newcube = np.memmap(outname, dtype=dtype.newbyteorder('>'),
+                            mode='r+', offset=offset, shape=shape)
+
+    tiles = [(slice(y0, y0+tile_size), slice(x0, x0+tile_size))
+             for y0 in range(0, shape[1], tile_size)
+             for x0 in range(0, shape[2], tile_size)]
+    from astropy.utils.console import ProgressBar
+    pb = ProgressBar(len(tiles))
+    for tile in tiles:
+        cubedata = cube.filled_data[(spectral_slice,) + tile]
+        newcube[(slice(None),) + tile] = function(cubedata.value)
+        pb.update()
+
+    if outname is None:
+        return fits.PrimaryHDU(data=newcube, header=header)
+
+    newcube.flush()
+    del newcube
+    return fits.open(outname, memmap=True)[0]
+
+
+def _spectral_interp_weights(inaxis, outaxis):
+    """
+    Precompute the linear interpolation from the increasing grid ``inaxis``
+    onto ``outaxis``, with the same conventions (and arithmetic) as
+    `numpy.interp`: values beyond either end take the end value.
+
+    Returns
+    -------
+    weights : tuple
+        ``(index, offset, step, below, above)`` where ``index`` is the input
+        channel at or below each output channel, ``offset`` the distance from
+        it, ``step`` the spacing to the next input channel, and ``below`` /
+        ``above`` flag output channels off either end of the input grid.
+    """
+    inaxis = np.asarray(inaxis)
+    outaxis = np.asarray(outaxis)
+    index = np.searchsorted(inaxis, outaxis, side='right') - 1
+    index = np.clip(index, 0, inaxis.size-2)
+    offset = outaxis - inaxis[index]
+    step = inaxis[index+1] - inaxis[index]
+    below = outaxis < inaxis[0]
+    above = outaxis >= inaxis[-1]
+    return index, offset, step, below, above
+
+
+def _spectral_interp(data, weights, out=None):
+    """
+    Apply weights from `_spectral_interp_weights` along the first axis of
+    ``data``, equivalent to `numpy.interp` on every spectrum.
+    """
+    index, offset, step, below, above = weights
+    extra = (slice(None),) + (None,) * (data.ndim - 1)
+
+    lower = data[index]
+    if out is None:
+        out = np.empty(lower.shape, dtype=np.result_type(lower, np.float64))
+    # (fp[j+1]-fp[j])/(xp[j+1]-xp[j])*(x-xp[j]) + fp[j], as in numpy.interp
+    np.subtract(data[index+1], lower, out=out)
+    out /= step[extra]
+    out *= offset[extra]
+    out += lower
+    # channels that coincide with an input channel take its value exactly,
+    # so that a NaN in the next channel does not spread
+    out[offset == 0] = lower[offset == 0]
+    out[below] = data[0]
+    out[above] = data[-1]
+    return out
+
+
+def spectral_smooth_and_downsample(cube, kernelwidth, dsfactor=None,
+                                   tile_size=None, outname=None,
+                                   dtype=np.float64, overwrite=False):
+    """
+    Smooth a cube spectrally with a Gaussian and downsample it, keeping every
+    ``dsfactor``'th channel starting from the first.
+
+    Only the channels that are kept are computed: each output channel is the
+    kernel-weighted sum of its neighbouring input channels, accumulated one
+    kernel tap at a time over strided views of the input.  The cost is
+    therefore that of smoothing the downsampled cube, rather than smoothing
+    the full resolution cube and discarding most of it.  NaNs and the ends of
+    the spectral axis are excluded from the sums and the weights are
+    renormalized over the remaining channels.
+
+    Parameters
+    ----------
+    cube : SpectralCube
+        A SpectralCube object to smooth and downsample
+    kernelwidth : float
+        The full-width-half-max of the Gaussian smoothing kernel, in channels
+    dsfactor : int or None
+        The downsampling factor.  Defaults to ``floor(kernelwidth)``.
+    tile_size, outname, dtype, overwrite :
+        See `spectral_regrid`.
+
+    Returns
+    -------
+    cube : fits.PrimaryHDU
+        An HDU containing the smoothed and downsampled cube
+    """
+
+    from spectral_cube import SpectralCube
+    assert isinstance(cube, SpectralCube)
+
+    if dsfactor is None:
+        dsfactor = int(np.floor(kernelwidth))
+    if dsfactor < 1:
+        raise ValueError("The downsampling factor must be at least 1.")
+
+    nchan_in = cube.shape[0]
+    nchan = len(range(0, nchan_in, dsfactor))
+
+    sigma = kernelwidth / np.sqrt(8*np.log(2))
+    half = int(np.ceil(4*sigma))
+    taps = np.arange(-half, half+1)
+    kernel = np.exp(-0.5 * (taps / sigma)**2)
+    kernel /= kernel.sum()
+
+    def smooth_and_downsample(data):
+        valid = np.isfinite(data)
+        data = np.where(valid, data, 0)
+        extra = (slice(None),) * (data.ndim - 1)
+        total = np.zeros((nchan,) + data.shape[1:])
+        weight = np.zeros_like(total)
+        for tap, tapweight in zip(taps, kernel):
+            # output channels whose input channel k*dsfactor+tap exists
+            first = max(0, -(tap // dsfactor))
+            last = min(nchan, (nchan_in - 1 - tap) // dsfactor + 1)
+            if last <= first:
+                continue
+            channels = slice(first*dsfactor + tap,
+                             (last-1)*dsfactor + tap + 1, dsfactor)
+            total[first:last] += tapweight * data[(channels,) + extra]
+            weight[first:last] += tapweight * valid[(channels,) + extra]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            total /= weight
+        return total
+
+    newheader = cube.header
+    # Since we're using a symmetric kernel centered on the kept channels, the
+    # world coordinate of input channel k*dsfactor is that of output channel
+    # k: pixel p (1-based) maps to output pixel (p-1)/dsfactor + 1
+    newheader['CRPIX3'] = (newheader['CRPIX3'] - 1) / dsfactor + 1
+    if 'CD3_3' in newheader:
+        newheader['CD3_3'] = newheader['CD3_3'] * dsfactor
+    else:
+        newheader['CDELT3'] = newheader.get('CDELT3', 1.0) * dsfactor
+
+    return _spectral_map(cube, smooth_and_downsample, nchan, newheader,
+                         tile_size=tile_size, outname=outname, dtype=dtype,
+                         overwrite=overwrite)